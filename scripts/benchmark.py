@@ -0,0 +1,450 @@
+#! /usr/bin/env /usr/bin/python3
+
+#  benchmark.py
+#
+#  Copyright (c) 2026 agent
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#  or visit https://www.gnu.org/licenses/gpl-3.0-standalone.html
+#
+benchmark_copyright = 'benchmark.py Copyright (c) 2026 agent ' + \
+                      'released under GNU GPL V3.0'
+
+import os
+import sys
+import json
+import time
+import getopt
+import socket
+import resource
+import datetime
+import subprocess
+import concurrent.futures
+
+import numpy as np
+from netCDF4 import Dataset
+
+from eto_FAO import eto
+from merge import merge
+from filter import filterWRF
+
+## @file      benchmark.py
+## @brief     Time the eto_FAO.py, merge.py and filter.py hot paths on
+##            synthetic WRF output files of several grid sizes.
+## @author    agent
+## @copyright Copyright (c) 2026 agent. All Rights Reserved.
+## @license   Released under GNU General Public License V3.0
+## @results   benchmark history JSON file
+
+# The synthetic files have the WRF variable names, dimensions, variable
+# and global attributes the scripts use, with plausible value ranges;
+# the numbers are random, only the cost is of interest.
+#
+# Each case runs in a fresh process so its peak RSS is its own. Bytes
+# read and written are the process' file I/O from /proc/self/io (Linux).
+# Every run is appended to the history file and compared with the
+# previous run of the same case.
+
+# print functions to reduce clutter and to flush output
+def eprint( *args ):
+    print( *args, file=sys.stderr, flush=True)
+
+def oprint( *args ):
+    print( *args, file=sys.stdout, flush=True)
+
+class wrfout():
+
+    # value ranges of the variables written
+    RANGES = { 'TSK':(270.0,310.0),
+               'EMISS':(0.9,0.99),
+               'SWDOWN':(0.0,1000.0),
+               'GLW':(250.0,420.0),
+               'GRDFLX':(-100.0,100.0),
+               'T2':(270.0,305.0),
+               'PSFC':(60000.0,101000.0),
+               'Q2':(0.002,0.02),
+               'U10':(-8.0,8.0),
+               'V10':(-8.0,8.0),
+               'RAINC':(0.0,2.0),       # accumulated
+               'RAINNC':(0.0,2.0),      # accumulated
+               'SFCEVP':(0.0,0.3),      # accumulated
+               'SMOIS':(0.0,0.5) }      # soil layers
+
+    ## @param path - output file
+    ## @param ny, nx - south_north, west_east grid size
+    ## @param nt - number of hourly frames
+    ## @param seed - random seed
+    def __init__( self, path, ny, nx, nt=25, seed=0 ):
+
+        self.path = path
+        self.ny = ny
+        self.nx = nx
+        self.nt = nt
+        self.rng = np.random.default_rng( seed )
+
+        self.start = datetime.datetime( 2022, 5, 1, 6 )
+
+    def add_var( self, ds, name, dims, description, units, stagger='' ):
+
+        var = ds.createVariable( name, 'f4', dims )
+        var.FieldType = np.int32( 104 )
+        var.MemoryOrder = 'XYZ' if len( dims ) == 4 else 'XY '
+        var.description = description
+        var.units = units
+        var.stagger = stagger
+        var.coordinates = 'XLONG XLAT XTIME'
+
+        return var
+
+    # make it so
+    def run( self ):
+
+        ds = Dataset( self.path, 'w', format='NETCDF3_64BIT_OFFSET' )
+        ny, nx, nt = self.ny, self.nx, self.nt
+
+        ds.createDimension( 'Time', None )
+        ds.createDimension( 'DateStrLen', 19 )
+        ds.createDimension( 'west_east', nx )
+        ds.createDimension( 'south_north', ny )
+        ds.createDimension( 'west_east_stag', nx+1 )
+        ds.createDimension( 'south_north_stag', ny+1 )
+        ds.createDimension( 'soil_layers_stag', 4 )
+
+        ds.setncattr( 'TITLE', ' OUTPUT FROM WRF V4.2.1 MODEL' )
+        ds.setncattr( 'SIMULATION_START_DATE',
+                      self.start.strftime( '%Y-%m-%d_%H:%M:%S' ) )
+        ds.setncattr( 'WEST-EAST_GRID_DIMENSION', np.int32( nx+1 ) )
+        ds.setncattr( 'SOUTH-NORTH_GRID_DIMENSION', np.int32( ny+1 ) )
+        ds.setncattr( 'DX', np.float32( 3333.333 ) )
+        ds.setncattr( 'DY', np.float32( 3333.333 ) )
+        ds.setncattr( 'GRIDTYPE', 'C' )
+        for attr in [ 'WEST-EAST_PATCH_START_UNSTAG',
+                      'SOUTH-NORTH_PATCH_START_UNSTAG',
+                      'WEST-EAST_PATCH_START_STAG',
+                      'SOUTH-NORTH_PATCH_START_STAG' ]:
+            ds.setncattr( attr, np.int32( 1 ) )
+        ds.setncattr( 'WEST-EAST_PATCH_END_UNSTAG', np.int32( nx ) )
+        ds.setncattr( 'WEST-EAST_PATCH_END_STAG', np.int32( nx+1 ) )
+        ds.setncattr( 'SOUTH-NORTH_PATCH_END_UNSTAG', np.int32( ny ) )
+        ds.setncattr( 'SOUTH-NORTH_PATCH_END_STAG', np.int32( ny+1 ) )
+        ds.setncattr( 'CEN_LAT', np.float32( -1.5 ) )
+        ds.setncattr( 'CEN_LON', np.float32( -78.5 ) )
+        ds.setncattr( 'TRUELAT1', np.float32( -1.5 ) )
+        ds.setncattr( 'TRUELAT2', np.float32( -1.5 ) )
+        ds.setncattr( 'MOAD_CEN_LAT', np.float32( -1.5 ) )
+        ds.setncattr( 'STAND_LON', np.float32( -78.5 ) )
+        ds.setncattr( 'POLE_LAT', np.float32( 90.0 ) )
+        ds.setncattr( 'POLE_LON', np.float32( 0.0 ) )
+        ds.setncattr( 'GMT', np.float32( self.start.hour ) )
+        ds.setncattr( 'JULYR', np.int32( self.start.year ) )
+        ds.setncattr( 'JULDAY', np.int32( self.start.timetuple().tm_yday ) )
+        ds.setncattr( 'MAP_PROJ', np.int32( 3 ) )
+        ds.setncattr( 'MAP_PROJ_CHAR', 'Mercator' )
+
+        times = ds.createVariable( 'Times', 'S1', ('Time','DateStrLen') )
+        for i in range( nt ):
+            t = self.start + datetime.timedelta( hours=i )
+            times[i] = np.frombuffer( t.strftime( '%Y-%m-%d_%H:%M:%S' ).encode(),
+                                      'S1' )
+
+        # regular lat/long grid around the center
+        spacing = 0.03
+        lat = -1.5 + spacing*( np.arange( ny ) - ny/2.0 )
+        lon = -78.5 + spacing*( np.arange( nx ) - nx/2.0 )
+
+        xlat = self.add_var( ds, 'XLAT', ('Time','south_north','west_east'),
+                             'LATITUDE, SOUTH IS NEGATIVE', 'degree_north' )
+        xlong = self.add_var( ds, 'XLONG', ('Time','south_north','west_east'),
+                              'LONGITUDE, WEST IS NEGATIVE', 'degree_east' )
+
+        for i in range( nt ):
+            xlat[i] = np.repeat( lat[:,np.newaxis], nx, axis=1 )
+            xlong[i] = np.repeat( lon[np.newaxis,:], ny, axis=0 )
+
+        for name in self.RANGES:
+
+            if name == 'SMOIS':
+                var = self.add_var( ds, name,
+                                    ('Time','soil_layers_stag',
+                                     'south_north','west_east'),
+                                    'SOIL MOISTURE', 'm3 m-3', 'Z' )
+                shape = ( 4, ny, nx )
+            else:
+                var = self.add_var( ds, name,
+                                    ('Time','south_north','west_east'),
+                                    name, '-' )
+                shape = ( ny, nx )
+
+            low, high = self.RANGES[name]
+            total = np.zeros( shape, dtype=np.float32 )
+
+            # one frame at a time, bounded memory on large grids
+            for i in range( nt ):
+
+                frame = self.rng.uniform( low, high, shape ).astype( np.float32 )
+
+                if name in [ 'RAINC', 'RAINNC', 'SFCEVP' ]:
+                    if i > 0:
+                        total += frame
+                    frame = total
+
+                var[i] = frame
+
+        # a staggered variable, as in WRF output
+        var = self.add_var( ds, 'U', ('Time','south_north','west_east_stag'),
+                            'x-wind component', 'm s-1', 'X' )
+        for i in range( nt ):
+            var[i] = self.rng.uniform( -8.0, 8.0, ( ny, nx+1 ) ).astype( np.float32 )
+
+        ds.close()
+
+# end class wrfout
+
+# --------------------------------------------------------------------
+
+wrfname = 'wrfout_d03_2022-05-01_06-00-00'
+
+# file I/O of this process so far, or None if not available
+def read_io():
+
+    try:
+        with open( '/proc/self/io', 'r' ) as f:
+            counts = dict( line.split( ':' ) for line in f )
+    except OSError:
+        return None
+
+    return int( counts['rchar'] ), int( counts['wchar'] )
+
+# run one case, in its own process; returns its measurements
+def run_case( case, workdir, engine ):
+
+    wrf_path = workdir + '/' + wrfname
+    eto_path = workdir + '/ETo_FAO_' + wrfname + '.npy'
+
+    if case == 'eto':
+        oper = eto( False, wrf_path, workdir, None, engine=engine )
+        run = oper.read_and_run
+
+    elif case == 'merge':
+
+        # the ETo input is made beforehand, see main
+        oper = merge( wrf_path, eto_path, workdir + '/smv.nc', False )
+        run = oper.run
+
+    elif case == 'filter':
+        oper = filterWRF( wrf_path, workdir + '/filtered.nc' )
+        run = oper.run
+
+    else:
+        raise ValueError( 'unknown case: ' + str(case) )
+
+    io_start = read_io()
+    start = time.perf_counter()
+
+    run()
+
+    wall = time.perf_counter() - start
+    io_end = read_io()
+
+    result = { 'wall':wall,
+               'maxrss':resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss*1024,
+               'read':None,
+               'written':None }
+
+    if io_start != None and io_end != None:
+        result['read'] = io_end[0] - io_start[0]
+        result['written'] = io_end[1] - io_start[1]
+
+    return result
+
+# run a case in a fresh process
+def measure( case, workdir, engine ):
+
+    with concurrent.futures.ProcessPoolExecutor( 1 ) as pool:
+        return pool.submit( run_case, case, workdir, engine ).result()
+
+# commit of the scripts, if in a git tree
+def get_commit():
+
+    try:
+        here = os.path.dirname( os.path.abspath( __file__ ) )
+        return subprocess.check_output( [ 'git', 'rev-parse', '--short', 'HEAD' ],
+                                        cwd=here,
+                                        stderr=subprocess.DEVNULL ).decode().strip()
+    except ( OSError, subprocess.CalledProcessError ):
+        return None
+
+def read_history( path ):
+
+    if not os.path.isfile( path ):
+        return []
+
+    with open( path, 'r' ) as f:
+        return json.load( f )
+
+# last recorded result of a case, or None
+def previous( history, case, size, engine ):
+
+    for run in reversed( history ):
+        for result in run['results']:
+            if result['case'] == case and result['size'] == size and \
+               result['engine'] == engine:
+                return result
+
+    return None
+
+# command line options
+def usage():
+    eprint('usage: benchmark.py -h -g sizes -c cases -e engine -n N -w workdir -o history')
+    eprint('       benchmark.py --help --sizes=sizes --cases=cases --engine=engine --repeat=N --workdir=workdir --history=history')
+    eprint('       sizes are square grid sizes, default 172,250,500,1000')
+    eprint('       cases from eto,merge,filter (default all)')
+    eprint('       engine is the ETo engine, fused (default), batch or hourly')
+    eprint('       --repeat runs each case N times, the fastest is kept (default 1)')
+    eprint('       synthetic WRF files are kept in workdir for reuse')
+    eprint('       (default ./benchmark); results are appended to the')
+    eprint('       history file (default ./benchmark.json)')
+
+# end usage
+
+def read_args( argv ):
+
+    options = { 'sizes':[ 172, 250, 500, 1000 ],
+                'cases':[ 'eto', 'merge', 'filter' ],
+                'engine':'fused',
+                'repeat':1,
+                'workdir':'./benchmark',
+                'history':'./benchmark.json' }
+
+    try:
+        opts, args = getopt.getopt( argv,
+                                    'hg:c:e:n:w:o:',
+                                    ['help','sizes=','cases=','engine=',
+                                     'repeat=','workdir=','history='])
+    except getopt.GetoptError:
+        eprint('unknown command arguments')
+        usage()
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ( '-h', '--help' ):
+            usage()
+            sys.exit(0)
+
+        elif opt in ( '-g', '--sizes' ):
+            try:
+                options['sizes'] = [ int(s) for s in arg.split( ',' ) ]
+            except ValueError:
+                options['sizes'] = []
+            if len( options['sizes'] ) == 0 or min( options['sizes'] ) < 2:
+                eprint('sizes must be comma separated integers > 1')
+                usage()
+                sys.exit(2)
+
+        elif opt in ( '-c', '--cases' ):
+            options['cases'] = arg.split( ',' )
+            for case in options['cases']:
+                if case not in [ 'eto', 'merge', 'filter' ]:
+                    eprint('unknown case:', case)
+                    usage()
+                    sys.exit(2)
+
+        elif opt in ( '-e', '--engine' ):
+            if arg not in [ 'fused', 'batch', 'hourly' ]:
+                eprint('unknown engine:', arg)
+                usage()
+                sys.exit(2)
+            options['engine'] = arg
+
+        elif opt in ( '-n', '--repeat' ):
+            try:
+                options['repeat'] = int( arg )
+            except ValueError:
+                options['repeat'] = 0
+            if options['repeat'] < 1:
+                eprint('repeat must be a positive integer')
+                usage()
+                sys.exit(2)
+
+        elif opt in ( '-w', '--workdir' ):
+            options['workdir'] = arg
+
+        elif opt in ( '-o', '--history' ):
+            options['history'] = arg
+
+    return options
+
+# end read_args
+
+if __name__ == '__main__':
+
+    options = read_args( sys.argv[1:] )
+    history = read_history( options['history'] )
+
+    run = { 'date':datetime.datetime.now().isoformat( timespec='seconds' ),
+            'host':socket.gethostname(),
+            'commit':get_commit(),
+            'results':[] }
+
+    for size in options['sizes']:
+
+        workdir = options['workdir'] + '/%dx%d' % ( size, size )
+        os.makedirs( workdir, exist_ok=True )
+
+        wrf_path = workdir + '/' + wrfname
+        if not os.path.isfile( wrf_path ):
+            eprint('making synthetic WRF file', wrf_path + '.')
+            wrfout( wrf_path + '.part', size, size ).run()
+            os.replace( wrf_path + '.part', wrf_path )
+
+        # merge reads the ETo file, make it if the eto case does not
+        if 'merge' in options['cases'] and 'eto' not in options['cases']:
+            run_case( 'eto', workdir, options['engine'] )
+
+        for case in [ 'eto', 'merge', 'filter' ]:
+            if case not in options['cases']:
+                continue
+
+            best = None
+            for i in range( options['repeat'] ):
+                result = measure( case, workdir, options['engine'] )
+                if best == None or result['wall'] < best['wall']:
+                    best = result
+
+            best.update( { 'case':case,
+                           'size':[ size, size ],
+                           'engine':options['engine'] } )
+
+            line = '%-6s %4dx%-4d %8.3f s %8.1f MB rss' % \
+                   ( case, size, size, best['wall'], best['maxrss']/2**20 )
+            if best['read'] != None:
+                line += ' %8.1f MB read %8.1f MB written' % \
+                        ( best['read']/2**20, best['written']/2**20 )
+
+            last = previous( history, case, best['size'], options['engine'] )
+            if last != None:
+                line += '  (%+.0f%% time, %+.0f%% rss)' % \
+                        ( 100.0*( best['wall']/last['wall'] - 1.0 ),
+                          100.0*( best['maxrss']/last['maxrss'] - 1.0 ) )
+
+            oprint( line )
+            run['results'].append( best )
+
+    history.append( run )
+    with open( options['history'] + '.part', 'w' ) as f:
+        json.dump( history, f, indent=1 )
+    os.replace( options['history'] + '.part', options['history'] )
+
+# end benchmark.py
@@ -0,0 +1,357 @@
+#! /usr/bin/env /usr/bin/python3
+
+#  blockzip.py
+#
+#  Copyright (c) 2026 agent
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#  or visit https://www.gnu.org/licenses/gpl-3.0-standalone.html
+#
+blockzip_copyright = 'blockzip.py Copyright (c) 2026 agent ' + \
+                     'released under GNU GPL V3.0'
+
+import os
+import bz2
+import sys
+import gzip
+import zlib
+import lzma
+import time
+import getopt
+import tarfile
+import collections
+import concurrent.futures
+
+## @file      blockzip.py
+## @brief     Multi-core block compression of the daily tarballs: the tar
+##            stream is cut into blocks compressed on a thread pool, each
+##            written as an independent gzip member (or bz2, xz, zstd
+##            stream), so the result is a standard, concatenated stream.
+## @author    agent
+## @copyright Copyright (c) 2026 agent. All Rights Reserved.
+## @license   Released under GNU General Public License V3.0
+## @results   <name>.tar.gz (or .tar.bz2, .tar.xz, .tar.zst)
+
+# gzip -d, tar xzf, python's gzip module and tarfile's random access
+# mode ('r:gz') read multi-member gzip files as one stream; likewise
+# concatenated bz2, xz and zstd streams. tarfile's stream mode ('r|gz',
+# 'r|*') reads only the first member and fails, use tarstream.
+# zlib, bz2 and lzma release the GIL while compressing, so threads run
+# the blocks on separate cores. Larger blocks compress slightly better,
+# each member restarts the dictionary.
+
+# print functions to reduce clutter and to flush output
+def eprint( *args ):
+    print( *args, file=sys.stderr, flush=True)
+
+def oprint( *args ):
+    print( *args, file=sys.stdout, flush=True)
+
+# default block size, bytes
+BLOCKSIZE = 4*1024*1024
+
+def gzip_block( data, level ):
+    c = zlib.compressobj( level, zlib.DEFLATED, 31 )   # 31: gzip header
+    return c.compress( data ) + c.flush()
+
+def bz2_block( data, level ):
+    return bz2.compress( data, level )
+
+def xz_block( data, level ):
+    return lzma.compress( data, preset=level )
+
+# codec: ( file suffix, block compressor, default level )
+CODECS = { 'gzip':( '.gz', gzip_block, 6 ),
+           'bz2':( '.bz2', bz2_block, 9 ),
+           'xz':( '.xz', xz_block, 6 ) }
+
+# codec: ( leading magic bytes, binary file reader of concatenated streams )
+READERS = { 'gzip':( b'\x1f\x8b', lambda path: gzip.open( path, 'rb' ) ),
+            'bz2':( b'BZh', lambda path: bz2.open( path, 'rb' ) ),
+            'xz':( b'\xfd7zXZ\x00', lambda path: lzma.open( path, 'rb' ) ) }
+
+# codec: decompressor of one block
+DECOMPRESSORS = { 'gzip':lambda data: zlib.decompress( data, 31 ),
+                  'bz2':bz2.decompress,
+                  'xz':lzma.decompress }
+
+# zstd where the runtime has it
+try:
+    import zstandard
+
+    def zstd_block( data, level ):
+        return zstandard.ZstdCompressor( level=level ).compress( data )
+
+    CODECS['zstd'] = ( '.zst', zstd_block, 3 )
+    DECOMPRESSORS['zstd'] = zstandard.ZstdDecompressor().decompress
+    READERS['zstd'] = ( b'\x28\xb5\x2f\xfd',
+                        lambda path: zstandard.ZstdDecompressor().stream_reader(
+                            open( path, 'rb' ), read_across_frames=True,
+                            closefd=True ) )
+
+except ImportError:
+    pass
+
+class blockwriter():
+
+    ## @param fileobj - binary file to write the compressed stream to
+    ## @param codec - one of CODECS
+    ## @param level - compression level, default per codec
+    ## @param threads - compressing threads, default the cores
+    ## @param blocksize - bytes compressed per block
+    def __init__( self, fileobj, codec='gzip', level=None, threads=None,
+                  blocksize=BLOCKSIZE ):
+
+        if codec not in CODECS:
+            raise ValueError( 'unknown codec: ' + str( codec ) )
+
+        self.fileobj = fileobj
+        self.compress = CODECS[codec][1]
+        self.level = level
+        if level == None:
+            self.level = CODECS[codec][2]
+
+        if threads == None:
+            threads = os.cpu_count()
+        self.threads = max( 1, threads )
+        self.blocksize = blocksize
+
+        self.pool = concurrent.futures.ThreadPoolExecutor( self.threads )
+        self.pending = collections.deque()   # compressing, in file order
+        self.buf = bytearray()
+
+        self.raw = 0          # bytes in
+        self.written = 0      # bytes out
+
+        # [ raw offset, raw bytes, compressed offset, compressed bytes ]
+        # of each block written, for seeking readers
+        self.blocks = []
+        self.submitted = 0    # raw bytes submitted
+
+    def write( self, data ):
+
+        self.buf += data
+        self.raw += len( data )
+
+        while len( self.buf ) >= self.blocksize:
+            block = bytes( self.buf[:self.blocksize] )
+            del self.buf[:self.blocksize]
+            self.submit( block )
+
+        return len( data )
+
+    # end the current block here, eg. at a boundary a reader seeks to
+    def cut( self ):
+
+        if len( self.buf ) > 0:
+            self.submit( bytes( self.buf ) )
+            self.buf = bytearray()
+
+    # bytes buffered for the current block
+    def buffered( self ):
+        return len( self.buf )
+
+    # compress a block, keeping at most two per thread in memory
+    def submit( self, block ):
+
+        future = self.pool.submit( self.compress, block, self.level )
+        self.pending.append( ( self.submitted, len( block ), future ) )
+        self.submitted += len( block )
+
+        while len( self.pending ) > 2*self.threads:
+            self.drain()
+
+    # write the oldest block
+    def drain( self ):
+
+        start, size, future = self.pending.popleft()
+        data = future.result()
+        self.fileobj.write( data )
+        self.blocks.append( [ start, size, self.written, len( data ) ] )
+        self.written += len( data )
+
+    # flush the last block; the file object is left open
+    def close( self ):
+
+        if len( self.buf ) > 0 or self.raw == 0:
+            self.submit( bytes( self.buf ) )
+            self.buf = bytearray()
+
+        while len( self.pending ) > 0:
+            self.drain()
+
+        self.pool.shutdown()
+
+# end class blockwriter
+
+## Sequential, no seek, reader of a tarball written by tarball(), or any
+## compressed or plain tar file: the compressed streams are decompressed
+## as one, then read by tarfile in stream mode.
+##   with tarstream( path ) as tar:
+##       for member in tar: ...
+class tarstream():
+
+    def __init__( self, path ):
+
+        with open( path, 'rb' ) as f:
+            magic = f.read( 8 )
+
+        self.fileobj = None
+        for prefix, reader in READERS.values():
+            if magic.startswith( prefix ):
+                self.fileobj = reader( path )
+        if self.fileobj == None:
+            self.fileobj = open( path, 'rb' )     # plain tar
+
+        try:
+            self.tar = tarfile.open( fileobj=self.fileobj, mode='r|' )
+        except:
+            self.fileobj.close()
+            raise
+
+    def __enter__( self ):
+        return self.tar
+
+    def __exit__( self, *args ):
+        self.close()
+
+    def close( self ):
+        self.tar.close()
+        self.fileobj.close()
+
+# end class tarstream
+
+# --------------------------------------------------------------------
+
+# file suffix of a codec's tarballs, eg. '.tar.gz'
+def tar_suffix( codec ):
+    return '.tar' + CODECS[codec][0]
+
+## tar a directory or file, like tar cfz path srcpath, compressing blocks
+## on threads; written under a temporary name then renamed
+## @param arcname - name in the archive, default the base name of srcpath
+## @return { 'raw':tar bytes, 'stored':compressed bytes, 'seconds':wall time }
+def tarball( path, srcpath, codec='gzip', level=None, threads=None,
+             blocksize=BLOCKSIZE, arcname=None ):
+
+    if arcname == None:
+        arcname = os.path.basename( os.path.normpath( srcpath ) )
+
+    start = time.time()
+    part = path + '.part'
+    with open( part, 'wb' ) as f:
+        writer = blockwriter( f, codec, level, threads, blocksize )
+        with tarfile.open( fileobj=writer, mode='w|' ) as tar:
+            tar.add( srcpath, arcname=arcname )
+        writer.close()
+    os.replace( part, path )
+
+    return { 'raw':writer.raw,
+             'stored':writer.written,
+             'seconds':time.time() - start }
+
+# report line of tarball() statistics
+def report( codec, stats ):
+
+    seconds = max( stats['seconds'], 1e-9 )
+    ratio = stats['raw']/float( max( stats['stored'], 1 ) )
+    return '%-5s %10.1f MB -> %10.1f MB  ratio %5.2f  %7.1f MB/s  %7.2f s' % \
+           ( codec, stats['raw']/1e6, stats['stored']/1e6, ratio,
+             stats['raw']/1e6/seconds, stats['seconds'] )
+
+# command line options
+def usage():
+    eprint('usage: blockzip.py -h -c codecs -l level -t threads -b MB -o outdir source')
+    eprint('       blockzip.py --help --codecs=codecs --level=level --threads=threads --blocksize=MB --outdir=outdir source')
+    eprint('       tars source (a directory or file) with each codec, eg.')
+    eprint('       gzip,xz, and reports throughput, ratio and wall time')
+    eprint('       codecs here: ' + ','.join( sorted( CODECS ) ) +
+           ' (default all)')
+    eprint('       --threads defaults to the cores (%d)' % os.cpu_count() )
+    eprint('       --blocksize defaults to %d MB' % ( BLOCKSIZE//( 1024*1024 ) ) )
+    eprint('       --outdir defaults to the current directory')
+
+def read_args( argv ):
+
+    options = { 'codecs':sorted( CODECS ),
+                'level':None,
+                'threads':None,
+                'blocksize':BLOCKSIZE,
+                'outdir':'.' }
+
+    try:
+        opts, args = getopt.getopt( argv, 'hc:l:t:b:o:',
+                                    ['help','codecs=','level=','threads=',
+                                     'blocksize=','outdir='] )
+    except getopt.GetoptError:
+        eprint('unknown command arguments')
+        usage()
+        sys.exit(2)
+
+    try:
+        for opt, arg in opts:
+            if opt in ( '-h', '--help' ):
+                usage()
+                sys.exit(0)
+
+            elif opt in ( '-c', '--codecs' ):
+                options['codecs'] = arg.split( ',' )
+                for codec in options['codecs']:
+                    if codec not in CODECS:
+                        raise ValueError( 'codec not available: ' + codec )
+
+            elif opt in ( '-l', '--level' ):
+                options['level'] = int( arg )
+
+            elif opt in ( '-t', '--threads' ):
+                options['threads'] = int( arg )
+                if options['threads'] < 1:
+                    raise ValueError( 'threads must be a positive integer' )
+
+            elif opt in ( '-b', '--blocksize' ):
+                options['blocksize'] = int( float( arg )*1024*1024 )
+                if options['blocksize'] < 1:
+                    raise ValueError( 'blocksize must be positive' )
+
+            elif opt in ( '-o', '--outdir' ):
+                options['outdir'] = arg
+
+    except ValueError as e:
+        eprint( e )
+        usage()
+        sys.exit(2)
+
+    if len( args ) != 1:
+        usage()
+        sys.exit(2)
+
+    return options, args[0]
+
+if __name__ == '__main__':
+
+    options, source = read_args( sys.argv[1:] )
+
+    if not os.path.exists( source ):
+        eprint( source, 'does not exist' )
+        sys.exit(2)
+
+    name = os.path.basename( os.path.normpath( source ) )
+    for codec in options['codecs']:
+        path = options['outdir'] + '/' + name + tar_suffix( codec )
+        stats = tarball( path, source, codec, options['level'],
+                         options['threads'], options['blocksize'] )
+        oprint( report( codec, stats ) )
+
+# end blockzip.py
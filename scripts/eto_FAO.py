@@ -25,14 +25,23 @@ import os
 import sys
 import glob
 import math
+import time
 import struct
 import getopt
+import resource
 import datetime
+import threading
+import tracemalloc
+import concurrent.futures
 
 import numpy as np
-from osgeo import gdal  # uses gdal to read WRF netCDF4 file
-                        # NOTE: GDC and SME packages use netCDF4 module
-                        # instead of gdal
+from netCDF4 import Dataset  # default reader, one open per WRF file
+
+try:
+    from osgeo import gdal   # optional legacy reader, see backend below
+except ImportError:
+    gdal = None
+
 ## @file      eto.py
 ## @brief     Calculate, according to UNs' Food and Agriculture Organization
 ##            (FAO), standard evapotranspiration (ETo) using Weather, 
@@ -55,9 +64,10 @@ from osgeo import gdal  # uses gdal to read WRF netCDF4 file
 # How-to-use:
 
 # - Use data from generic WRF run over an area of interest
-# - Install osgeo, numpy Python3 modules
+# - Install netCDF4, numpy Python3 modules (osgeo only for the gdal backend)
 #   eg.
 #     > pip3 numpy
+#     > pip3 netCDF4
 #     > pip3 osgeo
 
 # - The main program section is geared toward a web server 
@@ -81,10 +91,39 @@ class eto():
     ## @param infile - WRF netCDF4 output file
     ## @param outdir - output directory
     ## @param rundate - data run date (simulation target date)
-    def __init__( self, report, infile, outdir, rundate ):
+    ## @param backend - 'netcdf' (default) or 'gdal' reader
+    ## @param engine - 'fused' (default), 'batch' or 'hourly', see calc_day*
+    ## @param budget - working memory budget in bytes for tile mode;
+    ##                 None processes the whole domain in one block
+    ## @param nthreads - number of threads computing row tiles at once
+    def __init__( self, report, infile, outdir, rundate, backend='netcdf',
+                  engine='fused', budget=None, nthreads=1 ):
 
         self.report = report
         self.rundate = rundate # not used in this version
+
+        # WRF variables needed for ETo, in prep_eto band order
+        self.WRF_VARS = [ 'TSK','EMISS','SWDOWN','GLW','GRDFLX',
+                          'T2','PSFC','Q2','U10','V10' ]
+
+        if backend not in [ 'netcdf', 'gdal' ]:
+            raise ValueError( 'unknown backend: ' + str(backend) )
+
+        if backend == 'gdal' and gdal == None:
+            raise ImportError( 'gdal backend requested but osgeo is not installed' )
+
+        self.backend = backend
+
+        if engine not in [ 'fused', 'batch', 'hourly' ]:
+            raise ValueError( 'unknown engine: ' + str(engine) )
+
+        self.engine = engine
+        self.budget = budget
+        self.nthreads = max( 1, nthreads )
+
+        # netCDF/HDF5 and gdal reads are not thread safe, serialize them;
+        # the numpy work releases the GIL and runs in parallel
+        self.read_lock = threading.Lock()
         
         # tag output numpy file with input data name
         bname = os.path.basename( infile ) 
@@ -92,7 +131,8 @@ class eto():
         self.daily_vars_path = outdir + '/DailyVars_' + bname + '.npy'
         self.infile = infile
 
-        gdal.PushErrorHandler( 'CPLQuietErrorHandler' ) # suppress warning
+        if gdal != None:
+            gdal.PushErrorHandler( 'CPLQuietErrorHandler' ) # suppress warning
 
     ## Calculate mean hourly net radiation
     ## @param Rsd - mean hourly downward shortwave radiation
@@ -484,7 +524,127 @@ class eto():
 
             sink[:,:,i] = data #  stash data in output array
 
-        return sink 
+        return sink
+
+    ## get domain dimensions (south_north, west_east) of WRF file
+    def get_dims( self ):
+
+        if self.backend == 'gdal':
+            ds = gdal.Open( 'NETCDF:"' + self.infile + '":T2' )
+            if ds == None:
+                raise IOError( 'cannot get dataset: T2' )
+            return ds.RasterYSize, ds.RasterXSize
+
+        ds = Dataset( self.infile, 'r' )
+        numy = len( ds.dimensions['south_north'] )
+        numx = len( ds.dimensions['west_east'] )
+        ds.close()
+
+        return numy, numx
+
+    ## read each WRF variable once as a (time,y,x) float32 cube
+    ## returns dictionary of cubes keyed by variable name, plus,
+    ## if reporting, the last SFCEVP frame
+    ## @param window - optional (y0,y1,x0,x1) block, rows north up,
+    ##                 read as a hyperslab; default is the whole domain
+    def read_cube( self, window=None ):
+
+        # variables and time frames to read; None is all frames
+        frames = {}
+        for name in self.WRF_VARS:
+            frames[name] = None
+
+        # no XLAT, XLONG: they do not enter the calculation and the
+        # sector grid cache has them, see gridcache.py
+        if self.report:
+            frames['SFCEVP'] = 24  # accumulated, last hour
+
+        cube = {}
+
+        if self.backend == 'gdal':
+
+            for name in frames:
+                bufstr = 'NETCDF:"' + self.infile + '":' + name
+                ds = gdal.Open( bufstr )
+                if ds == None:
+                    raise IOError( 'cannot get dataset: ' + name )
+
+                if window == None:
+                    y0,y1,x0,x1 = 0, ds.RasterYSize, 0, ds.RasterXSize
+                else:
+                    y0,y1,x0,x1 = window
+
+                if frames[name] == None:
+                    data = ds.ReadAsArray( x0, y0, x1-x0, y1-y0 )
+                else:
+                    band = ds.GetRasterBand( frames[name] + 1 )
+                    data = band.ReadAsArray( x0, y0, x1-x0, y1-y0 )
+
+                cube[name] = data.astype( np.float32, copy=False )
+                ds = None
+
+        else:
+
+            ds = Dataset( self.infile, 'r' )
+            ds.set_auto_mask( False )   # WRF has no fill values
+
+            numy = len( ds.dimensions['south_north'] )
+            numx = len( ds.dimensions['west_east'] )
+
+            if window == None:
+                y0,y1,x0,x1 = 0, numy, 0, numx
+            else:
+                y0,y1,x0,x1 = window
+
+            # gdal's netCDF driver presents rows north up, flip to
+            # match so ETo_FAO_*.npy orientation (and merge.load_eto's
+            # flipud) is the same whichever backend is used
+            rows = slice( numy-y1, numy-y0 )
+            cols = slice( x0, x1 )
+
+            for name in frames:
+                if name not in ds.variables:
+                    ds.close()
+                    raise IOError( '"' + name + '" variable is not in WRF file' )
+
+                wvar = ds.variables[name]
+                if frames[name] == None:
+                    data = wvar[:,rows,cols]
+                else:
+                    data = wvar[frames[name],rows,cols]
+
+                cube[name] = data.astype( np.float32, copy=False )[...,::-1,:]
+
+            ds.close()
+
+        time_steps = cube[ self.WRF_VARS[0] ].shape[0]
+        if time_steps < 25:
+            raise IOError( 'expected 25 time steps, got: ' + str(time_steps) )
+
+        return cube
+
+    ## fill prep_eto source buffer with i-th time slice bookends from cube
+    def cube_source( self, cube, i, source=None ):
+
+        numy,numx = cube['T2'].shape[1:]
+
+        if source is None:
+            source = np.empty( (numy,numx,22), dtype=np.float32 )
+
+        # same band order as the read_and_run band string, ie.
+        # TSK:i,TSK:i+1,EMISS:i,EMISS:i+1,...,V10:i,V10:i+1,XLAT:0,XLONG:0
+        for j, name in enumerate( self.WRF_VARS ):
+            source[:,:,2*j] = cube[name][i]
+            source[:,:,2*j+1] = cube[name][i+1]
+
+        # lat/long only pass through prep_eto, zero unless given
+        for band, name in [ (20,'XLAT'), (21,'XLONG') ]:
+            if name in cube:
+                source[:,:,band] = cube[name]
+            else:
+                source[:,:,band] = 0.0
+
+        return source
 
     # calculate daily variable output values
     # for quality control and analysis
@@ -515,36 +675,21 @@ class eto():
         daily_vars[:,:,4] += eto_vars[:,:,8]/24 # accumulate averaged wind speed
         daily_vars[:,:,5] += eto_vars[:,:,0]    # accumulate net solar rad
 
-    ## Read wrf buffers, generate timeslice parameters and process
-    def read_and_run( self ):
-        #print( 'eto working...' )
+    ## Calculate daily ETo one hourly slice at a time
+    ## with prep_eto and calc_eto (the original engine)
+    ## @param cube - dictionary of WRF variable cubes, see read_cube
+    ## @return daily ETo and, if reporting, daily vars (else None)
+    def calc_day_hourly( self, cube ):
+
+        source = None
+        daily_vars = None
 
-        # generate band input string to extract buffers from wrf netCDF output.
         # bookend entries i, i+1 is for mean hourly value calculation.
-        for i in range(0,24):
-            bandstr =  'TSK:'    + str(i)   + \
-                      ',TSK:'    + str(i+1) + \
-                      ',EMISS:'  + str(i)   + \
-                      ',EMISS:'  + str(i+1) + \
-                      ',SWDOWN:' + str(i)   + \
-                      ',SWDOWN:' + str(i+1) + \
-                      ',GLW:'    + str(i)   + \
-                      ',GLW:'    + str(i+1) + \
-                      ',GRDFLX:' + str(i)   + \
-                      ',GRDFLX:' + str(i+1) + \
-                      ',T2:'     + str(i)   + \
-                      ',T2:'     + str(i+1) + \
-                      ',PSFC:'   + str(i)   + \
-                      ',PSFC:'   + str(i+1) + \
-                      ',Q2:'     + str(i)   + \
-                      ',Q2:'     + str(i+1) + \
-                      ',U10:'    + str(i)   + \
-                      ',U10:'    + str(i+1) + \
-                      ',V10:'    + str(i)   + \
-                      ',V10:'    + str(i+1) + \
-                      ',XLAT:0,XLONG:0'
-
-            source = self.read_wrf( self.infile, bandstr )
+        # (fewer than 24 slices when given a partial day, eg. streaming)
+        nt = min( 24, cube['T2'].shape[0] - 1 )
+        for i in range(0,nt):
+
+            source = self.cube_source( cube, i, source )
             if i == 0:
                 # allocate output buffers now that we know dimensions
                 numy = source.shape[0]
@@ -553,7 +698,7 @@ class eto():
                 if self.report:
                     daily_vars = np.zeros( (numy,numx,8), dtype=np.float32 )
 
-            # source nows holds bandstr bookend 
+            # source nows holds bookend 
             # values for i-th time slice            
             eto_vars = self.prep_eto( source, i ) # prepare variables
                                                   # for eto calculations.
@@ -568,35 +713,520 @@ class eto():
 
         # end hourly for loop
 
-        np.save( self.outfile_path, eto )
-        
+        return eto, daily_vars
+
+    ## mean of time slice bookends, ie. slices i and i+1, for all hours
+    def bookend( self, a ):
+        return 0.5*(a[:-1] + a[1:])
+
+    ## Calculate daily ETo for all 24 hourly slices at once
+    ## the class methods above are elementwise so they are applied
+    ## directly to (24,y,x) arrays; same results as calc_day_hourly
+    ## @param cube - dictionary of WRF variable cubes, see read_cube
+    ## @return daily ETo and, if reporting, daily vars (else None)
+    def calc_day( self, cube ):
+
+        albedo = 0.23    # for short green grass FIXME: make variable
+
+        # hourly means, see prep_eto for variables and units
+        c = {}
+        for name in self.WRF_VARS:
+            c[name] = cube[name][:25]
+
+        tsk = self.bookend( c['TSK'] )
+        emiss = self.bookend( c['EMISS'] )
+        Rsd = self.bookend( c['SWDOWN'] )
+        Rld = self.bookend( c['GLW'] )
+
+        Rn = self.calc_Rn( Rsd, Rld, tsk, emiss, albedo )
+        G = self.bookend( c['GRDFLX'] )/(10**6) * 3600
+
+        Thk = self.bookend( c['T2'] )
+        Thc = Thk - 273.16
+
+        D = self.calc_D( Thc )
+        P = self.bookend( c['PSFC'] )
+        g = self.calc_g( P )
+
+        Q2 = self.bookend( c['Q2'] )
+        es = self.calc_es( Thc )
+        Rh = self.calc_Rh( Q2, Thk, P )
+        ea = es*Rh
+
+        # wind speed pairs bands 16,17 and 18,19 exactly as prep_eto does
+        U2 = self.convert_wind( c['U10'][:-1], 10.0 )
+        V2 = self.convert_wind( c['U10'][1:], 10.0 )
+        WS_start = np.sqrt( U2*U2 + V2*V2 )
+
+        U2 = self.convert_wind( c['V10'][:-1], 10.0 )
+        V2 = self.convert_wind( c['V10'][1:], 10.0 )
+        WS_end = np.sqrt( U2*U2 + V2*V2 )
+
+        w2 = (WS_start + WS_end)/2.0
+
+        # hourly ETo, then daily sum in one reduction
+        hourly = self.calc_et_ref( Rn, G, Thc, D, g, es, ea, w2 )
+        eto = hourly.sum( axis=0, dtype=np.float32 )
+
+        daily_vars = None
+        if self.report:
+            numy,numx = eto.shape
+            daily_vars = np.zeros( (numy,numx,8), dtype=np.float32 )
+
+            # same bands as report_daily_vars
+            daily_vars[:,:,0] = Thc.max( axis=0 )
+            daily_vars[:,:,1] = Thc.min( axis=0 )
+            daily_vars[:,:,2] = Rh.max( axis=0 )
+            daily_vars[:,:,3] = Rh.min( axis=0 )
+            daily_vars[:,:,4] = w2.sum( axis=0, dtype=np.float32 )/24
+            daily_vars[:,:,5] = Rn.sum( axis=0, dtype=np.float32 )
+
+        return eto, daily_vars
+
+    ## Calculate daily ETo for all 24 hourly slices with a fused kernel
+    ## same equations as calc_day but each intermediate is computed once
+    ## into one of seven preallocated float32 (24,y,x) buffers, in place,
+    ## eg. the exponential shared by calc_es and calc_D.
+    ## @param cube - dictionary of WRF variable cubes, see read_cube
+    ## @return daily ETo and, if reporting, daily vars (else None)
+    def calc_day_fused( self, cube ):
+
+        f4 = np.float32  # keep every constant float32, no promotion
+
+        albedo = f4(0.23)    # for short green grass FIXME: make variable
+        sigma = f4(5.67e-8)  # SI stephan-boltzmann equation constant
+        mj = f4(3600.0/10**6) # convert (J/s)/m^2 to MJ/(m^2*hr)
+
+        nt = min( 24, cube['T2'].shape[0] - 1 )  # fewer for a partial day
+        numy,numx = cube['T2'].shape[1:]
+        shape = (nt,numy,numx)
+
+        # work buffers; reused as the calculation proceeds
+        t = np.empty( shape, dtype=f4 )   # Thc, C
+        p = np.empty( shape, dtype=f4 )   # P, then g
+        w = np.empty( shape, dtype=f4 )   # Q2, then w2
+        es = np.empty( shape, dtype=f4 )  # es, then es-ea
+        x1 = np.empty( shape, dtype=f4 )
+        x2 = np.empty( shape, dtype=f4 )
+        x3 = np.empty( shape, dtype=f4 )
+
+        daily_vars = None
+        if self.report:
+            daily_vars = np.zeros( (numy,numx,8), dtype=f4 )
+
+        # mean of time slice bookends into out
+        def bookend( name, out ):
+            a = cube[name]
+            np.add( a[:nt], a[1:nt+1], out=out )
+            out *= f4(0.5)
+            return out
+
+        # net radiation, calc_Rn, into x2
+        bookend( 'TSK', x1 )
+        np.square( x1, out=x1 )
+        np.square( x1, out=x1 )                # tsk**4
+        x1 *= bookend( 'EMISS', x2 )
+        x1 *= sigma                            # Rlu
+
+        bookend( 'SWDOWN', x2 )
+        x2 *= f4(1.0) - albedo
+        x2 += bookend( 'GLW', x3 )
+        x2 -= x1
+        x2 *= mj                               # Rn, MJ/(m^2*hr)
+
+        if self.report:
+            x2.sum( axis=0, dtype=f4, out=daily_vars[:,:,5] )
+
+        # ground flux, then Rn-G in x2
+        bookend( 'GRDFLX', x1 )
+        x1 *= mj
+        x2 -= x1
+
+        # temperatures
+        bookend( 'T2', x1 )                    # Thk
+        np.subtract( x1, f4(273.16), out=t )   # Thc
+
+        if self.report:
+            t.max( axis=0, out=daily_vars[:,:,0] )
+            t.min( axis=0, out=daily_vars[:,:,1] )
+
+        # es, calc_es, and D, calc_D, share one exponential
+        np.add( t, f4(237.3), out=x3 )
+        np.divide( t, x3, out=es )
+        es *= f4(17.27)
+        np.exp( es, out=es )
+        es *= f4(0.6108)                       # es
+
+        np.multiply( x3, x3, out=x3 )
+        np.divide( es, x3, out=x3 )
+        x3 *= f4(4098.0)                       # D
+
+        # relative humidity, calc_Rh, into x1 (holding Thk)
+        bookend( 'PSFC', p )
+        x1 -= f4(35.86)
+        np.divide( t, x1, out=x1 )             # Thk-273.16 is Thc
+        x1 *= f4(17.2693882)
+        np.exp( x1, out=x1 )
+        x1 *= f4(379.90516)
+        x1 /= p
+        np.divide( bookend( 'Q2', w ), x1, out=x1 )
+        np.clip( x1, f4(0.0), f4(1.0), out=x1 ) # Rh
+
+        if self.report:
+            x1.max( axis=0, out=daily_vars[:,:,2] )
+            x1.min( axis=0, out=daily_vars[:,:,3] )
+
+        x1 *= es                               # ea
+        es -= x1                               # es-ea
+        p *= f4(0.000665/1000.0)               # g, calc_g
+
+        # wind speed, convert_wind, paired as prep_eto does
+        factor = f4( 4.87/math.log(67.8*10.0 - 5.42) )
+        np.hypot( cube['U10'][:nt], cube['U10'][1:nt+1], out=w )
+        np.hypot( cube['V10'][:nt], cube['V10'][1:nt+1], out=x1 )
+        w += x1
+        w *= factor*f4(0.5)                    # w2
+
+        if self.report:
+            w.sum( axis=0, dtype=f4, out=daily_vars[:,:,4] )
+            daily_vars[:,:,4] /= f4(24.0)
+
+        # ETo, calc_et_ref, numerator into x2
+        x2 *= f4(0.408)
+        x2 *= x3
+        t += f4(273.16)
+        np.divide( f4(37.0), t, out=t )
+        t *= p
+        t *= w
+        t *= es
+        x2 += t
+
+        # denominator into w
+        w *= f4(0.34)
+        w += f4(1.0)
+        w *= p
+        w += x3
+
+        x2 /= w
+        np.maximum( x2, f4(0.0), out=x2 )      # no negative values
+
+        eto = x2.sum( axis=0, dtype=f4 )
+
+        return eto, daily_vars
+
+    ## select engine method by name
+    def engine_method( self, engine ):
+
+        if engine == 'hourly':
+            return self.calc_day_hourly
+        elif engine == 'batch':
+            return self.calc_day
+        else:
+            return self.calc_day_fused
+
+    ## report runtime and peak memory for each engine on one cube
+    def profile_engines( self, cube ):
+
+        ref = None
+
+        for engine in [ 'hourly', 'batch', 'fused' ]:
+            method = self.engine_method( engine )
+
+            start = time.perf_counter()
+            eto, daily_vars = method( cube )
+            elapsed = time.perf_counter() - start
+
+            # peak memory in a second run; tracing slows the timing
+            tracemalloc.start()
+            method( cube )
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            if ref is None:
+                ref = eto
+
+            eprint( '%-7s %9.3f s %10.1f MB peak   max |ETo diff| %.3g' %
+                    ( engine, elapsed, peak/2**20, np.abs(eto-ref).max() ) )
+
+        if self.nthreads > 1:
+            self.profile_threads( cube )
+
+    ## Calculate daily ETo from a cube already in memory, on the
+    ## thread pool over row tiles when more than one thread is set
+    ## @param cube - dictionary of WRF variable cubes, see read_cube
+    ## @return daily ETo, same orientation as the cube
+    def calc_cube( self, cube ):
+
+        method = self.engine_method( self.engine )
+        if self.nthreads == 1:
+            return method( cube )[0]
+
+        numy,numx = cube['T2'].shape[1:]
+        tiles = self.plan_tiles( numy, numx )
+        eto = np.zeros( (numy,numx), dtype=np.float32 )
+
+        def run( window ):
+            y0,y1,x0,x1 = window
+            block = {}
+            for name in cube:
+                block[name] = cube[name][...,y0:y1,x0:x1]
+            eto[y0:y1,x0:x1] = method( block )[0]
+
+        with concurrent.futures.ThreadPoolExecutor( self.nthreads ) as pool:
+            for job in [ pool.submit( run, window ) for window in tiles ]:
+                job.result()
+
+        return eto
+
+    ## report speedup of the thread pool over the serial engine
+    ## for the selected engine, computation only (cube already read)
+    def profile_threads( self, cube ):
+
+        method = self.engine_method( self.engine )
+        numy,numx = cube['T2'].shape[1:]
+
+        start = time.perf_counter()
+        serial, dvars = method( cube )
+        serial_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        eto = self.calc_cube( cube )
+        threaded_time = time.perf_counter() - start
+
+        eprint( '%s serial %.3f s, %d threads %.3f s on %d tiles, speedup %.2fx'
+                % ( self.engine, serial_time, self.nthreads, threaded_time,
+                    len( self.plan_tiles( numy, numx ) ),
+                    serial_time/threaded_time ) )
+        eprint( 'max |ETo diff| %.3g' % np.abs( eto-serial ).max() )
+
+    ## split the domain into (y0,y1,x0,x1) blocks whose working set
+    ## fits the memory budget; one block when there is no budget
+    def plan_tiles( self, numy, numx ):
+
+        if self.budget == None:
+
+            if self.nthreads == 1:
+                return [ (0, numy, 0, numx) ]
+
+            # a few row tiles per thread to balance the load
+            nrows = max( 1, -(-numy // (4*self.nthreads)) )
+            return [ (y0, min( y0+nrows, numy ), 0, numx)
+                     for y0 in range( 0, numy, nrows ) ]
+
+        # approximate bytes per pixel: 25 float32 frames for each input
+        # variable plus the engine's work buffers (measured with --profile)
+        work = { 'hourly':300, 'batch':2600, 'fused':720 }
+        pixel = 25*4*len( self.WRF_VARS ) + 3*4 + work[ self.engine ]
+
+        # the budget is shared by the threads working at the same time
+        npix = max( 1, self.budget // (pixel*self.nthreads) )
+
+        if npix >= numx:
+            # full-width row blocks
+            nrows = min( numy, npix // numx )
+            ncols = numx
+        else:
+            # square-ish blocks when a whole row does not fit
+            nrows = max( 1, min( numy, math.isqrt( npix ) ) )
+            ncols = max( 1, npix // nrows )
+
+        tiles = []
+        for y0 in range( 0, numy, nrows ):
+            for x0 in range( 0, numx, ncols ):
+                tiles.append( (y0, min( y0+nrows, numy ),
+                               x0, min( x0+ncols, numx )) )
+
+        return tiles
+
+    ## read and calculate one block and write it into the output buffers
+    def run_tile( self, window, eto, daily_vars ):
+
+        y0,y1,x0,x1 = window
+
+        with self.read_lock:
+            cube = self.read_cube( window )
+
+        values, dvars = self.engine_method( self.engine )( cube )
+
+        eto[y0:y1,x0:x1] = values
+
         if self.report:
 
             # report accumulated eto for daily vars also
-            daily_vars[:,:,6] = eto[:,:]
+            dvars[:,:,6] = values
 
             # report WRF accumulated potevp
-            # first read the buffer
-            bufstr = 'NETCDF:"' + self.infile + '":' + 'SFCEVP'
-            ds = gdal.Open( bufstr )
-
-            # get last hour value (accumulated) and convert to mm
-            data = ds.ReadAsArray()[24]
-            if type( data ) is not np.ndarray:
-                eprint('cannot get dataset:', 'SFCEVP')
-                return
-
-            daily_vars[:,:,7] = data[:,:] # kg/m^3 = mm ?
+            # last hour value (accumulated) was read with the cube
+            dvars[:,:,7] = cube['SFCEVP'] # kg/m^3 = mm ?
 
             # SFCEVP units Kg/m^2. using cm^3=1e-6m^3 & 1kg water= 1000cm^3
             # 1000*1e-6m^3/m^2 = 0.001m; 1000mm=1m -> 0.001*1000=1
 
-            np.save( self.daily_vars_path, daily_vars )
-        
+            daily_vars[y0:y1,x0:x1,:] = dvars
+
+    ## Read wrf buffers, generate timeslice parameters and process
+    def read_and_run( self ):
+        #print( 'eto working...' )
+
+        # read every needed variable once; all 25 time steps.
+        # (read_wrf with a band string, eg. 'TSK:10,TSK:11,...', still
+        # works for single slices but reopens the file for each band)
+        numy,numx = self.get_dims()
+        tiles = self.plan_tiles( numy, numx )
+
+        daily_vars = None
+
+        if self.budget == None:
+            eto = np.zeros( (numy,numx), dtype=np.float32 )
+            if self.report:
+                daily_vars = np.zeros( (numy,numx,8), dtype=np.float32 )
+        else:
+            # write blocks straight into the .npy files
+            eto = np.lib.format.open_memmap( self.outfile_path, mode='w+',
+                                             dtype=np.float32,
+                                             shape=(numy,numx) )
+            if self.report:
+                daily_vars = np.lib.format.open_memmap( self.daily_vars_path,
+                                                        mode='w+',
+                                                        dtype=np.float32,
+                                                        shape=(numy,numx,8) )
+        if self.nthreads == 1:
+            for window in tiles:
+                self.run_tile( window, eto, daily_vars )
+        else:
+            # tiles write disjoint blocks of the shared output buffers
+            with concurrent.futures.ThreadPoolExecutor( self.nthreads ) as pool:
+                jobs = [ pool.submit( self.run_tile, window, eto, daily_vars )
+                         for window in tiles ]
+                for job in jobs:
+                    job.result()   # raise any tile exception here
+
+        if self.budget == None:
+            np.save( self.outfile_path, eto )
+            if self.report:
+                np.save( self.daily_vars_path, daily_vars )
+        else:
+            eto.flush()
+            if self.report:
+                daily_vars.flush()
+
+            # linux reports kilobytes
+            rss = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+            eprint( len( tiles ), 'tiles, peak RSS %.1f MB' % (rss/1024.0) )
+
         #print( 'done.' )
     
 # end class eto
 
+## Class to calculate ETo hour by hour while WRF is still writing its
+## history output. A slice is calculated as soon as both of its bookend
+## frames are complete, so the daily product is done moments after WRF
+## ends. Works with one growing wrfout per domain (frames_per_outfile =
+## 1000) or one file per hour (frames_per_outfile = 1).
+class eto_stream():
+
+    ## @param oper - eto instance, its report, engine and output paths are used
+    ## @param files - function returning the domain's history files so far
+    ## @param final - function returning True once WRF has finished writing
+    def __init__( self, oper, files, final ):
+
+        self.oper = oper
+        self.files = files
+        self.final = final
+        self.slot = 0          # next hourly slice to calculate
+        self.eto = None
+        self.daily_vars = None
+
+    # list (file, frame) for every frame counted so far; the record count
+    # of a classic file being written can include a frame whose
+    # variables are not all written yet
+    def list_frames( self ):
+
+        frames = []
+        for f in self.files():
+            try:
+                ds = Dataset( f, 'r' )
+            except OSError:
+                break          # not yet readable, try next poll
+
+            numt = len( ds.dimensions['Time'] )
+            ds.close()
+
+            for j in range( numt ):
+                frames.append( (f, j) )
+
+        return frames
+
+    # read given frames of a variable as a float32 (time,y,x) cube
+    # with rows north up, like eto.read_cube
+    def read_var( self, name, frames ):
+
+        data = []
+        for f, j in frames:
+            ds = Dataset( f, 'r' )
+            ds.set_auto_mask( False )
+            data.append( ds.variables[name][j] )
+            ds.close()
+
+        return np.stack( data ).astype( np.float32, copy=False )[:,::-1,:]
+
+    # calculate every slice whose bookends are complete: a frame is
+    # complete once the next one exists or WRF has finished;
+    # returns True when the day is complete and saved
+    def step( self ):
+
+        final = self.final()     # before listing, WRF may finish between
+        frames = self.list_frames()
+        if not final:
+            frames = frames[:-1]
+
+        while self.slot < 24 and len( frames ) > self.slot + 1:
+
+            i = self.slot
+            pair = frames[i:i+2]
+
+            cube = {}
+            for name in self.oper.WRF_VARS:
+                cube[name] = self.read_var( name, pair )
+
+            values, dvars = self.oper.engine_method( self.oper.engine )( cube )
+            self.accumulate( values, dvars )
+            self.slot += 1
+
+        if self.slot < 24:
+            return False
+
+        if self.oper.report:
+            # report accumulated eto and WRF accumulated potevp
+            self.daily_vars[:,:,6] = self.eto
+            self.daily_vars[:,:,7] = self.read_var( 'SFCEVP',
+                                                    frames[24:25] )[0]
+            np.save( self.oper.daily_vars_path, self.daily_vars )
+
+        np.save( self.oper.outfile_path, self.eto )
+
+        return True
+
+    # combine one hourly slice with the day so far
+    def accumulate( self, values, dvars ):
+
+        if self.eto is None:
+            self.eto = values
+            self.daily_vars = dvars
+            return
+
+        self.eto += values
+
+        if self.oper.report:
+            d = self.daily_vars
+            np.maximum( d[:,:,0], dvars[:,:,0], out=d[:,:,0] )  # max temp
+            np.minimum( d[:,:,1], dvars[:,:,1], out=d[:,:,1] )  # min temp
+            np.maximum( d[:,:,2], dvars[:,:,2], out=d[:,:,2] )  # max Rh
+            np.minimum( d[:,:,3], dvars[:,:,3], out=d[:,:,3] )  # min Rh
+            d[:,:,4:6] += dvars[:,:,4:6]   # averaged wind, net radiation
+
+# end class eto_stream
+
 # ---------------------------------------------------------------------------
 
 #outdir = '/extra/SMVdata/archive'
@@ -604,22 +1234,59 @@ outdir = '/students/agrineer/wrf/output'
 
 # command line options
 def usage():
-    eprint('usage: eto_FAO.py -h -d -s sector <-r date> ')
-    eprint('       eto_FAO.py --help --daily --sector=sector <--rundate=date>')
+    eprint('usage: eto_FAO.py -h -d -g -p -e engine -m MB -t N -j N <-w wrfdir -o sec> -s sector <-r date> ')
+    eprint('       eto_FAO.py --help --daily --gdal --profile --engine=engine --memory=MB --threads=N --jobs=N <--stream=wrfdir --timeout=sec> --sector=sector <--rundate=date>')
     eprint("       omitting rundate parameter defaults to yesterday's date")
+    eprint('       --gdal reads WRF files with osgeo instead of netCDF4')
+    eprint('       engine is fused (default), batch or hourly')
+    eprint('       --profile reports runtime and peak memory of each engine,')
+    eprint('       no output is written')
+    eprint('       --memory processes the domain in tiles within MB megabytes')
+    eprint('       --threads computes row tiles on N threads (default 1);')
+    eprint('       with --profile the speedup over 1 thread is reported')
+    eprint('       --jobs processes N domain files at once (default 1)')
+    eprint('       --stream calculates ETo hour by hour while WRF writes')
+    eprint('       its output in wrfdir (the sector wrf directory); gives up')
+    eprint('       after --timeout seconds without a new frame (default 10800)')
   
 # end usage
 
+# parse a positive integer option or exit
+def positive_int( name, arg ):
+
+    try:
+        value = int( arg )
+    except ValueError:
+        value = 0
+
+    if value < 1:
+        eprint( name, 'must be a positive integer' )
+        usage()
+        sys.exit(2)
+
+    return value
+
 def read_args( argv ):
 
-    report = False
-    rundate = None
-    sector = None
+    options = { 'report':False,
+                'rundate':None,
+                'sector':None,
+                'backend':'netcdf',
+                'engine':'fused',
+                'profile':False,
+                'budget':None,
+                'nthreads':1,
+                'jobs':1,
+                'stream':None,
+                'timeout':10800.0 }
 
     try:                                
         opts, args = getopt.getopt( argv,
-                                    'hds:r:', 
-                                    ['help','daily','sector=','rundate='])
+                                    'hdgpe:m:t:j:w:o:s:r:', 
+                                    ['help','daily','gdal','profile',
+                                     'engine=','memory=','threads=','jobs=',
+                                     'stream=','timeout=','sector=',
+                                     'rundate='])
     except getopt.GetoptError: 
         eprint('unknown command arguments')
         usage()                          
@@ -631,35 +1298,187 @@ def read_args( argv ):
             sys.exit(0)
             
         elif opt in ( '-d', '--daily' ): 
-            report = True
-           
+            options['report'] = True
+
+        elif opt in ( '-g', '--gdal' ): 
+            options['backend'] = 'gdal'
+
+        elif opt in ( '-p', '--profile' ): 
+            options['profile'] = True
+
+        elif opt in ( '-e', '--engine' ): 
+            if arg not in [ 'fused', 'batch', 'hourly' ]:
+                eprint('unknown engine:', arg)
+                usage()
+                sys.exit(2)
+            options['engine'] = arg
+
+        elif opt in ( '-m', '--memory' ): 
+            try:
+                options['budget'] = int( float(arg)*2**20 )
+            except ValueError:
+                eprint('memory must be a number of megabytes')
+                usage()
+                sys.exit(2)
+
+        elif opt in ( '-t', '--threads' ): 
+            options['nthreads'] = positive_int( 'threads', arg )
+
+        elif opt in ( '-j', '--jobs' ): 
+            options['jobs'] = positive_int( 'jobs', arg )
+
+        elif opt in ( '-w', '--stream' ): 
+            options['stream'] = arg
+
+        elif opt in ( '-o', '--timeout' ): 
+            options['timeout'] = float( positive_int( 'timeout', arg ) )
+
         elif opt in ( '-s', '--sector' ):
-            sector = arg  
+            options['sector'] = arg  
 
         elif opt in ( '-r', '--rundate' ):
-            rundate = arg  
+            options['rundate'] = arg  
 
-    if sector == None:
+    if options['sector'] == None:
         usage()                     
         sys.exit( 2 )
 
-    return report, rundate, sector
+    return options
 
 # end read_args
 
+# calculate (or profile) ETo for one domain file in the current directory
+def run_domain( f, options ):
+
+    oper = eto( options['report'], f, '.', options['rundate'],
+                options['backend'], options['engine'], options['budget'],
+                options['nthreads'] )
+
+    if options['profile']:
+        eprint('profiling ETo engines for', f + '.') 
+        oper.profile_engines( oper.read_cube() )
+        return
+
+    eprint('calculating ETo for', f + '.') 
+    oper.read_and_run()                  
+
+# run func( f, *args ) for each file, jobs at a time in a process pool.
+# errors are reported in file order; returns the number of failures
+def run_domains( files, jobs, func, *args ):
+
+    nfailed = 0
+
+    if jobs == 1:
+        for f in files:
+            try:
+                func( f, *args )
+            except Exception as e:
+                eprint( 'failed on', f + ':', repr(e) )
+                nfailed += 1
+
+        return nfailed
+
+    with concurrent.futures.ProcessPoolExecutor( jobs ) as pool:
+        futures = [ pool.submit( func, f, *args ) for f in files ]
+
+        for f, future in zip( files, futures ):
+            try:
+                future.result()
+            except Exception as e:
+                eprint( 'failed on', f + ':', repr(e) )
+                nfailed += 1
+
+    return nfailed
+
+# has wrf.exe finished writing into watchdir: its master task reports
+# success at the end of rsl.error.0000 after closing the history files
+def wrf_complete( watchdir ):
+
+    path = watchdir + '/rsl.error.0000'
+    try:
+        with open( path, 'rb' ) as f:
+            f.seek( max( 0, os.path.getsize( path ) - 4096 ) )
+            return b'SUCCESS COMPLETE WRF' in f.read()
+    except OSError:
+        return False
+
+# calculate ETo for each domain WRF is writing into watchdir, as the
+# hourly frames appear; .npy files go to the current directory.
+# gives up after timeout seconds without a new frame
+def stream_domains( watchdir, options, poll=30.0, timeout=10800.0 ):
+
+    streams = {}
+    done = {}
+    last = time.time()
+
+    while True:
+
+        # history files grouped by domain, eg. wrfout_d03_*
+        for path in sorted( glob.glob( watchdir + '/wrfout_d0*' ) ):
+            domain = os.path.basename( path )[:10]
+            if domain in streams:
+                continue
+
+            eprint('streaming ETo for', domain, 'from', watchdir + '.')
+            oper = eto( options['report'], path, '.', options['rundate'],
+                        engine=options['engine'] )
+
+            # run_wrfgfs.py replaces ':' with '-' in the file names once
+            # WRF is done, name the outputs to match
+            bname = os.path.basename( path ).replace( ':', '-' )
+            oper.outfile_path = './ETo_FAO_' + bname + '.npy'
+            oper.daily_vars_path = './DailyVars_' + bname + '.npy'
+
+            pattern = watchdir + '/' + domain + '_*'
+            streams[domain] = eto_stream( oper,
+                                lambda p=pattern: sorted( glob.glob( p ) ),
+                                lambda: wrf_complete( watchdir ) )
+            done[domain] = False
+
+        for domain in streams:
+            if done[domain]:
+                continue
+
+            slot = streams[domain].slot
+            done[domain] = streams[domain].step()
+            if streams[domain].slot > slot:
+                last = time.time()
+
+            if done[domain]:
+                eprint('ETo for', domain, 'complete.')
+
+        if len( streams ) > 0 and all( done.values() ):
+            return
+
+        if time.time() - last > timeout:
+            raise IOError( 'no new WRF frames in ' + watchdir +
+                           ' for %d seconds' % timeout )
+
+        time.sleep( poll )
+
 if __name__ == '__main__':  
 
-    # get report daily flag, run date and domain sector
-    report, rundate, sector = read_args( sys.argv[1:] ) 
-    if rundate == None:
+    # get report daily flag, run date, domain sector and run options
+    options = read_args( sys.argv[1:] ) 
+    if options['rundate'] == None:
         
         # run with yesterday's data
         today = datetime.datetime.now() # local time
         yesterday = today - datetime.timedelta(days = 1)
-        rundate = yesterday.strftime( "%Y%m%d" )
+        options['rundate'] = yesterday.strftime( "%Y%m%d" )
 
     # go to working directory
-    indir = outdir + '/' + sector + '/' + rundate
+    indir = outdir + '/' + options['sector'] + '/' + options['rundate']
+
+    if options['stream'] != None:
+
+        # WRF is still running; the output directory may not exist yet
+        os.makedirs( indir, exist_ok=True )
+        os.chdir( indir )
+
+        stream_domains( options['stream'], options,
+                        timeout=options['timeout'] )
+        sys.exit(0)
 
     # check if working dir exists
     if not os.path.isdir( indir ):
@@ -674,11 +1493,11 @@ if __name__ == '__main__':
     os.chdir( indir )
 
     # process all available domains in directory
-    for f in glob.glob( 'wrfout_d*' ):
-    
-        eprint('calculating ETo for', f + '.') 
-        oper = eto( report, f, '.', rundate )
-        
-        oper.read_and_run()                  
+    files = sorted( glob.glob( 'wrfout_d*' ) )
+    nfailed = run_domains( files, options['jobs'], run_domain, options )
+
+    if nfailed > 0:
+        eprint( nfailed, 'of', len( files ), 'domains failed' )
+        sys.exit(2)
 
 # end eto.py
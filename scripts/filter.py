@@ -33,6 +33,9 @@ import datetime
 import numpy as np
 from netCDF4 import Dataset
 
+import ncout
+import gridcache
+
 ## @file      filter.py
 ## @brief     Selectively read WRF meta data variables and write to file
 ##            Make reprojectable by keeping GMT (general mapping tool ) format.
@@ -54,20 +57,78 @@ def eprint( *args ):
 def oprint( *args ):
     print( *args, file=sys.stdout, flush=True)
 
+# default memory limit of a copy block, MB
+MEMORY_MB = 64
+
+# packed int16 range; -32768 is the packed variables' _FillValue, the
+# netCDF default fill of short, -32767, would mask the minimum
+PACK_MAX = 32767
+PACK_FILL = np.int16( -32768 )
+
 class filterWRF():
     
-    def __init__( self, inpath, outpath ):
-
-        # hard code WRF variables to use, later implement command line string
+    ## @param inpath - WRF output file, or an already open Dataset
+    ## @param outpath - filtered output file
+    ## @param cache - dictionary of WRF variables already read, keyed by
+    ##                name; arrays are indexed by time like the variables
+    ## @param output - output format keyword arguments, see ncout.ncout
+    ## @param grid - sector gridcache.gridcache; the output refers to it
+    ##               instead of carrying XLAT, XLONG
+    ## @param memory - limit in bytes of the blocks data is copied in,
+    ##                 default MEMORY_MB
+    ## @param variables - WRF variables to keep, default WRF_VARS
+    ## @param bbox - ( south, north, west, east ) in degrees; keeps the
+    ##               smallest row, column window holding the grid points
+    ##               inside it
+    ## @param times - slice of the hourly frames to keep, eg. slice(0,24,3)
+    ## @param decimate - keep every Nth row and column
+    ## @param pack - write floating point variables as int16 with CF
+    ##               scale_factor, add_offset packing
+    def __init__( self, inpath, outpath, cache=None, output=None,
+                  grid=None, memory=None, variables=None, bbox=None,
+                  times=None, decimate=1, pack=False ):
+
+        self.grid = grid
+
+        if memory == None:
+            memory = MEMORY_MB*1024*1024
+        self.memory = memory
+
+        # default WRF variables to keep
         self.WRF_VARS = [ 'TSK','EMISS','SWDOWN','GLW','GRDFLX',
                           'T2','PSFC','Q2','U10','V10']
+        if variables != None:
+            self.WRF_VARS = list( variables )
+
+        self.bbox = bbox
+        self.times = times
+        self.decimate = decimate
+
+        # source slices of the subset dimensions, see resolve_subset
+        self.select = {}
+
+        # packed variables, name: [ scale, offset, max reconstruction error ]
+        self.pack = pack
+        self.packing = {}
 
-        # check if file names have same wrf_out_XXX_YYYY-MM-DD_VV_ZZ
-        wrf_filename = os.path.basename( inpath )
+        # variables read by the caller
+        if cache == None:
+            cache = {}
+        self.cache = cache
 
         # open netcdf files
-        self.wrf_ds = Dataset( inpath, 'r' )
-        self.out_ds = Dataset( outpath, 'w', format='NETCDF3_CLASSIC' )
+        if isinstance( inpath, Dataset ):
+            self.wrf_ds = inpath
+        else:
+            self.wrf_ds = Dataset( inpath, 'r' )
+        if output == None:
+            output = {}
+        self.out = ncout.ncout( outpath, **output )
+        self.out_ds = self.out.ds
+
+        # data to copy once all variables are defined,
+        # ( name, source, selection of source )
+        self.pending = []
 
         # our attributes to have
         self.attr = [ 'TITLE',
@@ -184,14 +245,135 @@ class filterWRF():
                 
                 self.out_ds.setncattr( attr, self.wrf_ds.getncattr(attr) )
 
+    # XLAT, XLONG of the first frame
+    def read_latlong( self ):
+
+        if 'XLAT' in self.cache and 'XLONG' in self.cache:
+            return self.cache['XLAT'][0], self.cache['XLONG'][0]
+
+        if self.grid != None:
+            domain = gridcache.domain_of( self.wrf_ds.filepath() )
+            self.grid.check( self.wrf_ds, domain )
+            return self.grid.load( domain )
+
+        wvars = self.wrf_ds.variables
+        for name in [ 'XLAT', 'XLONG' ]:
+            if name not in wvars:
+                raise IOError( '"' + name + '" variable is not in WRF file' )
+
+        return np.asarray( wvars['XLAT'][0] ), np.asarray( wvars['XLONG'][0] )
+
+    # source slices of the time and grid dimensions kept; the bounding
+    # box is resolved to a row, column window of the grid
+    def resolve_subset( self ):
+
+        dims = self.wrf_ds.dimensions
+        ny = len( dims['south_north'] )
+        nx = len( dims['west_east'] )
+        j0, j1, i0, i1 = 0, ny, 0, nx
+
+        if self.bbox != None:
+            south, north, west, east = self.bbox
+            xlat, xlong = self.read_latlong()
+
+            inside = ( xlat >= south ) & ( xlat <= north ) & \
+                     ( xlong >= west ) & ( xlong <= east )
+            rows = np.nonzero( inside.any( axis=1 ) )[0]
+            cols = np.nonzero( inside.any( axis=0 ) )[0]
+            if len( rows ) == 0:
+                raise ValueError( 'bounding box ' + str( self.bbox ) +
+                                  ' holds no grid points' )
+
+            j0, j1 = int( rows[0] ), int( rows[-1] ) + 1
+            i0, i1 = int( cols[0] ), int( cols[-1] ) + 1
+
+        if self.bbox != None or self.decimate > 1:
+            d = self.decimate
+            self.select['south_north'] = slice( j0, j1, d )
+            self.select['west_east'] = slice( i0, i1, d )
+            self.select['south_north_stag'] = slice( j0, j1 + 1, d )
+            self.select['west_east_stag'] = slice( i0, i1 + 1, d )
+
+        if self.times != None:
+            nt = len( dims['Time'] )
+            self.select['Time'] = slice( *self.times.indices( nt ) )
+
+    # size of a dimension in the output
+    def dim_size( self, dim ):
+
+        n = len( self.wrf_ds.dimensions[dim] )
+        if dim in self.select:
+            n = len( range( *self.select[dim].indices( n ) ) )
+
+        return n
+
+    # selection of a variable's source data, after any leading indices
+    def selection( self, dims, lead=() ):
+
+        return tuple( lead ) + tuple( self.select.get( dim, slice( None ) )
+                                      for dim in dims[len( lead ):] )
+
+    # grid attributes of the subset, and where it was taken from
+    def subset_attrs( self ):
+
+        ny = self.dim_size( 'south_north' )
+        nx = self.dim_size( 'west_east' )
+
+        attrs = { 'WEST-EAST_GRID_DIMENSION':nx + 1,
+                  'SOUTH-NORTH_GRID_DIMENSION':ny + 1,
+                  'WEST-EAST_PATCH_START_UNSTAG':1,
+                  'WEST-EAST_PATCH_END_UNSTAG':nx,
+                  'WEST-EAST_PATCH_START_STAG':1,
+                  'WEST-EAST_PATCH_END_STAG':nx + 1,
+                  'SOUTH-NORTH_PATCH_START_UNSTAG':1,
+                  'SOUTH-NORTH_PATCH_END_UNSTAG':ny,
+                  'SOUTH-NORTH_PATCH_START_STAG':1,
+                  'SOUTH-NORTH_PATCH_END_STAG':ny + 1 }
+
+        for attr in [ 'DX', 'DY' ]:
+            if attr in self.out_ds.ncattrs():
+                attrs[attr] = self.out_ds.getncattr( attr )*self.decimate
+
+        # keep the WRF attribute types
+        for attr in attrs:
+            if attr in self.out_ds.ncattrs():
+                value = self.out_ds.getncattr( attr )
+                self.out_ds.setncattr( attr,
+                                       np.asarray( value ).dtype.type( attrs[attr] ) )
+
+        for dim in [ 'Time', 'south_north', 'west_east' ]:
+            if dim in self.select:
+                s = self.select[dim]
+                self.out_ds.setncattr( 'SUBSET_' + dim.upper(),
+                                       '%d:%d:%d' % ( s.start, s.stop, s.step ) )
+
+    # create an output dimension, Time unlimited as in the WRF output
+    def create_dim( self, dim ):
+
+        if self.wrf_ds.dimensions[dim].isunlimited():
+            size = None
+        else:
+            size = self.dim_size( dim )
+        self.out_ds.createDimension( dim, size )
+
     # notch out unwanted dimensions from WRF output and write out
     def sift_dims( self ):
 
-        # create dimensions
         for dim in self.wrf_ds.dimensions:
             if dim in self.dims:
-                size = len( self.wrf_ds.dimensions[dim] )
-                self.out_ds.createDimension( dim, size )
+                self.create_dim( dim )
+
+    # add the WRF dimensions of a variable not already in the output,
+    # eg. soil_layers_stag or west_east_stag
+    def add_dims( self, dims ):
+
+        for dim in dims:
+            if dim in self.out_ds.dimensions:
+                continue
+            if dim not in self.wrf_ds.dimensions:
+                raise IOError( '"' + dim + '" dimension is not in WRF file' )
+
+            self.create_dim( dim )
 
     # check and copy lat longs
     def copy_coord( self, var ):
@@ -204,22 +386,31 @@ class filterWRF():
 
         # 2D array
         if var=='Times':
-            ds_var = self.out_ds.createVariable( var, dtype,
-                                                 ('Time','DateStrLen') )
+            ds_var = self.out.create_var( var, dtype, ('Time','DateStrLen'),
+                                          quantize=False,
+                                          shape=( self.dim_size( 'Time' ),
+                                                  wvar.shape[1] ) )
         else:
-            ds_var = self.out_ds.createVariable( var, dtype,
-                                           ('south_north', 'west_east') )
+            ds_var = self.out.create_var( var, dtype,
+                                          ('south_north', 'west_east'),
+                                          quantize=False )
         # copy over variable attributes
         for ncattr in wvar.ncattrs():
 
             value = wvar.getncattr(ncattr)
             ds_var.setncattr( ncattr, value )
 
+        if var in self.cache:
+            wvar = self.cache[var]
+
         if var=='Times':
-            self.out_ds.variables[var][:,:] = wvar[:,:]
+            self.pending.append( ( var, wvar,
+                                   self.selection( ('Time','DateStrLen') ) ) )
         else:
             # just one buffer, not the 25 that are present
-            self.out_ds.variables[var][:,:] = wvar[0][:,:]
+            self.pending.append( ( var, wvar,
+                                   self.selection( ('Time','south_north',
+                                                    'west_east'), (0,) ) ) )
 
     # clone a netcdf variable's attributes and data
     def clone_var( self, var ):
@@ -230,18 +421,151 @@ class filterWRF():
             raise IOError( var + ' variable is not in WRF file' )
         
         dtype = wvar.dtype
-
-        # 3-D array
-        ds_var = self.out_ds.createVariable( var, dtype,
-                                           ('Time','south_north', 'west_east') )
+        select = self.selection( wvar.dimensions )
+
+        source = wvar
+        if var in self.cache:
+            source = self.cache[var]
+
+        packed = self.pack and dtype.kind == 'f'
+        fill = None
+        if packed:
+            self.packing[var] = list( self.pack_params( source, select ) ) + [ 0.0 ]
+            dtype = np.dtype( 'i2' )
+            fill = PACK_FILL
+
+        # ( Time, south_north, west_east ) or with soil levels, staggering
+        self.add_dims( wvar.dimensions )
+        ds_var = self.out.create_var( var, dtype, wvar.dimensions,
+                                      shape=[ self.dim_size( dim )
+                                              for dim in wvar.dimensions ],
+                                      fill_value=fill )
         # copy over variable attributes
         for ncattr in wvar.ncattrs():
 
             value = wvar.getncattr(ncattr)
             ds_var.setncattr( ncattr, value )
-        
-        self.out_ds.variables[var][:,:,:] = wvar[:,:,:]
-                      
+
+        if packed:
+            scale, offset, error = self.packing[var]
+            ds_var.setncattr( 'scale_factor', wvar.dtype.type( scale ) )
+            ds_var.setncattr( 'add_offset', wvar.dtype.type( offset ) )
+            ds_var.set_auto_maskandscale( False )   # packed by copy
+
+        self.pending.append( ( var, source, select ) )
+
+    # scale_factor, add_offset mapping the selected range of a source onto
+    # -PACK_MAX to PACK_MAX
+    def pack_params( self, source, select ):
+
+        vmin = np.inf
+        vmax = -np.inf
+        for block, data in self.blocks( source, select ):
+            vmin = min( vmin, float( np.min( data ) ) )
+            vmax = max( vmax, float( np.max( data ) ) )
+
+        if not np.isfinite( vmin ) or not np.isfinite( vmax ):
+            raise ValueError( 'cannot pack non-finite values' )
+
+        # scale and offset as stored, the reader unpacks with these
+        ftype = np.dtype( source.dtype ).type
+        offset = ftype( ( vmax + vmin )/2.0 )
+        scale = ftype( ( vmax - vmin )/( 2.0*PACK_MAX ) )
+        if scale == 0:
+            scale = ftype( 1.0 )
+        while ( vmax - offset )/scale > PACK_MAX or \
+              ( offset - vmin )/scale > PACK_MAX:
+            scale = np.nextafter( scale, ftype( np.inf ) )
+
+        return scale, offset
+
+    # pack a block of a variable, keeping the largest reconstruction error
+    def pack_data( self, var, data ):
+
+        scale, offset, error = self.packing[var]
+
+        packed = np.clip( np.rint( ( data - offset )/scale ),
+                          -PACK_MAX, PACK_MAX ).astype( np.int16 )
+        restored = packed*scale + offset
+        self.packing[var][2] = max( error,
+                                    float( np.max( np.abs( restored - data ) ) ) )
+
+        return packed
+
+    # read the source of an output block; the last dimension is read
+    # whole and decimated in memory, strided reads of it are slow
+    def read( self, source, axes, select, block ):
+
+        index = list( select )
+        for k, ( i, start, step ) in enumerate( axes ):
+            if k < len( block ):
+                b = block[k]
+                if isinstance( b, slice ):
+                    index[i] = slice( start + b.start*step,
+                                      start + ( b.stop - 1 )*step + 1, step )
+                else:
+                    index[i] = start + b*step
+
+        last = index[-1]
+        if isinstance( last, slice ) and last.step not in [ None, 1 ]:
+            index[-1] = slice( last.start, last.stop )
+            return source[tuple( index )][...,::last.step]
+
+        return source[tuple( index )]
+
+    # the selection of source in blocks of at most self.memory bytes,
+    # ( output block, data ): whole time slabs if they fit, else slices of
+    # the first dimension that does. Blocks are whole chunks of chunking,
+    # the output chunk shape, where possible so compressed chunks are
+    # written once
+    def blocks( self, source, select, chunking=None ):
+
+        # output shape, and the source axis, start and step of each axis
+        shape = []
+        axes = []
+        for i, s in enumerate( select ):
+            if isinstance( s, slice ):
+                start, stop, step = s.indices( source.shape[i] )
+                axes.append( ( i, start, step ) )
+                shape.append( len( range( start, stop, step ) ) )
+
+        if len( shape ) == 0:
+            yield (), source[select]
+            return
+
+        itemsize = np.dtype( source.dtype ).itemsize
+
+        # split on the first axis whose trailing slabs fit
+        axis = 0
+        slab = itemsize*axes[-1][2]
+        for n in shape[1:]:
+            slab *= n
+        while axis < len( shape ) - 1 and slab > self.memory:
+            axis += 1
+            slab //= shape[axis]
+
+        step = max( 1, self.memory//slab )
+        if chunking not in [ None, 'contiguous' ] and step > chunking[axis]:
+            step -= step%chunking[axis]
+        step = min( step, shape[axis] )
+
+        for outer in np.ndindex( *shape[:axis] ):
+            for start in range( 0, shape[axis], step ):
+                stop = min( start + step, shape[axis] )
+                block = outer + ( slice( start, stop ), )
+                yield block, self.read( source, axes, select, block )
+
+    # copy the selection of source to an output variable
+    def copy( self, var, source, select ):
+
+        chunking = self.out_ds.variables[var].chunking()
+        for block, data in self.blocks( source, select, chunking ):
+            if var in self.packing:
+                data = self.pack_data( var, data )
+            if block == ():
+                block = Ellipsis
+            self.out.write( var, data, block )
+
     # make it so
     def run( self ):
 
@@ -252,11 +576,19 @@ class filterWRF():
 
         # sift through input globals for attrs,dims of interests
         self.sift_attrs()
+        self.resolve_subset()
+        if len( self.select ) > 0:
+            self.subset_attrs()
         self.sift_dims()
 
-        # mandatory XLAT, XLONG buffers 
-        self.copy_coord('XLAT')
-        self.copy_coord('XLONG')
+        # mandatory XLAT, XLONG buffers, or the sector grid they are in
+        if self.grid != None:
+            domain = gridcache.domain_of( self.wrf_ds.filepath() )
+            key = self.grid.check( self.wrf_ds, domain )
+            self.grid.reference( self.out_ds, domain, key )
+        else:
+            self.copy_coord('XLAT')
+            self.copy_coord('XLONG')
         self.copy_coord('Times')
  
         for var in self.WRF_VARS:
@@ -264,9 +596,22 @@ class filterWRF():
             self.clone_var( var )
             #print( self.out_ds.variables[var])
         
+        # all variables are defined, copy the data; reading here keeps
+        # one block in memory at a time
+        for var, wvar, select in self.pending:
+            self.copy( var, wvar, select )
+        self.pending = []
+
+        for var in self.packing:
+            scale, offset, error = self.packing[var]
+            eprint( '    packed %-8s scale %.6g offset %.6g max error %.6g'
+                    % ( var, scale, offset, error ) )
+
         # report output data
         #self.wrf_info( self.out_ds, verb=True ) 
-        self.out_ds.close()
+
+        # the file's bytes if built in memory, see ncout tobytes
+        return self.out.close()
         
 # end class merge    
 
@@ -274,24 +619,54 @@ class filterWRF():
 
 # command line options
 def usage():
-    eprint('usage: filter.py -h -i infile -o outfile')
-    eprint('       filter.py --help --in=infile --out=outfile')
+    eprint('usage: filter.py -h -p -n -z level -q N -m MB -g griddir -v vars -b box -t frames -d N -i infile -o outfile')
+    eprint('       filter.py --help --pack --netcdf4 --complevel=level --digits=N --memory=MB --grid=griddir --variables=vars --bbox=box --times=frames --decimate=N --in=infile --out=outfile')
+    eprint('       --grid refers to the sector grid cache in griddir instead')
+    eprint('       of copying XLAT, XLONG; see gridcache.py')
+    eprint('       --memory copies variables in blocks of at most MB')
+    eprint('       megabytes (default %d)' % MEMORY_MB )
+    eprint('       --variables keeps the comma separated WRF variables,')
+    eprint('       eg. T2,Q2,SMOIS (default TSK,EMISS,SWDOWN,GLW,GRDFLX,T2,')
+    eprint('       PSFC,Q2,U10,V10)')
+    eprint('       --bbox keeps the grid window holding south,north,west,east')
+    eprint('       in degrees, eg. -2.5,-1.5,-79.5,-78.5')
+    eprint('       --times keeps frames start:stop:step, python slice style,')
+    eprint('       eg. 0:24 or ::3 for every third hour')
+    eprint('       --decimate keeps every Nth row and column')
+    eprint('       --pack writes data variables as int16 with scale_factor,')
+    eprint('       add_offset over each variable\'s range and reports the')
+    eprint('       largest reconstruction error')
+    ncout.usage()
   
 def read_args( argv ):
 
     infile = None
     outfile = None
+    output = {}
+    grid = None
+    memory = None
+    options = {}
     
     try:                                
         opts, args = getopt.getopt( argv,
-                                    'hi:o:', 
-                                    ['help','in=','out='] )
+                                    'hpnz:q:m:g:v:b:t:d:i:o:', 
+                                    ['help','pack','netcdf4','complevel=','digits=',
+                                     'memory=','grid=','variables=','bbox=',
+                                     'times=','decimate=','in=','out='] )
     except getopt.GetoptError: 
         eprint('unknown command arguments')
         usage()                          
         sys.exit(2)  
                    
     for opt, arg in opts:   
+        try:
+            if ncout.read_arg( output, opt, arg ):
+                continue
+        except ValueError as e:
+            eprint( e )
+            usage()
+            sys.exit( 2 )
+
         if opt in ( '-h', '--help' ): 
             usage()                     
             sys.exit(0)       
@@ -302,6 +677,64 @@ def read_args( argv ):
         elif opt in ( '-o', '--out' ):
             outfile = arg  
 
+        elif opt in ( '-g', '--grid' ):
+            grid = gridcache.gridcache( arg )
+
+        elif opt in ( '-m', '--memory' ):
+            try:
+                memory = float( arg )*1024*1024
+            except ValueError:
+                memory = 0
+            if memory < 1:
+                eprint( 'memory must be a positive number of MB' )
+                usage()
+                sys.exit( 2 )
+            memory = int( memory )
+
+        elif opt in ( '-p', '--pack' ):
+            options['pack'] = True
+
+        elif opt in ( '-v', '--variables' ):
+            options['variables'] = [ v.strip() for v in arg.split( ',' )
+                                    if v.strip() != '' ]
+
+        elif opt in ( '-b', '--bbox' ):
+            try:
+                bbox = [ float( v ) for v in arg.split( ',' ) ]
+            except ValueError:
+                bbox = []
+            if len( bbox ) != 4 or bbox[0] > bbox[1] or bbox[2] > bbox[3]:
+                eprint( 'bbox must be south,north,west,east degrees' )
+                usage()
+                sys.exit( 2 )
+            options['bbox'] = tuple( bbox )
+
+        elif opt in ( '-t', '--times' ):
+            try:
+                parts = [ int( v ) if v.strip() != '' else None
+                          for v in arg.split( ':' ) ]
+            except ValueError:
+                parts = []
+            if len( parts ) < 1 or len( parts ) > 3 or \
+               ( len( parts ) == 3 and parts[2] != None and parts[2] < 1 ):
+                eprint( 'times must be start:stop:step frames' )
+                usage()
+                sys.exit( 2 )
+            if len( parts ) == 1:       # one frame
+                parts = [ parts[0], None if parts[0] in [ None, -1 ]
+                          else parts[0] + 1 ]
+            options['times'] = slice( *parts )
+
+        elif opt in ( '-d', '--decimate' ):
+            try:
+                options['decimate'] = int( arg )
+            except ValueError:
+                options['decimate'] = 0
+            if options['decimate'] < 1:
+                eprint( 'decimate must be a positive integer' )
+                usage()
+                sys.exit( 2 )
+
         else:
             usage()                     
             sys.exit(0)       
@@ -316,14 +749,16 @@ def read_args( argv ):
         usage()                     
         sys.exit( 2 )
 
-    return infile, outfile
+    return infile, outfile, output, grid, memory, options
 
 if __name__ == '__main__':  
 
-    infile, outfile= read_args( sys.argv[1:] ) # get input and output files
+    # get input and output files
+    infile, outfile, output, grid, memory, options = read_args( sys.argv[1:] )
 
     eprint( 'Filtering', infile, 'and outputing to', outfile )
-    oper = filterWRF( infile, outfile )
+    oper = filterWRF( infile, outfile, output=output, grid=grid,
+                      memory=memory, **options )
     oper.run() 
 
 # end filter.py
@@ -0,0 +1,186 @@
+#  gridcache.py
+#
+#  Copyright (c) 2026 agent
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#  or visit https://www.gnu.org/licenses/gpl-3.0-standalone.html
+#
+gridcache_copyright = 'gridcache.py Copyright (c) 2026 agent ' + \
+                      'released under GNU GPL V3.0'
+
+import os
+import sys
+import time
+import hashlib
+import tempfile
+
+import numpy as np
+from netCDF4 import Dataset
+
+## @file      gridcache.py
+## @brief     Per sector cache of the static WRF grid coordinates
+##            (XLAT, XLONG), one file per domain, keyed by a hash of the
+##            grid defining attributes.
+## @author    agent
+## @copyright Copyright (c) 2026 agent. All Rights Reserved.
+## @license   Released under GNU General Public License V3.0
+## @results   grid_dNN.nc files in the sector grid directory
+
+# The grid of a sector domain does not change from run to run, so the
+# coordinates are kept once, in <sector>/grid/grid_dNN.nc, and the daily
+# products carry GRID_KEY and GRID_FILE global attributes instead of
+# their own XLAT, XLONG copies.
+#
+# The first WRF file of a domain writes its cache file. Every later one
+# is checked against it: a different key means the sector grid changed
+# (namelist.wps edited, say) and is reported as an error; remove the
+# cache file to accept the new grid.
+
+# print functions to reduce clutter and to flush output
+def eprint( *args ):
+    print( *args, file=sys.stderr, flush=True)
+
+# global attributes and dimensions defining a WRF grid
+GRID_ATTRS = [ 'DX', 'DY', 'CEN_LAT', 'CEN_LON', 'TRUELAT1', 'TRUELAT2',
+               'STAND_LON', 'MAP_PROJ' ]
+GRID_DIMS = [ 'south_north', 'west_east' ]
+
+# hash of the grid defining attributes and dimensions of a WRF dataset
+def grid_key( wrf_ds ):
+
+    items = []
+    for attr in GRID_ATTRS:
+        if attr in wrf_ds.ncattrs():
+            value = np.asarray( wrf_ds.getncattr( attr ) ).item()
+        else:
+            value = None
+        items.append( attr + '=' + repr( value ) )
+
+    for dim in GRID_DIMS:
+        if dim not in wrf_ds.dimensions:
+            raise IOError( '"' + dim + '" dimension is not in WRF file' )
+        items.append( dim + '=' + str( len( wrf_ds.dimensions[dim] ) ) )
+
+    return hashlib.sha1( ';'.join( items ).encode() ).hexdigest()[:16]
+
+# domain of a WRF output file name, eg. d03 for wrfout_d03_2022-05-01_...
+def domain_of( path ):
+
+    name = os.path.basename( path )
+    if not name.startswith( 'wrfout_d' ):
+        raise ValueError( 'not a WRF output file name: ' + name )
+
+    return name[7:10]
+
+class gridcache():
+
+    ## @param griddir - sector grid directory, eg. <output>/<sector>/grid
+    def __init__( self, griddir ):
+
+        self.griddir = griddir
+
+    def path( self, domain ):
+        return self.griddir + '/grid_' + domain + '.nc'
+
+    # write the grid of a WRF dataset; written under a temporary name then
+    # renamed, parallel jobs may race to write the same grid
+    def write( self, wrf_ds, domain, key ):
+
+        os.makedirs( self.griddir, exist_ok=True )
+        fd, tmp_path = tempfile.mkstemp( prefix='.grid_', suffix='.nc',
+                                         dir=self.griddir )
+        os.close( fd )
+
+        out_ds = Dataset( tmp_path, 'w', format='NETCDF3_CLASSIC' )
+
+        out_ds.description = 'Static WRF grid coordinates of a sector domain.'
+        out_ds.history = 'File created on ' + time.ctime(time.time()) + '.'
+        out_ds.setncattr( 'GRID_KEY', key )
+        for attr in GRID_ATTRS + [ 'MAP_PROJ_CHAR', 'MOAD_CEN_LAT',
+                                   'POLE_LAT', 'POLE_LON' ]:
+            if attr in wrf_ds.ncattrs():
+                out_ds.setncattr( attr, wrf_ds.getncattr( attr ) )
+
+        for dim in GRID_DIMS:
+            out_ds.createDimension( dim, len( wrf_ds.dimensions[dim] ) )
+
+        data = {}
+        for name in [ 'XLAT', 'XLONG' ]:
+            if name not in wrf_ds.variables:
+                out_ds.close()
+                os.remove( tmp_path )
+                raise IOError( '"' + name + '" variable is not in WRF file' )
+
+            wvar = wrf_ds.variables[name]
+            var = out_ds.createVariable( name, wvar.dtype, tuple( GRID_DIMS ) )
+            for ncattr in wvar.ncattrs():
+                if ncattr == 'coordinates':
+                    continue
+                var.setncattr( ncattr, wvar.getncattr( ncattr ) )
+
+            data[name] = wvar[0]   # one buffer, not the 25 present
+
+        for name in data:
+            out_ds.variables[name][:] = data[name]
+
+        out_ds.close()
+        os.replace( tmp_path, self.path( domain ) )
+
+    ## check a WRF dataset against its domain's cache file, writing the
+    ## file if there is none. returns the grid key
+    ## @param domain - eg. 'd03', default from the dataset's file name
+    def check( self, wrf_ds, domain=None ):
+
+        if domain == None:
+            domain = domain_of( wrf_ds.filepath() )
+
+        key = grid_key( wrf_ds )
+        path = self.path( domain )
+
+        if not os.path.isfile( path ):
+            eprint( 'caching', domain, 'grid in', path )
+            self.write( wrf_ds, domain, key )
+            return key
+
+        ds = Dataset( path, 'r' )
+        cached = ds.getncattr( 'GRID_KEY' )
+        ds.close()
+
+        if cached != key:
+            raise IOError( 'grid of ' + os.path.basename( wrf_ds.filepath() ) +
+                           ' (' + key + ') does not match ' + path +
+                           ' (' + cached + '); remove it if the ' + domain +
+                           ' grid has changed' )
+
+        return key
+
+    # read the cached XLAT, XLONG of a domain, rows in WRF order
+    def load( self, domain ):
+
+        ds = Dataset( self.path( domain ), 'r' )
+        ds.set_auto_mask( False )
+        xlat = ds.variables['XLAT'][:]
+        xlong = ds.variables['XLONG'][:]
+        ds.close()
+
+        return xlat, xlong
+
+    # reference to the cache for a product's global attributes
+    def reference( self, out_ds, domain, key ):
+
+        out_ds.setncattr( 'GRID_KEY', key )
+        out_ds.setncattr( 'GRID_FILE', os.path.basename( self.path( domain ) ) )
+
+# end class gridcache
@@ -0,0 +1,394 @@
+#! /usr/bin/env /usr/bin/python3
+
+#  hindcast.py
+#
+#  Copyright (c) 2026 agent
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#  or visit https://www.gnu.org/licenses/gpl-3.0-standalone.html
+#
+hindcast_copyright = 'hindcast.py Copyright (c) 2026 agent ' + \
+                     'released under GNU GPL V3.0'
+
+import os
+import sys
+import time
+import getopt
+import shutil
+import hashlib
+import datetime
+import concurrent.futures
+
+from postproc import postproc
+import ncout
+import gridcache
+import reprocess
+import blockzip
+
+## @file      hindcast.py
+## @brief     Reprocess archived WRF runs of a sector over a date range:
+##            recalculate ETo and rewrite the daily soil moisture
+##            variables (SMV) files.
+## @author    agent
+## @copyright Copyright (c) 2026 agent. All Rights Reserved.
+## @license   Released under GNU General Public License V3.0
+## @results   netCDF SMV files, progress manifest hindcast.json
+
+# Each day is one <archive>/<sector>/<date>.tar.gz as written by
+# run_wrfgfs.py. wrfout members are read straight out of the gzip stream,
+# nothing is untar'ed; days run in a process pool.
+#
+# Outputs are written to a temporary name and renamed when complete, so
+# a killed run never leaves a partial SMV file and rerunning a day simply
+# replaces its files. The manifest records each finished day with a
+# fingerprint of the ETo and merge code; a rerun skips days already done
+# with the same code and settings, so changing, for example, the albedo
+# in eto_FAO.py makes every day due again.
+
+# print functions to reduce clutter and to flush output
+def eprint( *args ):
+    print( *args, file=sys.stderr, flush=True)
+
+def oprint( *args ):
+    print( *args, file=sys.stdout, flush=True)
+
+class hindcast():
+
+    ## @param tarpath - archived run, <date>.tar.gz
+    ## @param dayout - output directory for the day
+    ## @param options - see read_args
+    def __init__( self, tarpath, dayout, options ):
+
+        self.tarpath = tarpath
+        self.dayout = dayout
+        self.options = options
+
+        self.grid = None
+        if options['grid']:
+            self.grid = gridcache.gridcache( os.path.dirname( dayout ) +
+                                             '/grid' )
+
+    # make it so; returns the output files and the WRF bytes read
+    def run( self ):
+
+        os.makedirs( self.dayout, exist_ok=True )
+
+        outputs = []
+        nbytes = 0
+
+        # read sequentially, no seeks; block compressed archives too
+        with blockzip.tarstream( self.tarpath ) as tar:
+            for member in tar:
+
+                name = os.path.basename( member.name )
+                if not member.isfile() or not name.startswith( 'wrfout_d' ):
+                    continue
+
+                # older archives may keep the ':' in the WRF names
+                name = name.replace( ':', '-' )
+                smv_path = self.dayout + '/' + self.options['sector'] + \
+                           '_SMV' + name[6:] + '.nc'
+                part_path = smv_path + '.part'
+
+                wrf_ds, scratch = reprocess.open_member( tar, member,
+                                                         self.options['memory'],
+                                                         self.options['scratch'],
+                                                         'hindcast_' )
+                nbytes += member.size
+
+                try:
+                    oper = postproc( wrf_ds, part_path, None,
+                                     self.options['latlongs'],
+                                     self.options['engine'],
+                                     self.options['nthreads'],
+                                     output=self.options['output'],
+                                     grid=self.grid )
+                    oper.run()
+                    os.replace( part_path, smv_path )
+
+                finally:
+                    wrf_ds.close()
+                    if scratch != None:
+                        shutil.rmtree( scratch, ignore_errors=True )
+                    if os.path.exists( part_path ):
+                        os.remove( part_path )
+
+                outputs.append( smv_path )
+
+        if len( outputs ) == 0:
+            raise IOError( 'no wrfout files in ' + self.tarpath )
+
+        return outputs, nbytes
+
+# end class hindcast
+
+# --------------------------------------------------------------------
+
+archive = '/output/'                              # <sector>/<date>.tar.gz
+outdir = '/students/agrineer/wrf/output/hindcast/' # <sector>/<date>/
+
+# command line options
+def usage():
+    eprint('usage: hindcast.py -h -l -R -g -n -z level -q N -e engine -j N -t N -m MB -a archive -o outdir -w scratch -s sector -b date <-u date>')
+    eprint('       hindcast.py --help --latlongs --redo --grid --netcdf4 --complevel=level --digits=N --engine=engine --jobs=N --threads=N --memory=MB --archive=archive --outdir=outdir --scratch=scratch --sector=sector --begin=date <--until=date>')
+    eprint('       reprocesses <archive>/<sector>/<date>.tar.gz from begin until')
+    eprint('       date (inclusive, YYYYMMDD), until defaults to begin')
+    eprint('       into <outdir>/<sector>/<date>/')
+    eprint('       --redo reprocesses days the manifest has as done')
+    eprint('       --latlongs includes XLAT, XLONG in SMV files')
+    eprint('       --grid checks each file against, and refers to, the')
+    eprint('       <outdir>/<sector>/grid cache; see gridcache.py')
+    eprint('       engine is fused (default), batch or hourly')
+    eprint('       --jobs processes N days at once (default 1)')
+    eprint('       --threads computes ETo row tiles on N threads (default 1)')
+    eprint('       --memory reads WRF files up to MB megabytes in memory,')
+    eprint('       larger ones go through scratch (default 4096)')
+    ncout.usage()
+
+# end usage
+
+# parse a positive integer option or exit
+def positive_int( name, arg ):
+
+    try:
+        value = int( arg )
+    except ValueError:
+        value = 0
+
+    if value < 1:
+        eprint( name, 'must be a positive integer' )
+        usage()
+        sys.exit(2)
+
+    return value
+
+# parse a YYYYMMDD option or exit
+def read_date( name, arg ):
+
+    try:
+        return datetime.datetime.strptime( arg, '%Y%m%d' ).date()
+    except ValueError:
+        eprint( name, 'must be a date, YYYYMMDD' )
+        usage()
+        sys.exit(2)
+
+def read_args( argv ):
+
+    options = { 'sector':None,
+                'begin':None,
+                'end':None,
+                'archive':archive,
+                'outdir':outdir,
+                'scratch':None,
+                'redo':False,
+                'grid':False,
+                'latlongs':False,
+                'engine':'fused',
+                'jobs':1,
+                'nthreads':1,
+                'memory':4096*1024*1024,
+                'output':{} }
+
+    try:
+        opts, args = getopt.getopt( argv,
+                                    'hlRgnz:q:e:j:t:m:a:o:w:s:b:u:',
+                                    ['help','latlongs','redo','grid','netcdf4',
+                                     'complevel=','digits=','engine=',
+                                     'jobs=','threads=','memory=',
+                                     'archive=','outdir=','scratch=',
+                                     'sector=','begin=','until='])
+    except getopt.GetoptError:
+        eprint('unknown command arguments')
+        usage()
+        sys.exit(2)
+
+    for opt, arg in opts:
+        try:
+            if ncout.read_arg( options['output'], opt, arg ):
+                continue
+        except ValueError as e:
+            eprint( e )
+            usage()
+            sys.exit(2)
+
+        if opt in ( '-h', '--help' ):
+            usage()
+            sys.exit(0)
+
+        elif opt in ( '-l', '--latlongs' ):
+            options['latlongs'] = True
+
+        elif opt in ( '-R', '--redo' ):
+            options['redo'] = True
+
+        elif opt in ( '-g', '--grid' ):
+            options['grid'] = True
+
+        elif opt in ( '-e', '--engine' ):
+            if arg not in [ 'fused', 'batch', 'hourly' ]:
+                eprint('unknown engine:', arg)
+                usage()
+                sys.exit(2)
+            options['engine'] = arg
+
+        elif opt in ( '-j', '--jobs' ):
+            options['jobs'] = positive_int( 'jobs', arg )
+
+        elif opt in ( '-t', '--threads' ):
+            options['nthreads'] = positive_int( 'threads', arg )
+
+        elif opt in ( '-m', '--memory' ):
+            options['memory'] = positive_int( 'memory', arg )*1024*1024
+
+        elif opt in ( '-a', '--archive' ):
+            options['archive'] = arg
+
+        elif opt in ( '-o', '--outdir' ):
+            options['outdir'] = arg
+
+        elif opt in ( '-w', '--scratch' ):
+            options['scratch'] = arg
+
+        elif opt in ( '-s', '--sector' ):
+            options['sector'] = arg
+
+        elif opt in ( '-b', '--begin' ):
+            options['begin'] = read_date( 'begin', arg )
+
+        elif opt in ( '-u', '--until' ):
+            options['end'] = read_date( 'until', arg )
+
+    if options['sector'] == None or options['begin'] == None:
+        usage()
+        sys.exit( 2 )
+
+    if options['end'] == None:
+        options['end'] = options['begin']
+
+    if options['end'] < options['begin']:
+        eprint('until date is before begin date')
+        sys.exit( 2 )
+
+    return options
+
+# end read_args
+
+# fingerprint of the code and settings producing the outputs
+def get_settings( options ):
+
+    sources = {}
+    here = os.path.dirname( os.path.abspath( __file__ ) )
+    for name in [ 'eto_FAO.py', 'merge.py', 'postproc.py', 'ncout.py' ]:
+        with open( here + '/' + name, 'rb' ) as f:
+            sources[name] = hashlib.sha1( f.read() ).hexdigest()
+
+    return { 'sources':sources,
+             'latlongs':options['latlongs'],
+             'engine':options['engine'],
+             'output':options['output'],
+             'grid':options['grid'] }
+
+# reprocess one archived day, run in the process pool
+def run_day( tarpath, dayout, options ):
+
+    start = time.time()
+    outputs, nbytes = hindcast( tarpath, dayout, options ).run()
+
+    return outputs, nbytes, time.time() - start
+
+if __name__ == '__main__':
+
+    options = read_args( sys.argv[1:] )
+    sector = options['sector']
+
+    srcdir = options['archive'] + '/' + sector + '/'
+    if not os.path.isdir( srcdir ):
+        eprint('directory:', srcdir, 'does not exist')
+        sys.exit(2)
+
+    sectordir = options['outdir'] + '/' + sector + '/'
+    os.makedirs( sectordir, exist_ok=True )
+
+    manifest_path = sectordir + 'hindcast.json'
+    manifest = reprocess.read_manifest( manifest_path, 'days' )
+    settings = get_settings( options )
+
+    # collect the days to do
+    days = []
+    day = options['begin']
+    while day <= options['end']:
+
+        date = day.strftime( '%Y%m%d' )
+        day += datetime.timedelta( days=1 )
+
+        tarpath = srcdir + date + '.tar.gz'
+        if not os.path.isfile( tarpath ):
+            eprint('no archive for', date + ', skipping.')
+            continue
+
+        if not options['redo'] and \
+           reprocess.is_done( manifest['days'].get( date ), settings ):
+            continue
+
+        days.append( ( date, tarpath ) )
+
+    eprint( len( days ), 'days to reprocess for', sector + '.' )
+
+    start = time.time()
+    ndone = 0
+    nfailed = 0
+    nbytes = 0
+
+    with concurrent.futures.ProcessPoolExecutor( options['jobs'] ) as pool:
+
+        futures = {}
+        for date, tarpath in days:
+            future = pool.submit( run_day, tarpath, sectordir + date, options )
+            futures[future] = date
+
+        for future in concurrent.futures.as_completed( futures ):
+
+            date = futures[future]
+            try:
+                outputs, size, seconds = future.result()
+            except Exception as e:
+                eprint( 'failed on', date + ':', repr(e) )
+                manifest['days'][date] = { 'status':'failed',
+                                           'error':repr(e) }
+                nfailed += 1
+            else:
+                manifest['days'][date] = { 'status':'done',
+                                           'outputs':outputs,
+                                           'seconds':round( seconds, 1 ),
+                                           'settings':settings }
+                ndone += 1
+                nbytes += size
+
+                hours = ( time.time() - start )/3600.0
+                eprint( 'completed', date, '(%d of %d), %.1f days/hour'
+                        % ( ndone + nfailed, len( days ), ndone/hours ) )
+
+            reprocess.write_manifest( manifest_path, manifest )
+
+    hours = ( time.time() - start )/3600.0
+    if hours > 0 and ndone > 0:
+        eprint( 'reprocessed %d days, %.1f GB of WRF output, in %.2f hours: '
+                '%.1f days/hour' % ( ndone, nbytes/1e9, hours, ndone/hours ) )
+
+    if nfailed > 0:
+        eprint( nfailed, 'of', len( days ), 'days failed' )
+        sys.exit(2)
+
+# end hindcast.py
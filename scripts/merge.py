@@ -33,6 +33,11 @@ import datetime
 import numpy as np
 from netCDF4 import Dataset
 
+import ncout
+import gridcache
+import tsstore
+from eto_FAO import run_domains
+
 ## @file      merge.py
 ## @brief     Selectively read WRF output meta and data variables 
 ##            (lat, long, min max temp, daily accumulated rain) used for ETo
@@ -41,7 +46,47 @@ from netCDF4 import Dataset
 ## @author    Scott L. Williams
 ## @copyright Copyright (c) 2018-2020 Scott L. Williams. All Rights Reserved.
 ## @license   Released under GNU General Public License V3.0
-## @results   netCDF4 file w/TMAX,TMIN,ETo,SFCEVP bands
+## @results   netCDF4 file w/PRECIP,TMAX,TMIN,ETo,SFCEVP bands
+
+# daily aggregates, "SOURCE+SOURCE: reduction,reduction"; sources are
+# added frame by frame before the reduction
+AGGREGATES = [ 'RAINC+RAINNC: last-minus-first',
+               'T2: min,max',
+               'SFCEVP: last' ]
+
+# frames 0 to 24, the hours bounding the day
+DAY_FRAMES = 25
+
+# reductions along the time axis of a day cube; sum adds the 24 hourly
+# frames after the first, as accumulations do
+REDUCTIONS = { 'min':lambda c: c.min( axis=0 ),
+               'max':lambda c: c.max( axis=0 ),
+               'mean':lambda c: c.mean( axis=0 ),
+               'sum':lambda c: c[1:].sum( axis=0 ),
+               'first':lambda c: c[0],
+               'last':lambda c: c[-1],
+               'last-minus-first':lambda c: c[-1] - c[0] }
+
+# reductions needing only the first and last frames
+ENDS_ONLY = [ 'first', 'last', 'last-minus-first' ]
+
+# names of known products: (output, description, units, offset); units
+# None keeps those of the first source. WRF's SFCEVP is in kg m-2, the
+# SMV files have always labelled it mm (it was cloned from RAINC)
+PRODUCTS = { ('RAINC+RAINNC','last-minus-first'):
+                 ( 'PRECIP', 'DAILY PRECIPITATION, mm', None, 0.0 ),
+             ('T2','min'):
+                 ( 'TMIN', 'DAILY MINIMUM TEMP at 2m, C', 'C', -273.15 ),
+             ('T2','max'):
+                 ( 'TMAX', 'DAILY MAXIMUM TEMP at 2m, C', 'C', -273.15 ),
+             ('T2','mean'):
+                 ( 'TMEAN', 'DAILY MEAN TEMP at 2m, C', 'C', -273.15 ),
+             ('SFCEVP','last'):
+                 ( 'SFCEVP', 'ACCUMULATED SURFACE EVAPORATION, mm', 'mm', 0.0 ),
+             ('SFCEVP','last-minus-first'):
+                 ( 'SFCEVP', 'DAILY SURFACE EVAPORATION, mm', 'mm', 0.0 ),
+             ('SNOWNC','last-minus-first'):
+                 ( 'SNOW', 'DAILY SNOW, mm', None, 0.0 ) }
 
 # print functions to reduce clutter and to flush output
 def eprint( *args ):
@@ -52,21 +97,63 @@ def oprint( *args ):
 
 class merge():
 
-    def __init__( self, wrf_path, eto_path, out_path, latlongs ):
-
-        # check if file names have same wrf_out_XXX_YYYY-MM-DD_VV_ZZ
-        wrf_filename = os.path.basename( wrf_path )
-        if wrf_filename in eto_path:
-            self.eto_path = eto_path
-        else:
-            raise IOError( 'ETo filename must contain input WRF filename' )
+    ## @param wrf_path - WRF output file, or an already open Dataset
+    ## @param eto_path - ETo_FAO_*.npy file from eto_FAO.py, or None
+    ##                   when eto_buf is given
+    ## @param out_path - output SMV netCDF file
+    ## @param latlongs - include XLAT, XLONG variables
+    ## @param eto_buf - daily ETo array in WRF row order (no flip needed)
+    ## @param cache - dictionary of WRF variables already read, keyed by
+    ##                name; arrays are indexed by time like the variables
+    ## @param aggregates - daily aggregate strings, default AGGREGATES
+    ## @param output - output format keyword arguments, see ncout.ncout
+    ## @param grid - sector gridcache.gridcache; the output references it
+    ##               and XLAT, XLONG come from it
+    ## @param series - sector series directory; the day's variables are
+    ##                 appended to the domain's tsstore.tsstore there
+    def __init__( self, wrf_path, eto_path, out_path, latlongs,
+                  eto_buf=None, cache=None, aggregates=None, output=None,
+                  grid=None, series=None ):
+
+        self.eto_buf = eto_buf
+
+        if aggregates == None:
+            aggregates = AGGREGATES
+        self.aggregates = aggregates
+
+        if eto_buf is None:
+
+            # check if file names have same wrf_out_XXX_YYYY-MM-DD_VV_ZZ
+            wrf_filename = os.path.basename( wrf_path )
+            if wrf_filename in eto_path:
+                self.eto_path = eto_path
+            else:
+                raise IOError( 'ETo filename must contain input WRF filename' )
 
         # include latlongs?
         self.latlongs = latlongs
+        self.grid = grid
+        self.series = series
+
+        # variables read by the caller
+        if cache == None:
+            cache = {}
+        self.cache = cache
 
         # open netcdf files
-        self.wrf_ds = Dataset( wrf_path, 'r' )
-        self.out_ds = Dataset( out_path, 'w', format='NETCDF3_CLASSIC' )
+        if isinstance( wrf_path, Dataset ):
+            self.wrf_ds = wrf_path
+        else:
+            self.wrf_ds = Dataset( wrf_path, 'r' )
+
+        if output == None:
+            output = {}
+        # a few maps, small enough to build in memory
+        self.out = ncout.ncout( out_path, inmemory=True, **output )
+        self.out_ds = self.out.ds
+
+        # data to write once all variables are defined, ( name, values )
+        self.pending = []
 
         # our attributes, per WRF
         self.attr = [ 'TITLE',
@@ -159,13 +246,26 @@ class merge():
 
         return nc_attrs, nc_dims, nc_vars
 
+    # read a whole WRF variable, from the cache if the caller has it
+    def wrf_var( self, key ):
+
+        if key in self.cache:
+            return self.cache[key]
+
+        wvars = self.wrf_ds.variables
+        if key not in wvars:
+            raise IOError( '"' + key + '" variable is not in WRF file' )
+
+        return wvars[key][:]
+
     # clone a netcdf variable
     def clone_var( self, outkey, inkey ):
 
         wvar = self.wrf_ds.variables[inkey]
         dtype = wvar.dtype 
-        ds_var = self.out_ds.createVariable( outkey, dtype, 
-                                             ('south_north', 'west_east') )
+        ds_var = self.out.create_var( outkey, dtype,
+                                      ('south_north', 'west_east'),
+                                      quantize=outkey not in [ 'XLAT', 'XLONG' ] )
         # copy over variable attributes
         for ncattr in wvar.ncattrs():
 
@@ -224,62 +324,38 @@ class merge():
         if 'XLONG' not in wvars:
             raise IOError( '"XLONG" variable is not in WRF file' )
 
+        if self.grid != None:
+            xlat, xlong = self.grid.load( self.domain )
+            self.clone_var( 'XLAT','XLAT' )
+            self.pending.append( ( 'XLAT', xlat ) )
+            self.clone_var( 'XLONG','XLONG' )
+            self.pending.append( ( 'XLONG', xlong ) )
+            return
+
         self.clone_var( 'XLAT','XLAT' )
-        self.out_ds.variables['XLAT'][:] = wvars['XLAT'][0]
+        if 'XLAT' in self.cache:
+            self.pending.append( ( 'XLAT', self.cache['XLAT'][0] ) )
+        else:
+            self.pending.append( ( 'XLAT', wvars['XLAT'][0] ) )
 
         self.clone_var( 'XLONG','XLONG' )
-        self.out_ds.variables['XLONG'][:] = wvars['XLONG'][0]
-
-    # make PRECIP variable
-    def make_precip( self ):
-
-        wvars = self.wrf_ds.variables
-
-        if 'RAINC' not in wvars:
-            raise IOError( '"RAINC" variable is not in WRF file' )
-
-        if 'RAINNC' not in wvars:
-            raise IOError( '"RAINNC" variable is not in WRF file' )
-
-        # extract accumulated rains and add
-        ac_rainc = wvars['RAINC'][24]          # 0-index
-        ac_rainnc = wvars['RAINNC'][24]
-        ac_rain = ac_rainc + ac_rainnc
-
-        # TODO: factor snow precip with SNOWNC variable
-        
-        # make PRECIP variable
-        precip = self.clone_var( 'PRECIP','RAINC' )
-        precip.setncattr( 'description', 'DAILY PRECIPITATION, mm' )
-        self.out_ds.variables['PRECIP'][:] = ac_rain
-
-        return precip
-        
-    # make SFCEVP variable
-    def make_sfcevp( self ):
-
-        wvars = self.wrf_ds.variables
-
-        if 'SFCEVP' not in wvars:
-            raise IOError( '"SFCEVP" variable is not in the WRF file' )
-
-        # extract accumulated surface evaporation
-        ac_sfcevp = wvars['SFCEVP'][24]          # 0-index
-      
-        # make SFCEVP variable
-        sfcevp = self.clone_var( 'SFCEVP','RAINC' )
-        sfcevp.setncattr( 'description', 'ACCUMULATED SURFACE EVAPORATION, mm' )
-        self.out_ds.variables['SFCEVP'][:] = ac_sfcevp
+        if 'XLONG' in self.cache:
+            self.pending.append( ( 'XLONG', self.cache['XLONG'][0] ) )
+        else:
+            self.pending.append( ( 'XLONG', wvars['XLONG'][0] ) )
 
     # load standard evaporation data from numpy file
     def load_eto( self, shape ):
 
-        etobuf = np.load( self.eto_path )         # load from file 
+        if self.eto_buf is not None:
+            etobuf = self.eto_buf                 # given, WRF row order
+        else:
+            etobuf = np.flipud( np.load( self.eto_path ) ) # load from file 
 
         # check compatibility
         if etobuf.shape != shape:
             eprint('ETo and WRF input files have incompatible shapes')
-            eprint('ETo:', etobuf.shape, 'WRF:', precip.shape)
+            eprint('ETo:', etobuf.shape, 'WRF:', shape)
             raise IOError( 'bad shapes' )
 
         # make ETo variable
@@ -288,39 +364,100 @@ class merge():
                        'DAILY STANDARD REFERENCE EVAPORATION, mm' )
 
         # insert data value
-        self.out_ds.variables['STDEVP'][:] = np.flipud( etobuf[:] )
+        self.pending.append( ( 'STDEVP', etobuf ) )
+
+    # parse "SOURCE+SOURCE: reduction,reduction" strings into products,
+    # (output, sources, reduction, description, units, offset) tuples
+    def parse_aggregates( self, specs ):
+
+        products = []
+        for spec in specs:
 
-    # make daily temperature min, max variables
-    def make_temps( self ):
+            if ':' not in spec:
+                raise ValueError( 'aggregate must be "SOURCES: reductions": ' +
+                                  spec )
+
+            expr, reductions = spec.split( ':', 1 )
+            expr = expr.replace( ' ', '' )
+            sources = expr.split( '+' )
+
+            for reduction in reductions.split( ',' ):
+                reduction = reduction.strip()
+                if reduction not in REDUCTIONS:
+                    raise ValueError( 'unknown reduction: ' + reduction )
+
+                if ( expr, reduction ) in PRODUCTS:
+                    output, description, units, offset = \
+                        PRODUCTS[( expr, reduction )]
+                else:
+                    output = ( '_'.join( sources ) + '_' +
+                               reduction.replace( '-', '_' ) ).upper()
+                    description = 'DAILY ' + reduction.upper() + ' OF ' + expr
+                    units = None
+                    offset = 0.0
+
+                products.append( ( output, sources, reduction,
+                                   description, units, offset ) )
+
+        return products
+
+    # read each source once; the whole day if any of its reductions needs
+    # it, else only the first and last frames
+    def read_sources( self, products ):
 
         wvars = self.wrf_ds.variables
 
-        if 'T2' not in wvars:
-            raise IOError( '"T2" variable is not in WRF file' )
+        whole = {}
+        for output, sources, reduction, description, units, offset in products:
+            for name in sources:
+                if name not in wvars:
+                    raise IOError( '"' + name + '" variable is not in WRF file' )
+                whole[name] = whole.get( name, False ) or \
+                              reduction not in ENDS_ONLY
+
+        cubes = {}
+        for name in whole:
+            if whole[name]:
+                cubes[name] = self.wrf_var( name )[0:DAY_FRAMES]
+            elif name in self.cache:
+                cubes[name] = self.cache[name][[0,DAY_FRAMES-1]]
+            else:
+                cubes[name] = np.stack( [ wvars[name][0],
+                                          wvars[name][DAY_FRAMES-1] ] )
+
+            if cubes[name].shape[0] < 2:
+                raise IOError( '"' + name + '" has too few time steps' )
+
+        return cubes
 
-        # allocate and initialize min, max buffers
-        tmin = wvars['T2'][0]
-        tmax = tmin
+    # make the daily aggregate variables
+    def make_aggregates( self ):
 
-        # get hourly temps and compare
-        for i in range(1,25):
+        products = self.parse_aggregates( self.aggregates )
+        cubes = self.read_sources( products )
 
-            tmin = np.minimum( tmin, wvars['T2'][i] )
-            tmax = np.maximum( tmax, wvars['T2'][i] )
+        sums = {}
+        for output, sources, reduction, description, units, offset in products:
 
-        tmin -= 273.15
-        tmax -= 273.15
+            # sum of sources, once per expression
+            expr = '+'.join( sources )
+            if expr not in sums:
+                sums[expr] = cubes[sources[0]]
+                for name in sources[1:]:
+                    sums[expr] = sums[expr] + cubes[name]
 
-        # make temp variables
-        tmin_var = self.clone_var( 'TMIN','T2' )
-        tmin_var.setncattr( 'description', 'DAILY MINIMUM TEMP at 2m, C' )
-        tmin_var.setncattr( 'units', 'C' )
-        self.out_ds.variables['TMIN'][:] = tmin
+            values = REDUCTIONS[reduction]( sums[expr] )
+            if offset != 0.0:
+                # the float32 values are offset in double precision and
+                # stored back as float32; the in-place tmin -= 273.15 this
+                # replaces, on masked arrays, rounded the same way
+                values = values.astype( np.float64 ) + offset
 
-        tmax_var = self.clone_var( 'TMAX','T2' )
-        tmax_var.setncattr( 'description', 'DAILY MAXIMUM TEMP at 2m, C' )
-        tmax_var.setncattr( 'units', 'C' )
-        self.out_ds.variables['TMAX'][:] = tmax
+            ds_var = self.clone_var( output, sources[0] )
+            ds_var.setncattr( 'description', description )
+            if units != None:
+                ds_var.setncattr( 'units', units )
+            self.pending.append( ( output, values ) )
 
     # make it so
     def run( self ):
@@ -334,17 +471,20 @@ class merge():
         self.sift_attrs()
         self.sift_dims()
 
-        # calculate total rain and make new variable PRECIP
-        precip = self.make_precip()
+        # check the grid against the sector's and refer to it
+        if self.grid != None:
+            self.domain = gridcache.domain_of( self.wrf_ds.filepath() )
+            key = self.grid.check( self.wrf_ds, self.domain )
+            self.grid.reference( self.out_ds, self.domain, key )
 
-        # load ETo data and make new variable STDEVP
-        self.load_eto( precip.shape )
-
-        # find daily temp mins and maxs, used to calulate growing degree days.
-        self.make_temps()
+        # daily rain, temp mins and maxs (used to calulate growing degree
+        # days), SFCEVP for comparisons, ...
+        self.make_aggregates()
 
-        # merge the SFCEVP variable for comparisons
-        self.make_sfcevp()
+        # load ETo data and make new variable STDEVP
+        shape = ( len( self.wrf_ds.dimensions['south_north'] ),
+                  len( self.wrf_ds.dimensions['west_east'] ) )
+        self.load_eto( shape )
         
         # copy lat,long variables.
         # default is False.
@@ -355,7 +495,36 @@ class merge():
 
         # report output data
         #self.wrf_info( self.out_ds, verb=True ) 
-        self.out_ds.close()
+
+        # all variables are defined, write the data
+        for name, values in self.pending:
+            self.out.write( name, values )
+
+        if self.series != None:
+            self.append_series()
+        self.pending = []
+
+        self.out.close()
+
+    # append the day's variables to the sector time series store
+    def append_series( self ):
+
+        domain, date = tsstore.domain_date( self.wrf_ds.filepath() )
+
+        values = {}
+        attrs = {}
+        for name, data in self.pending:
+            if name in tsstore.SKIP_VARS:
+                continue
+            var = self.out_ds.variables[name]
+            values[name] = data
+            attrs[name] = dict( ( a, var.getncattr( a ) ) for a in var.ncattrs() )
+
+        gattrs = dict( ( a, self.out_ds.getncattr( a ) )
+                       for a in self.out_ds.ncattrs() )
+
+        store = tsstore.tsstore( tsstore.store_path( self.series, domain ) )
+        store.append( date, values, attrs, gattrs )
 
 # end class merge    
 
@@ -363,26 +532,51 @@ class merge():
 
 # command line options
 def usage():
-    eprint('usage: merge.py -h -s sectorname <-l True/False> <-r date>')
-    eprint('       merge.py --help --sector=sectorname <--latlongs=True/False> <--rundate=date>')
+    eprint('usage: merge.py -h -g -u -n -z level -q N -s sectorname <-l True/False> <-r date> <-j N> <-a aggregate>')
+    eprint('       merge.py --help --grid --series --netcdf4 --complevel=level --digits=N --sector=sectorname <--latlongs=True/False> <--rundate=date> <--jobs=N> <--aggregate=aggregate>')
     eprint('       omitting rundate defaults to yesterday data')
+    eprint('       --jobs merges N domain files at once (default 1)')
+    eprint('       --aggregate adds daily variables, eg. "T2: mean" or')
+    eprint('       "SNOWNC: last-minus-first"; reductions are')
+    eprint('       ' + ', '.join( REDUCTIONS ) )
+    eprint('       --grid checks each file against, and refers to, the')
+    eprint('       sector grid cache; see gridcache.py')
+    eprint('       --series appends the daily variables to the sector time')
+    eprint('       series store; see tsstore.py')
+    ncout.usage()
   
 def read_args( argv ):
 
     rundate = None
     sector = None
     latlongs = False
+    jobs = 1
+    aggregates = list( AGGREGATES )
+    output = {}
+    grid = False
+    series = False
 
     try:                                
         opts, args = getopt.getopt( argv,
-                                    'hs:l:r:', 
-                                    ['help','sector=','latlongs=','rundate='])
+                                    'hgunz:q:s:l:r:j:a:', 
+                                    ['help','grid','series','netcdf4','complevel=',
+                                     'digits=',
+                                     'sector=','latlongs=','rundate=',
+                                     'jobs=','aggregate='])
     except getopt.GetoptError: 
         eprint('unknown command arguments')
         usage()                          
         sys.exit(2)  
                    
     for opt, arg in opts:   
+        try:
+            if ncout.read_arg( output, opt, arg ):
+                continue
+        except ValueError as e:
+            eprint( e )
+            usage()
+            sys.exit( 2 )
+
         if opt in ( '-h', '--help' ): 
             usage()                     
             sys.exit(0)       
@@ -400,11 +594,30 @@ def read_args( argv ):
         elif opt in ( '-r', '--rundate' ):
             rundate = arg  
 
+        elif opt in ( '-j', '--jobs' ):
+            try:
+                jobs = int( arg )
+            except ValueError:
+                jobs = 0
+            if jobs < 1:
+                eprint('jobs must be a positive integer')
+                usage()
+                sys.exit( 2 )
+
+        elif opt in ( '-a', '--aggregate' ):
+            aggregates.append( arg )
+
+        elif opt in ( '-g', '--grid' ):
+            grid = True
+
+        elif opt in ( '-u', '--series' ):
+            series = True
+
     if sector == None:
         usage()                     
         sys.exit( 2 )
 
-    return rundate, sector, latlongs
+    return rundate, sector, latlongs, jobs, aggregates, output, grid, series
 
 # return days to use from date
 def get_days( date ):
@@ -426,11 +639,22 @@ def get_days( date ):
 
     return yesterday, today
 
+# merge one domain file in the current directory
+def merge_domain( w, sector, latlongs, aggregates, output, grid, series ):
+
+    eprint('merging ETo data with', w)
+    oper = merge( w, 'ETo_FAO_' + w + '.npy', sector + '_SMV' + w[6:] + '.nc',
+                  latlongs, aggregates=aggregates, output=output, grid=grid,
+                  series=series )
+    oper.run() 
+
 if __name__ == '__main__':  
 
     outdir = '/students/agrineer/wrf/output'
 
-    rundate, sector, l = read_args( sys.argv[1:] ) # get run date, domain sector
+    # get run date, sector
+    rundate, sector, l, jobs, aggregates, output, grid, series = \
+        read_args( sys.argv[1:] )
     yesterday,today = get_days( rundate )          # parse dates from run date
 
     # date data directory
@@ -452,11 +676,23 @@ if __name__ == '__main__':
     os.chdir( indir )
 
     # process all domains
-    for w in glob.glob( 'wrfout_d*' ):
-    
-        eprint('merging ETo data with', w)
-        oper = merge( w, 'ETo_FAO_' + w + '.npy', sector + '_SMV' + w[6:] + '.nc',
-                      l )
-        oper.run() 
+    files = sorted( glob.glob( 'wrfout_d*' ) )
+    if grid:
+        grid = gridcache.gridcache( outdir + '/' + sector + '/grid' )
+    else:
+        grid = None
+
+    # each domain has its own store, safe to append to in parallel
+    if series:
+        series = outdir + '/' + sector + '/series'
+    else:
+        series = None
+
+    nfailed = run_domains( files, jobs, merge_domain, sector, l,
+                           aggregates, output, grid, series )
+
+    if nfailed > 0:
+        eprint( nfailed, 'of', len( files ), 'domains failed' )
+        sys.exit(2)
 
 # end merge.py
@@ -0,0 +1,244 @@
+#  ncout.py
+#
+#  Copyright (c) 2026 agent
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#  or visit https://www.gnu.org/licenses/gpl-3.0-standalone.html
+#
+ncout_copyright = 'ncout.py Copyright (c) 2026 agent ' + \
+                  'released under GNU GPL V3.0'
+
+import os
+import sys
+import time
+
+import numpy as np
+from netCDF4 import Dataset
+
+## @file      ncout.py
+## @brief     netCDF output file for the merge and filter scripts:
+##            classic or compressed, chunked NETCDF4 format.
+## @author    agent
+## @copyright Copyright (c) 2026 agent. All Rights Reserved.
+## @license   Released under GNU General Public License V3.0
+
+# NETCDF3_CLASSIC files are fixed layout: define every variable before
+# writing any data, otherwise each new variable moves the data already
+# written through the file. Defining a variable still moves the fixed
+# size variables before it, as does setting an attribute; keep a time
+# dimension unlimited (record variables are not moved while there are no
+# records) or, for small files, build the file in memory.
+#
+# NETCDF4 variables are zlib compressed with the shuffle filter, chunked
+# so a map (one time step) and a pixel time series both touch few chunks.
+# The file is synced after each variable written so its stored size,
+# and the compression ratio, can be reported.
+
+# print functions to reduce clutter and to flush output
+def eprint( *args ):
+    print( *args, file=sys.stderr, flush=True)
+
+# output formats
+FORMATS = [ 'NETCDF3_CLASSIC', 'NETCDF4' ]
+
+# chunk size aimed for, in values (1 MB of float32)
+CHUNK_VALUES = 256*1024
+
+class ncout():
+
+    ## @param path - output netCDF file
+    ## @param format - NETCDF3_CLASSIC (default) or NETCDF4
+    ## @param complevel - NETCDF4 zlib level, 1 to 9
+    ## @param shuffle - NETCDF4 shuffle filter
+    ## @param digits - NETCDF4 least_significant_digit quantization of
+    ##                 data variables, None keeps full precision
+    ## @param report - report each variable's write time and compression
+    ## @param inmemory - build a NETCDF3_CLASSIC file in memory and write
+    ##                   it on close; for small files
+    ## @param tobytes - build the file in memory and return its bytes from
+    ##                  close(); nothing is written to path
+    def __init__( self, path, format='NETCDF3_CLASSIC', complevel=4,
+                  shuffle=True, digits=None, report=False, inmemory=False,
+                  tobytes=False ):
+
+        if format not in FORMATS:
+            raise ValueError( 'unknown output format: ' + str(format) )
+
+        self.path = path
+        self.format = format
+        self.complevel = complevel
+        self.shuffle = shuffle
+        self.digits = digits
+        self.report = report
+        self.tobytes = tobytes
+
+        if tobytes:
+            # memory is the initial size, the buffer grows as needed
+            self.ds = Dataset( path, 'w', format=format, memory=1 )
+        else:
+            diskless = inmemory and format == 'NETCDF3_CLASSIC'
+            self.ds = Dataset( path, 'w', format=format, diskless=diskless,
+                               persist=diskless )
+
+        # every variable is written whole, prefilling is wasted I/O
+        self.ds.set_fill_off()
+
+        # name: [ raw bytes, stored bytes, seconds ]
+        self.stats = {}
+        self.size = None
+
+    # chunk shape balancing map and time series reads: for ( Time, y, x )
+    # and a chunk of N values the map read touches (y/cy)*(x/cx) chunks,
+    # the time series T/ct; equal when cy/y = cx/x = (N/T*y*x)**(1/4)
+    def chunks( self, shape ):
+
+        if len( shape ) < 2:
+            return list( shape )
+
+        nmap = shape[-2]*shape[-1]
+        nt = 1
+        for n in shape[:-2]:
+            nt *= n
+
+        if nt*nmap <= CHUNK_VALUES:
+            return list( shape )
+
+        frac = min( 1.0, ( CHUNK_VALUES/float( nt*nmap ) )**0.25 )
+        cy = max( 1, int( shape[-2]*frac ) )
+        cx = max( 1, int( shape[-1]*frac ) )
+
+        # the remaining dimensions (time, soil levels) share what is left
+        left = max( 1, CHUNK_VALUES//( cy*cx ) )
+        lead = []
+        for n in shape[:-2]:
+            c = max( 1, min( n, left ) )
+            lead.append( c )
+            left = max( 1, left//c )
+
+        return lead + [ cy, cx ]
+
+    ## @param quantize - apply the digits quantization; False for
+    ##                   coordinates, which are kept exact
+    ## @param shape - shape of the data to be written, for chunking
+    ##                along unlimited dimensions
+    ## @param fill_value - _FillValue, None for the netCDF default
+    def create_var( self, name, dtype, dims, quantize=True, shape=None,
+                    fill_value=None ):
+
+        if self.format == 'NETCDF3_CLASSIC':
+            return self.ds.createVariable( name, dtype, dims,
+                                           fill_value=fill_value )
+
+        if shape == None:
+            shape = [ max( 1, len( self.ds.dimensions[d] ) ) for d in dims ]
+
+        kwargs = { 'fill_value':fill_value,
+                   'zlib':True,
+                   'complevel':self.complevel,
+                   'shuffle':self.shuffle,
+                   'chunksizes':self.chunks( shape ) }
+
+        if quantize and self.digits != None and \
+           np.dtype( dtype ).kind == 'f':
+            kwargs['least_significant_digit'] = self.digits
+
+        return self.ds.createVariable( name, dtype, dims, **kwargs )
+
+    # write data to a variable, keeping its statistics
+    def write( self, name, data, index=Ellipsis ):
+
+        if name not in self.stats:
+            self.stats[name] = [ 0, 0, 0.0 ]
+
+        var = self.ds.variables[name]
+        measure = self.format == 'NETCDF4' and self.report and \
+                  not self.tobytes
+
+        # size of the file before the first data
+        if measure and self.size == None:
+            self.ds.sync()
+            self.size = os.path.getsize( self.path )
+
+        start = time.perf_counter()
+
+        var[index] = data
+
+        if measure:
+            self.ds.sync()
+            size = os.path.getsize( self.path )
+            self.stats[name][1] += size - self.size
+            self.size = size
+
+        self.stats[name][2] += time.perf_counter() - start
+        self.stats[name][0] += np.asarray( data ).size*var.dtype.itemsize
+
+    # close the file; returns its bytes when built with tobytes
+    def close( self ):
+
+        data = self.ds.close()
+
+        if self.report:
+            eprint( 'wrote', self.path, '(' + self.format + ')' )
+            for name in self.stats:
+                raw, stored, seconds = self.stats[name]
+                if self.format == 'NETCDF3_CLASSIC' or self.tobytes:
+                    stored = raw
+                ratio = raw/float( stored ) if stored > 0 else float( 'inf' )
+                eprint( '    %-10s %10d bytes %10d stored %6.2f ratio %8.3f s'
+                        % ( name, raw, stored, ratio, seconds ) )
+
+        if self.tobytes:
+            return data
+
+# end class ncout
+
+# --------------------------------------------------------------------
+
+# the command line options shared by the scripts writing netCDF
+def usage():
+    eprint('       --netcdf4 writes compressed, chunked NETCDF4 files')
+    eprint('       and reports each variable\'s compression and write time')
+    eprint('       --complevel sets the NETCDF4 zlib level 1-9 (default 4)')
+    eprint('       --digits quantizes NETCDF4 data variables to N decimal')
+    eprint('       digits (least_significant_digit)')
+
+# parse one of the options above into the output dictionary, the ncout
+# keyword arguments; returns False if opt is not one of them
+def read_arg( output, opt, arg ):
+
+    if opt in ( '-n', '--netcdf4' ):
+        output['format'] = 'NETCDF4'
+        output['report'] = True
+
+    elif opt in ( '-z', '--complevel' ):
+        try:
+            output['complevel'] = int( arg )
+        except ValueError:
+            output['complevel'] = 0
+        if output['complevel'] < 1 or output['complevel'] > 9:
+            raise ValueError( 'complevel must be 1 to 9' )
+
+    elif opt in ( '-q', '--digits' ):
+        try:
+            output['digits'] = int( arg )
+        except ValueError:
+            raise ValueError( 'digits must be an integer' )
+
+    else:
+        return False
+
+    return True
+
+# end ncout.py
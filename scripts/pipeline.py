@@ -0,0 +1,370 @@
+#  pipeline.py
+#
+#  Copyright (c) 2026 agent
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#  or visit https://www.gnu.org/licenses/gpl-3.0-standalone.html
+#
+pipeline_copyright = 'pipeline.py Copyright (c) 2026 agent ' + \
+                     'released under GNU GPL V3.0'
+
+import os
+import sys
+import glob
+import json
+import time
+import hashlib
+import datetime
+import threading
+import concurrent.futures
+
+## @file      pipeline.py
+## @brief     Stage graph runner for the WPS/WRF runs: stages declare the
+##            files they read and write, a stage waits for the stages
+##            writing its inputs, independent stages run at once and each
+##            stage's status is recorded in a JSON file.
+## @author    agent
+## @copyright Copyright (c) 2026 agent. All Rights Reserved.
+## @license   Released under GNU General Public License V3.0
+
+# Files are absolute paths or glob patterns; a stage depends on the
+# last stage added before it whose outputs list one of its inputs,
+# verbatim, and on the stages named in its after list. Runs reusing a
+# directory write the same paths, each reader waits for the writer of
+# its own run. Before a stage runs its inputs must exist, after it
+# runs its outputs must. A failed stage blocks the stages depending
+# on it, the others run on.
+#
+# Stages run on threads and must not change directory; the programs
+# they start are given their working directory. A watcher stage, one
+# that waits on stages started after it (eg. polls their status), runs
+# on a thread of its own beside the jobs, so it cannot hold the job
+# the stages it waits for need.
+#
+# A resumable stage is checkpointed when it completes: a hash of its
+# inputs, the files it depends on (namelists, executables) and its
+# parameters, with the size and mtime of its outputs. A rerun skips it
+# while the hash is the same and the outputs are as it left them, so a
+# retry resumes at the first stage whose outputs are missing or stale.
+# A stage that reruns rewrites its outputs, changing the hash of the
+# stages reading them.
+
+# print functions to reduce clutter and to flush output
+def eprint( *args ):
+    print( *args, file=sys.stderr, flush=True)
+
+def oprint( *args ):
+    print( *args, file=sys.stdout, flush=True)
+
+# files up to this size are hashed by content, larger ones (GFS files,
+# executables) by size and mtime
+HASH_BYTES = 1024*1024
+
+# stage states
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+BLOCKED = 'blocked'     # a stage it depends on failed
+
+class stage():
+
+    ## @param name - unique name, eg. '20220501/ungrib'
+    ## @param run - callable doing the work, raises on failure
+    ## @param inputs - files read, paths or glob patterns
+    ## @param outputs - files written, paths or glob patterns
+    ## @param after - names of stages to wait for besides the writers
+    ##                of the inputs
+    ## @param resume - skip the stage when its checkpoint is current
+    ## @param depends - other files the outputs depend on, for the
+    ##                  checkpoint hash only
+    ## @param params - parameters the outputs depend on, eg. the run dates
+    ## @param watcher - run beside the jobs, not counted against them
+    def __init__( self, name, run, inputs=(), outputs=(), after=(),
+                  resume=False, depends=(), params=None, watcher=False ):
+
+        self.name = name
+        self.run = run
+        self.inputs = list( inputs )
+        self.outputs = list( outputs )
+        self.after = list( after )
+        self.resume = resume
+        self.depends = list( depends )
+        self.params = params
+        self.watcher = watcher
+
+# end class stage
+
+# does a path or glob pattern name an existing file
+def exists( pattern ):
+    return len( glob.glob( pattern ) ) > 0
+
+# checkpoint hash of a stage's inputs, depends and params
+def stage_key( s ):
+
+    h = hashlib.sha1( repr( s.params ).encode( 'utf-8' ) )
+    for pattern in s.inputs + s.depends:
+        for path in sorted( glob.glob( pattern ) ):
+            st = os.stat( path )
+            h.update( path.encode( 'utf-8' ) )
+            if st.st_size <= HASH_BYTES:
+                with open( path, 'rb' ) as f:
+                    h.update( f.read() )
+            else:
+                h.update( ( '%d %d' % ( st.st_size,
+                                        st.st_mtime_ns ) ).encode( 'utf-8' ) )
+
+    return h.hexdigest()
+
+# { path:[ size, mtime ] } of a stage's outputs
+def output_stats( s ):
+
+    stats = {}
+    for pattern in s.outputs:
+        for path in glob.glob( pattern ):
+            st = os.stat( path )
+            stats[path] = [ st.st_size, st.st_mtime_ns ]
+
+    return stats
+
+class pipeline():
+
+    ## @param statepath - JSON file to record stage status in, None for none
+    ## @param jobs - stages run at once
+    ## @param checkpath - JSON file of the resumable stages' checkpoints,
+    ##                    kept across runs; None to always run them
+    def __init__( self, statepath=None, jobs=2, checkpath=None ):
+
+        self.statepath = statepath
+        self.jobs = max( 1, jobs )
+        self.stages = {}
+        self.order = []        # names, in the order added
+        self.state = {}
+        self.lock = threading.Lock()
+
+        self.checkpath = checkpath
+        self.checkpoints = {}
+        if checkpath != None and os.path.isfile( checkpath ):
+            try:
+                with open( checkpath, 'r' ) as f:
+                    self.checkpoints = json.load( f )
+            except ValueError:
+                eprint( 'ignoring unreadable checkpoints:', checkpath )
+
+        # forget the ones whose outputs were removed or rewritten since
+        for name in list( self.checkpoints ):
+            for path, stat in self.checkpoints[name]['outputs'].items():
+                if not os.path.exists( path ) or \
+                   [ os.stat( path ).st_size,
+                     os.stat( path ).st_mtime_ns ] != stat:
+                    del self.checkpoints[name]
+                    break
+
+    def add( self, s ):
+
+        if s.name in self.stages:
+            raise ValueError( 'duplicate stage: ' + s.name )
+
+        self.stages[s.name] = s
+        self.order.append( s.name )
+        self.state[s.name] = { 'status':PENDING }
+        return s
+
+    # names of the stages a stage waits for
+    def dependencies( self, s ):
+
+        deps = set( s.after )
+
+        # last writer of each input
+        writers = {}
+        for name in self.order[:self.order.index( s.name )]:
+            for pattern in self.stages[name].outputs:
+                writers[pattern] = name
+
+        for pattern in s.inputs:
+            if pattern in writers:
+                deps.add( writers[pattern] )
+
+        for name in deps:
+            if name not in self.stages:
+                raise ValueError( s.name + ' waits for unknown stage: ' + name )
+
+        return deps
+
+    # record a stage's status
+    def record( self, name, **fields ):
+
+        with self.lock:
+            self.state[name].update( fields )
+            if self.statepath == None:
+                return
+
+            part = self.statepath + '.part'
+            with open( part, 'w' ) as f:
+                json.dump( { 'stages':self.state, 'order':self.order }, f,
+                           indent=1 )
+            os.replace( part, self.statepath )
+
+    # set or, with key None, drop a stage's checkpoint
+    def checkpoint( self, s, key ):
+
+        with self.lock:
+            if key == None:
+                self.checkpoints.pop( s.name, None )
+            else:
+                self.checkpoints[s.name] = { 'key':key,
+                                             'outputs':output_stats( s ) }
+            if self.checkpath == None:
+                return
+
+            part = self.checkpath + '.part'
+            with open( part, 'w' ) as f:
+                json.dump( self.checkpoints, f, indent=1 )
+            os.replace( part, self.checkpath )
+
+    # are a stage's outputs current for its inputs
+    def current( self, s, key ):
+
+        with self.lock:
+            point = self.checkpoints.get( s.name )
+
+        return point != None and point['key'] == key and \
+               len( point['outputs'] ) > 0 and \
+               point['outputs'] == output_stats( s )
+
+    # run one stage, checking its files
+    # returns True if its checkpoint was current and it was skipped
+    def execute( self, s ):
+
+        for pattern in s.inputs:
+            if not exists( pattern ):
+                raise IOError( 'missing input: ' + pattern )
+
+        key = None
+        if s.resume and self.checkpath != None:
+            key = stage_key( s )
+            if self.current( s, key ):
+                return True
+
+            # outputs are invalid while it runs
+            self.checkpoint( s, None )
+
+        s.run()
+
+        for pattern in s.outputs:
+            if not exists( pattern ):
+                raise IOError( 'missing output: ' + pattern )
+
+        if key != None:
+            self.checkpoint( s, key )
+
+        return False
+
+    # running stages taking a job
+    def busy( self, running ):
+        return len( [ name for name, start in running.values()
+                      if not self.stages[name].watcher ] )
+
+    ## run the stages
+    ## @return True if every stage completed
+    def run( self ):
+
+        deps = {}
+        for name in self.order:
+            deps[name] = self.dependencies( self.stages[name] )
+
+        waiting = list( self.order )
+        running = {}
+
+        # a thread for each watcher, they may all wait at once
+        nwatchers = len( [ name for name in self.order
+                           if self.stages[name].watcher ] )
+
+        with concurrent.futures.ThreadPoolExecutor( self.jobs ) as pool, \
+             concurrent.futures.ThreadPoolExecutor( max( 1, nwatchers ) ) \
+             as watch:
+
+            while len( waiting ) > 0 or len( running ) > 0:
+
+                # start the ready stages and block the ones after a
+                # failure, until nothing changes
+                changed = True
+                while changed:
+                    changed = False
+                    for name in list( waiting ):
+                        status = [ self.state[d]['status'] for d in deps[name] ]
+
+                        if FAILED in status or BLOCKED in status:
+                            waiting.remove( name )
+                            eprint( 'stage', name, 'blocked.' )
+                            self.record( name, status=BLOCKED )
+                            changed = True
+
+                        elif all( st == DONE for st in status ) and \
+                             ( self.stages[name].watcher or
+                               self.busy( running ) < self.jobs ):
+                            waiting.remove( name )
+                            eprint( 'stage', name, 'started.' )
+                            self.record( name, status=RUNNING,
+                                         start=datetime.datetime.now().isoformat() )
+                            executor = pool
+                            if self.stages[name].watcher:
+                                executor = watch
+                            running[executor.submit( self.execute,
+                                                     self.stages[name] )] = \
+                                ( name, time.time() )
+                            changed = True
+
+                # a cycle leaves stages that can never start
+                if len( running ) == 0:
+                    for name in waiting:
+                        eprint( 'stage', name, 'cannot start, cyclic dependencies.' )
+                        self.record( name, status=BLOCKED )
+                    break
+
+                done, pending = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED )
+
+                for future in done:
+                    name, start = running.pop( future )
+                    seconds = round( time.time() - start, 1 )
+                    try:
+                        if future.result():
+                            eprint( 'stage', name, 'is current, skipped.' )
+                            self.record( name, status=DONE, seconds=seconds,
+                                         resumed=True )
+                            continue
+                        eprint( 'stage', name, 'completed in %.1f s.' % seconds )
+                        self.record( name, status=DONE, seconds=seconds )
+                    except Exception as e:
+                        eprint( 'stage', name, 'failed:', str( e ) )
+                        self.record( name, status=FAILED, seconds=seconds,
+                                     error=str( e ) )
+
+        return all( self.state[name]['status'] == DONE for name in self.order )
+
+    # a stage's status
+    def status( self, name ):
+        with self.lock:
+            return self.state[name]['status']
+
+    # names of the stages that did not complete
+    def failed( self ):
+        return [ name for name in self.order
+                 if self.state[name]['status'] != DONE ]
+
+# end class pipeline
+
+# end pipeline.py
@@ -0,0 +1,345 @@
+#! /usr/bin/env /usr/bin/python3
+
+#  postproc.py
+#
+#  Copyright (c) 2026 agent
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#  or visit https://www.gnu.org/licenses/gpl-3.0-standalone.html
+#
+postproc_copyright = 'postproc.py Copyright (c) 2026 agent ' + \
+                     'released under GNU GPL V3.0'
+
+import os
+import sys
+import glob
+import getopt
+import datetime
+
+import numpy as np
+from netCDF4 import Dataset
+
+from eto_FAO import eto, run_domains
+from merge import merge
+from filter import filterWRF
+import ncout
+import gridcache
+
+## @file      postproc.py
+## @brief     Post-process a WRF output file in one pass: calculate ETo,
+##            write the daily soil moisture variables (SMV) file and,
+##            optionally, the filtered WRF file.
+## @author    agent
+## @copyright Copyright (c) 2026 agent. All Rights Reserved.
+## @license   Released under GNU General Public License V3.0
+## @results   netCDF SMV file, optional filtered WRF file
+
+# Replaces running eto_FAO.py, merge.py and filter.py one after the other.
+# The WRF file is opened once and every shared variable is read once;
+# the ETo array goes straight to the merge writer, no ETo_FAO_*.npy
+# file and no row flip.
+
+# print functions to reduce clutter and to flush output
+def eprint( *args ):
+    print( *args, file=sys.stderr, flush=True)
+
+def oprint( *args ):
+    print( *args, file=sys.stdout, flush=True)
+
+class postproc():
+
+    ## @param wrf_path - WRF output file, or an already open Dataset
+    ## @param smv_path - output SMV netCDF file
+    ## @param filter_path - output filtered WRF file, None to skip
+    ## @param latlongs - include XLAT, XLONG in the SMV file
+    ## @param engine - ETo engine, see eto_FAO.eto
+    ## @param nthreads - ETo threads, see eto_FAO.eto
+    ## @param eto_path - ETo_FAO_*.npy from eto_FAO.py, eg. streamed while
+    ##                   WRF ran; used instead of calculating ETo if it exists
+    ## @param output - output format keyword arguments, see ncout.ncout
+    ## @param grid - sector gridcache.gridcache, see merge and filterWRF
+    ## @param series - sector series directory, see merge
+    def __init__( self, wrf_path, smv_path, filter_path=None, latlongs=False,
+                  engine='fused', nthreads=1, eto_path=None, output=None,
+                  grid=None, series=None ):
+
+        self.grid = grid
+        self.series = series
+        self.output = output
+        self.eto_path = eto_path
+        self.wrf_path = wrf_path
+        self.smv_path = smv_path
+        self.filter_path = filter_path
+        self.latlongs = latlongs
+
+        name = wrf_path
+        if isinstance( wrf_path, Dataset ):
+            name = wrf_path.filepath()
+
+        # only used for its engines, no files written
+        self.eto = eto( False, name, '.', None, engine=engine,
+                        nthreads=nthreads )
+
+    # read the variables shared by the ETo, merge and filter steps
+    def read_shared( self, wrf_ds ):
+
+        wvars = wrf_ds.variables
+        cache = {}
+
+        # ETo inputs; T2 is also used by merge, all are used by filter
+        for name in self.eto.WRF_VARS:
+            if name not in wvars:
+                raise IOError( '"' + name + '" variable is not in WRF file' )
+            cache[name] = wvars[name][:]
+
+        # one lat/long buffer, kept with its time axis so consumers
+        # index it like the WRF variable; the grid cache has them
+        if self.grid == None and \
+           ( self.latlongs or self.filter_path != None ):
+            for name in [ 'XLAT', 'XLONG' ]:
+                if name not in wvars:
+                    raise IOError( '"' + name + '" variable is not in WRF file' )
+                cache[name] = wvars[name][0:1]
+
+        return cache
+
+    # make it so
+    def run( self ):
+
+        if isinstance( self.wrf_path, Dataset ):
+            wrf_ds = self.wrf_path
+        else:
+            wrf_ds = Dataset( self.wrf_path, 'r' )
+        wrf_ds.set_auto_mask( False )   # WRF has no fill values
+
+        cache = self.read_shared( wrf_ds )
+
+        if self.eto_path != None and os.path.isfile( self.eto_path ):
+
+            # precalculated; .npy files are north up, flip to WRF row order
+            eto_buf = np.flipud( np.load( self.eto_path ) )
+
+        else:
+
+            # calculate ETo in WRF row order
+            cube = {}
+            for name in self.eto.WRF_VARS:
+                cube[name] = cache[name].astype( np.float32, copy=False )
+
+            eto_buf = self.eto.calc_cube( cube )
+
+        # merge writer reads RAINC, RAINNC and SFCEVP from the open file
+        oper = merge( wrf_ds, None, self.smv_path, self.latlongs,
+                      eto_buf=eto_buf, cache=cache, output=self.output,
+                      grid=self.grid, series=self.series )
+        oper.run()
+
+        if self.filter_path != None:
+            oper = filterWRF( wrf_ds, self.filter_path, cache=cache,
+                              output=self.output, grid=self.grid )
+            oper.run()
+
+        if not isinstance( self.wrf_path, Dataset ):
+            wrf_ds.close()
+
+        if self.eto_path != None and os.path.isfile( self.eto_path ):
+            os.remove( self.eto_path )
+
+# end class postproc
+
+# --------------------------------------------------------------------
+
+outdir = '/students/agrineer/wrf/output'
+
+# command line options
+def usage():
+    eprint('usage: postproc.py -h -f -l -p -g -u -n -z level -q N -e engine -t N -j N -s sector <-r date>')
+    eprint('       postproc.py --help --filter --latlongs --precalculated --grid --series --netcdf4 --complevel=level --digits=N --engine=engine --threads=N --jobs=N --sector=sector <--rundate=date>')
+    eprint("       omitting rundate parameter defaults to yesterday's date")
+    eprint('       --filter also writes filtered WRF files, wrfout*-filtered')
+    eprint('       --latlongs includes XLAT, XLONG in SMV files')
+    eprint('       --precalculated uses, then removes, existing ETo_FAO_*.npy')
+    eprint('       files, eg. from eto_FAO.py --stream')
+    eprint('       --grid checks each file against, and refers to, the')
+    eprint('       sector grid cache; see gridcache.py')
+    eprint('       --series appends the daily variables to the sector time')
+    eprint('       series store; see tsstore.py')
+    eprint('       engine is fused (default), batch or hourly')
+    eprint('       --threads computes ETo row tiles on N threads (default 1)')
+    eprint('       --jobs processes N domain files at once (default 1)')
+    ncout.usage()
+
+# end usage
+
+# parse a positive integer option or exit
+def positive_int( name, arg ):
+
+    try:
+        value = int( arg )
+    except ValueError:
+        value = 0
+
+    if value < 1:
+        eprint( name, 'must be a positive integer' )
+        usage()
+        sys.exit(2)
+
+    return value
+
+def read_args( argv ):
+
+    options = { 'rundate':None,
+                'sector':None,
+                'filter':False,
+                'latlongs':False,
+                'precalculated':False,
+                'grid':False,
+                'series':False,
+                'engine':'fused',
+                'nthreads':1,
+                'jobs':1,
+                'output':{} }
+
+    try:
+        opts, args = getopt.getopt( argv,
+                                    'hflpgunz:q:e:t:j:s:r:',
+                                    ['help','filter','latlongs',
+                                     'precalculated','grid','series','netcdf4',
+                                     'complevel=',
+                                     'digits=','engine=','threads=',
+                                     'jobs=','sector=','rundate='])
+    except getopt.GetoptError:
+        eprint('unknown command arguments')
+        usage()
+        sys.exit(2)
+
+    for opt, arg in opts:
+        try:
+            if ncout.read_arg( options['output'], opt, arg ):
+                continue
+        except ValueError as e:
+            eprint( e )
+            usage()
+            sys.exit(2)
+
+        if opt in ( '-h', '--help' ):
+            usage()
+            sys.exit(0)
+
+        elif opt in ( '-f', '--filter' ):
+            options['filter'] = True
+
+        elif opt in ( '-l', '--latlongs' ):
+            options['latlongs'] = True
+
+        elif opt in ( '-p', '--precalculated' ):
+            options['precalculated'] = True
+
+        elif opt in ( '-g', '--grid' ):
+            options['grid'] = True
+
+        elif opt in ( '-u', '--series' ):
+            options['series'] = True
+
+        elif opt in ( '-e', '--engine' ):
+            if arg not in [ 'fused', 'batch', 'hourly' ]:
+                eprint('unknown engine:', arg)
+                usage()
+                sys.exit(2)
+            options['engine'] = arg
+
+        elif opt in ( '-t', '--threads' ):
+            options['nthreads'] = positive_int( 'threads', arg )
+
+        elif opt in ( '-j', '--jobs' ):
+            options['jobs'] = positive_int( 'jobs', arg )
+
+        elif opt in ( '-s', '--sector' ):
+            options['sector'] = arg
+
+        elif opt in ( '-r', '--rundate' ):
+            options['rundate'] = arg
+
+    if options['sector'] == None:
+        usage()
+        sys.exit( 2 )
+
+    return options
+
+# end read_args
+
+# post-process one domain file in the current directory
+def run_domain( w, options ):
+
+    eprint('post-processing', w + '.')
+
+    filter_path = None
+    if options['filter']:
+        filter_path = w + '-filtered'
+
+    eto_path = None
+    if options['precalculated']:
+        eto_path = 'ETo_FAO_' + w + '.npy'
+
+    grid = None
+    if options['grid']:
+        grid = gridcache.gridcache( outdir + '/' + options['sector'] + '/grid' )
+
+    series = None
+    if options['series']:
+        series = outdir + '/' + options['sector'] + '/series'
+
+    oper = postproc( w, options['sector'] + '_SMV' + w[6:] + '.nc',
+                     filter_path, options['latlongs'], options['engine'],
+                     options['nthreads'], eto_path, options['output'], grid,
+                     series )
+    oper.run()
+
+if __name__ == '__main__':
+
+    # get run date, domain sector and run options
+    options = read_args( sys.argv[1:] )
+    if options['rundate'] == None:
+
+        # run with yesterday's data
+        today = datetime.datetime.now() # local time
+        yesterday = today - datetime.timedelta(days = 1)
+        options['rundate'] = yesterday.strftime( "%Y%m%d" )
+
+    # go to working directory
+    indir = outdir + '/' + options['sector'] + '/' + options['rundate']
+
+    # check if working dir exists
+    if not os.path.isdir( indir ):
+        eprint('directory:', indir, 'does not exist')
+        sys.exit(2)
+
+    # check directory permissions
+    if not os.access( indir, os.W_OK ):
+        eprint('cannot write to directory:', indir)
+        sys.exit(2)
+
+    os.chdir( indir )
+
+    # process all available domains in directory; only the WRF history
+    # files, not the *-filtered ones written beside them by --filter
+    files = sorted( glob.glob( 'wrfout_d0?_????-??-??_??[-:]??[-:]??' ) )
+    nfailed = run_domains( files, options['jobs'], run_domain, options )
+
+    if nfailed > 0:
+        eprint( nfailed, 'of', len( files ), 'domains failed' )
+        sys.exit(2)
+
+# end postproc.py
@@ -0,0 +1,96 @@
+#  reprocess.py
+#
+#  Copyright (c) 2026 agent
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#  or visit https://www.gnu.org/licenses/gpl-3.0-standalone.html
+#
+reprocess_copyright = 'reprocess.py Copyright (c) 2026 agent ' + \
+                      'released under GNU GPL V3.0'
+
+import os
+import json
+import shutil
+import tempfile
+
+from netCDF4 import Dataset
+
+## @file      reprocess.py
+## @brief     Helpers shared by the scripts reprocessing the daily
+##            archives, hindcast.py and run_filter.py.
+## @author    agent
+## @copyright Copyright (c) 2026 agent. All Rights Reserved.
+## @license   Released under GNU General Public License V3.0
+
+## open a wrfout member of a tar stream: members up to memory bytes are
+## read into memory, larger ones are copied once to a scratch directory
+## @param scratch - directory holding the scratch directories
+## @param prefix - name prefix of the scratch directory, eg. 'hindcast_'
+## @return the dataset and the scratch directory to remove, or None
+def open_member( tar, member, memory, scratch, prefix ):
+
+    name = os.path.basename( member.name )
+    src = tar.extractfile( member )
+
+    if member.size <= memory:
+        return Dataset( name, 'r', memory=src.read() ), None
+
+    tmpdir = tempfile.mkdtemp( prefix=prefix, dir=scratch )
+    path = tmpdir + '/' + name
+    with open( path, 'wb' ) as dst:
+        shutil.copyfileobj( src, dst, 16*1024*1024 )
+
+    return Dataset( path, 'r' ), tmpdir
+
+# ----------------------------------------------------------------------------
+# completion manifest of a resumable batch: { key:{ record name:record } },
+# a record has 'status', 'settings', 'outputs' and maybe 'source'
+
+## @param key - the records' key, eg. 'days'
+def read_manifest( path, key ):
+
+    if not os.path.isfile( path ):
+        return { key:{} }
+
+    with open( path, 'r' ) as f:
+        return json.load( f )
+
+# write to a temporary name and rename, the manifest is always whole
+def write_manifest( path, manifest ):
+
+    with open( path + '.part', 'w' ) as f:
+        json.dump( manifest, f, indent=1, sort_keys=True )
+    os.replace( path + '.part', path )
+
+## a record is done if it finished with the same settings, from the same
+## source if one is given, and its outputs are still there
+def is_done( record, settings, source=None ):
+
+    if record == None or record.get( 'status' ) != 'done':
+        return False
+
+    if record.get( 'settings' ) != settings:
+        return False
+
+    if source != None and record.get( 'source' ) != source:
+        return False
+
+    for path in record['outputs']:
+        if not os.path.isfile( path ):
+            return False
+
+    return True
+
+# end reprocess.py
@@ -0,0 +1,248 @@
+#! /usr/bin/env /usr/bin/python3
+
+#  roundtrip.py
+#
+#  Copyright (c) 2026 agent
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#  or visit https://www.gnu.org/licenses/gpl-3.0-standalone.html
+#
+roundtrip_copyright = 'roundtrip.py Copyright (c) 2026 agent ' + \
+                      'released under GNU GPL V3.0'
+
+import os
+import sys
+import getopt
+import shutil
+import tarfile
+import tempfile
+
+import numpy as np
+from netCDF4 import Dataset
+
+from benchmark import wrfout, wrfname
+from filter import filterWRF
+import blockzip
+import tarindex
+import tsstore
+import hindcast
+import run_filter
+
+## @file      roundtrip.py
+## @brief     Check that the files the scripts write read back intact,
+##            on a small synthetic WRF file.
+## @author    agent
+## @copyright Copyright (c) 2026 agent. All Rights Reserved.
+## @license   Released under GNU General Public License V3.0
+
+# Each check raises IOError describing the first difference found.
+
+# print functions to reduce clutter and to flush output
+def eprint( *args ):
+    print( *args, file=sys.stderr, flush=True)
+
+def oprint( *args ):
+    print( *args, file=sys.stdout, flush=True)
+
+# synthetic grid size
+NY = 40
+NX = 50
+
+# filter.py -p: packed variables read back unmasked, within half a
+# packing step of the source
+def check_pack( workdir, wrf_path ):
+
+    variables = [ 'T2', 'Q2', 'PSFC', 'GRDFLX' ]
+    out_path = workdir + '/packed.nc'
+    filterWRF( wrf_path, out_path, variables=variables, pack=True ).run()
+
+    src = Dataset( wrf_path, 'r' )
+    out = Dataset( out_path, 'r' )
+    try:
+        for name in variables:
+            data = out.variables[name][:]
+            source = src.variables[name][:]
+
+            if np.ma.count_masked( data ) > 0:
+                raise IOError( '%s: %d packed values read back masked' %
+                               ( name, np.ma.count_masked( data ) ) )
+
+            step = out.variables[name].scale_factor
+            error = float( np.max( np.abs( data - source ) ) )
+            if error > step:
+                raise IOError( '%s: unpacked error %g exceeds the step %g' %
+                               ( name, error, step ) )
+    finally:
+        src.close()
+        out.close()
+
+# small blocks, so the archives hold many compressed members
+BLOCK = 64*1024
+
+# the block compressed archives of a day directory, path: writer
+def write_archives( workdir, daydir, name ):
+
+    paths = {}
+    path = workdir + '/' + name + '-blockzip.tar.gz'
+    blockzip.tarball( path, daydir, blocksize=BLOCK )
+    paths[path] = 'blockzip'
+
+    path = workdir + '/' + name + '-tarindex.tar.gz'
+    tarindex.archive( path, daydir, minblock=BLOCK )
+    paths[path] = 'tarindex'
+
+    return paths
+
+# read the block compressed archives back through each streaming reader:
+# run_filter.py -s, hindcast.py, tsstore.py and tarindex.py -r
+def check_archive( workdir, wrf_path ):
+
+    try:
+        read_archives( workdir, wrf_path )
+    except tarfile.TarError as e:
+        raise IOError( 'tarfile: ' + str( e ) )
+
+def read_archives( workdir, wrf_path ):
+
+    daydir = workdir + '/20220501'
+    os.makedirs( daydir, exist_ok=True )
+    shutil.copy( wrf_path, daydir + '/' + wrfname )
+    with open( wrf_path, 'rb' ) as f:
+        wrf_data = f.read()
+
+    for path, writer in write_archives( workdir, daydir, 'wrf' ).items():
+
+        # run_filter.py -s
+        outpath = workdir + '/filtered-' + writer + '/'
+        os.makedirs( outpath, exist_ok=True )
+        outputs, nbytes = run_filter.stream_filter( path, '20220501',
+                                                    { 'outpath':outpath,
+                                                      'memory':len( wrf_data ),
+                                                      'scratch':None,
+                                                      'pack':False,
+                                                      'threads':1 } )
+        if len( outputs ) != 1 or nbytes[1] != len( wrf_data ):
+            raise IOError( 'run_filter.py: read %d of %d wrfout bytes from %s'
+                           % ( nbytes[1], len( wrf_data ), writer ) )
+
+        # hindcast.py
+        dayout = workdir + '/hindcast-' + writer + '/20220501'
+        smv, nbytes = hindcast.hindcast( path, dayout,
+                                         { 'sector':'S', 'grid':False,
+                                           'latlongs':False,
+                                           'engine':'fused', 'nthreads':1,
+                                           'output':{},
+                                           'memory':len( wrf_data ),
+                                           'scratch':None } ).run()
+        if len( smv ) != 1 or nbytes != len( wrf_data ):
+            raise IOError( 'hindcast.py: read %d of %d wrfout bytes from %s'
+                           % ( nbytes, len( wrf_data ), writer ) )
+
+        # tarindex.py -r
+        path_r = workdir + '/reindexed-' + writer + '.tar.gz'
+        tarindex.reindex( path, path_r, minblock=BLOCK )
+        with tarindex.tarreader( path_r ) as reader:
+            if reader.read_file( '20220501/' + wrfname ) != wrf_data:
+                raise IOError( 'tarindex.py: the wrfout reindexed from ' +
+                               writer + ' differs' )
+
+    # tsstore.py, from archives of hindcast's SMV file; without the index
+    # of the tarindex one, so it is streamed too
+    for path, writer in write_archives( workdir, dayout, 'smv' ).items():
+        if tarindex.indexed( path ):
+            os.remove( path + tarindex.INDEX_SUFFIX )
+        members = list( tsstore.archive_members( path ) )
+        for name, ds in members:
+            ds.close()
+        if [ name for name, ds in members ] != [ os.path.basename( smv[0] ) ]:
+            raise IOError( 'tsstore.py: read %s from %s, not %s' %
+                           ( [ name for name, ds in members ], writer,
+                             os.path.basename( smv[0] ) ) )
+
+# check: function( workdir, wrf_path )
+CHECKS = { 'pack':check_pack,
+           'archive':check_archive }
+
+# command line options
+def usage():
+    eprint('usage: roundtrip.py -h -c checks -w workdir')
+    eprint('       roundtrip.py --help --checks=checks --workdir=workdir')
+    eprint('       checks from ' + ','.join( sorted( CHECKS ) ) +
+           ' (default all)')
+    eprint('       workdir defaults to a temporary directory, removed after')
+
+# end usage
+
+def read_args( argv ):
+
+    options = { 'checks':sorted( CHECKS ),
+                'workdir':None }
+
+    try:
+        opts, args = getopt.getopt( argv, 'hc:w:',
+                                    ['help','checks=','workdir='] )
+    except getopt.GetoptError:
+        eprint('unknown command arguments')
+        usage()
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ( '-h', '--help' ):
+            usage()
+            sys.exit(0)
+
+        elif opt in ( '-c', '--checks' ):
+            options['checks'] = arg.split( ',' )
+            for check in options['checks']:
+                if check not in CHECKS:
+                    eprint('unknown check:', check)
+                    usage()
+                    sys.exit(2)
+
+        elif opt in ( '-w', '--workdir' ):
+            options['workdir'] = arg
+
+    return options
+
+# end read_args
+
+if __name__ == '__main__':
+
+    options = read_args( sys.argv[1:] )
+
+    workdir = options['workdir']
+    if workdir == None:
+        workdir = tempfile.mkdtemp( prefix='roundtrip_' )
+    os.makedirs( workdir, exist_ok=True )
+
+    wrf_path = workdir + '/' + wrfname
+    wrfout( wrf_path, NY, NX ).run()
+
+    nfailed = 0
+    for check in options['checks']:
+        try:
+            CHECKS[check]( workdir, wrf_path )
+            oprint( '%-10s ok' % check )
+        except IOError as e:
+            oprint( '%-10s FAILED: %s' % ( check, str( e ) ) )
+            nfailed += 1
+
+    if options['workdir'] == None:
+        shutil.rmtree( workdir )
+
+    if nfailed > 0:
+        sys.exit(2)
+
+# end roundtrip.py
@@ -6,19 +6,19 @@
 @package WRF
 @brief filter WRF data sets for data size reduction
 @LICENSE
-# 
+#
 #  Copyright (C) 2023 Scott L. Williams.
-# 
+#
 #  This program is free software; you can redistribute it and/or modify
 #  it under the terms of the GNU General Public License as published by
 #  the Free Software Foundation; either version 3 of the License, or
 #  (at your option) any later version.
-# 
+#
 #  This program is distributed in the hope that it will be useful,
 #  but WITHOUT ANY WARRANTY; without even the implied warranty of
 #  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
 #  GNU General Public License for more details.
-# 
+#
 #  You should have received a copy of the GNU General Public License
 #  along with this program; if not, write to the Free Software
 #  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
@@ -28,90 +28,395 @@
 
 run_filter_copyright = 'run_filter.py Copyright (c) 2023 Scott L. Williams, released under GNU GPL V3.0'
 
+import io
 import os
 import sys
 import glob
+import time
 import getopt
+import shutil
+import tarfile
+import concurrent.futures
+
+import reprocess
+import blockzip
+from filter import filterWRF
 
 # point to data directories
 datapath = '/output/ecuador/ANDES_03/'  # point to WRF output data
 outpath = '/output/ecuador/ANDES_03-filtered/'
 filterpath = '/home/agrineer/wrf/scripts/filter.py'
 
-# ----------------------------------------------------------------------------
-# main
-
-# check if input/output data directories exists
-if not os.path.isdir( datapath ):
-    print( 'run_filter:', datapath, ' does not exist...exiting',
-           file=sys.stderr )
-    sys.exit( 1 )
-        
-if not os.path.isdir( outpath ):
-    os.mkdir( outpath )
-    if not os.path.isdir( outpath ):
-        print( 'run_filter:', outpath, ' cannot be made...exiting',
-               file=sys.stderr )
-        sys.exit( 1 )
+# streaming: WRF files up to this size are read in memory, larger ones
+# are copied once to the scratch directory, a tmpfs by default
+memory = 4096*1024*1024
+scratchpath = '/dev/shm'
 
-os.chdir( outpath ) # work from here
+# print functions to reduce clutter and to flush output
+def eprint( *args ):
+    print( *args, file=sys.stderr, flush=True)
 
-prefix_size = len( datapath )
+# ----------------------------------------------------------------------------
 
-# run through all files in datapath with "tar.gz" suffix
-tarfiles = glob.glob( datapath + '*.tar.gz' )
-for f in tarfiles:
+# extract, filter with filter.py, re-tar; works from outpath.
+# returns the archives written and [ archive bytes read, wrfout bytes,
+# bytes written ]
+def extract_filter( f, folder, options ):
 
-    # get the name of the date folder (YYYYMMD)
-    folder = f[prefix_size:-7] 
+    outpath = options['outpath']
     out_prefix = outpath + folder + '/'
     out_prefix_size = len( out_prefix )
-        
-    # check if folder already exists
-    if os.path.isdir( outpath + folder ):        
-        print( outpath+folder, ' already exists...exiting',
-               file=sys.stderr )
-        sys.exit( 1 )
+
+    # left by an interrupted run
+    if os.path.isdir( outpath + folder ):
+        eprint( 'removing', outpath + folder, 'left by an earlier run' )
+        shutil.rmtree( outpath + folder )
 
     # untar the WRF file to the output directory
-    print( 'untar\'ing ' + datapath + folder + '.tar.gz', 'to', outpath[:-1],
-           file=sys.stderr )
-    
-    result = os.system( 'tar xzf ' + datapath + folder + '.tar.gz' )
-    if result == 1:
-        print( 'run_filter: cannot untar ' + f + ' exiting...',
-               file=sys.stderr )
-        sys.exit( 1 )
-    
-    wrffile = glob.glob( out_prefix + 'wrfout*' )[0] # returns array, use only first
+    eprint( 'untar\'ing ' + f, 'to', outpath[:-1] )
+
+    result = os.system( 'tar xzf ' + f )
+    if result != 0:
+        raise IOError( 'cannot untar ' + f )
+
+    wrffiles = glob.glob( out_prefix + 'wrfout*' )
+    if len( wrffiles ) == 0:
+        raise IOError( 'no WRF file in ' + f )
+    wrffile = wrffiles[0] # use only first
     outfile = out_prefix + wrffile[out_prefix_size:] + '-filtered'
+    nwrf = os.path.getsize( wrffile )
 
     # filter the WRF file
     #print( 'filtering:', outfile )
-    
-    result = os.system( filterpath + ' -i ' + wrffile + ' -o ' + outfile )
-    if result == 1:
-        print( 'run_filter: cannot filter ' + wrffile + ' exiting...',
-               file=sys.stderr )
-        sys.exit( 1 )
+
+    flags = ''
+    if options['pack']:
+        flags = ' -p'
+    result = os.system( filterpath + flags + ' -i ' + wrffile + ' -o ' + outfile )
+    if result != 0:
+        raise IOError( 'cannot filter ' + wrffile )
 
     # rename filtered file (clobbers unfiltered file)
-    result = os.system( 'mv ' + outfile + ' ' + wrffile )
-    if result == 1:
-        print( 'run_filter: cannot rename ' + outfile + ' exiting...',
-               file=sys.stderr )
-        sys.exit( 1 )
+    os.replace( outfile, wrffile )
+
+    # tar renamed filtered file, gzip blocks on threads
+    eprint( 'tar\'ing ./' + wrffile[-39:] )
+    tarpath = outpath + wrffile[-30:] + '.tar.gz'
+    blockzip.tarball( tarpath, wrffile, threads=options['threads'],
+                      arcname='./' + wrffile[-39:] )
+
+    # remove date directory
+    shutil.rmtree( out_prefix )
+
+    return [ tarpath ], [ os.path.getsize( f ), nwrf,
+                          os.path.getsize( tarpath ) ]
+
+# filter the wrfout members of an archive in process, each written
+# straight into its new archive, outpath/<wrfout name>.tar.gz, holding
+# ./<folder>/<wrfout name> as the extract path does.
+# returns the archives written and [ archive bytes read, wrfout bytes,
+# bytes written ]
+def stream_filter( f, folder, options ):
+
+    outputs = []
+    nbytes = [ os.path.getsize( f ), 0, 0 ]
+
+    # read sequentially, no seeks; block compressed archives too
+    with blockzip.tarstream( f ) as tar:
+        for member in tar:
+
+            name = os.path.basename( member.name )
+            if not member.isfile() or not name.startswith( 'wrfout' ):
+                continue
+
+            tarpath = options['outpath'] + name + '.tar.gz'
+            eprint( 'filtering', folder + '/' + name, 'from', f )
+
+            wrf_ds, scratch = reprocess.open_member( tar, member,
+                                                     options['memory'],
+                                                     options['scratch'],
+                                                     'run_filter_' )
+            nbytes[1] += member.size
+            try:
+                data = filterWRF( wrf_ds, name + '-filtered',
+                                  output={ 'tobytes':True },
+                                  pack=options['pack'] ).run()
+            finally:
+                wrf_ds.close()
+                if scratch != None:
+                    shutil.rmtree( scratch, ignore_errors=True )
+
+            # gzip level 6 as tar cfz, blocks on threads
+            info = tarfile.TarInfo( './' + folder + '/' + name )
+            info.size = len( data )
+            info.mtime = time.time()
+            part = tarpath + '.part'
+            with open( part, 'wb' ) as fout:
+                writer = blockzip.blockwriter( fout, threads=options['threads'] )
+                with tarfile.open( fileobj=writer, mode='w|' ) as out:
+                    out.addfile( info, io.BytesIO( data ) )
+                writer.close()
+            os.replace( part, tarpath )
+
+            nbytes[2] += os.path.getsize( tarpath )
+            outputs.append( tarpath )
+
+    if len( outputs ) == 0:
+        raise IOError( 'no WRF file in ' + f )
+
+    return outputs, nbytes
+
+# filter one archive, run in the process pool
+def filter_archive( f, folder, options ):
+
+    start = time.time()
+    if options['stream']:
+        outputs, nbytes = stream_filter( f, folder, options )
+    else:
+        outputs, nbytes = extract_filter( f, folder, options )
+
+    return outputs, nbytes, time.time() - start
+
+# ----------------------------------------------------------------------------
+# completion manifest, outpath/run_filter.json
+
+# identity of an input archive; a rewritten archive is filtered again
+def get_source( f ):
+
+    st = os.stat( f )
+    return { 'size':st.st_size, 'mtime':int( st.st_mtime ) }
+
+# the options changing the output
+def get_settings( options ):
+
+    return { 'pack':options['pack'] }
+
+# command line options
+def usage():
+    eprint('usage: run_filter.py -h -R -s -p -j N -t N -r N -m MB -w scratch -i datapath -o outpath')
+    eprint('       run_filter.py --help --redo --stream --pack --jobs=N --threads=N --retries=N --memory=MB --scratch=scratch --in=datapath --out=outpath')
+    eprint('       filters the WRF files of the datapath/*.tar.gz archives into')
+    eprint('       outpath/<wrfout name>.tar.gz')
+    eprint('       --jobs filters N archives at once (default 1)')
+    eprint('       --threads gzips each archive on N threads (default the')
+    eprint('       cores shared among the jobs)')
+    eprint('       --retries retries failed archives N times (default 1)')
+    eprint('       completed archives are kept in outpath/run_filter.json and')
+    eprint('       skipped unless changed since or --redo is given')
+    eprint('       --stream filters in process, without extracting: WRF files')
+    eprint('       up to MB megabytes (default 4096) are read in memory, larger')
+    eprint('       ones are copied once to scratch (default ' + scratchpath + ')')
+    eprint('       --pack writes packed int16 variables, see filter.py')
 
-    # tar renamed filtered file
-    print( 'tar\'ing ./' + wrffile[-39:], file=sys.stderr )
-    result = os.system( 'tar cfz ' + wrffile[-30:] + '.tar.gz ' + './' + wrffile[-39:] )
-    if result == 1:
-        print( 'run_filter: cannot tar ' + wrffile + ' exiting...',
+# parse a non negative integer option or exit
+def count_arg( name, arg ):
+
+    try:
+        value = int( arg )
+    except ValueError:
+        value = -1
+
+    if value < 0:
+        eprint( name, 'must be a non negative integer' )
+        usage()
+        sys.exit(2)
+
+    return value
+
+def read_args( argv ):
+
+    options = { 'redo':False,
+                'stream':False,
+                'pack':False,
+                'jobs':1,
+                'threads':None,
+                'retries':1,
+                'memory':memory,
+                'scratch':scratchpath,
+                'datapath':datapath,
+                'outpath':outpath }
+
+    try:
+        opts, args = getopt.getopt( argv,
+                                    'hRspj:t:r:m:w:i:o:',
+                                    ['help','redo','stream','pack','jobs=',
+                                     'threads=',
+                                     'retries=','memory=',
+                                     'scratch=','in=','out='] )
+    except getopt.GetoptError:
+        eprint('unknown command arguments')
+        usage()
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ( '-h', '--help' ):
+            usage()
+            sys.exit(0)
+
+        elif opt in ( '-R', '--redo' ):
+            options['redo'] = True
+
+        elif opt in ( '-s', '--stream' ):
+            options['stream'] = True
+
+        elif opt in ( '-j', '--jobs' ):
+            options['jobs'] = count_arg( 'jobs', arg )
+            if options['jobs'] < 1:
+                eprint('jobs must be a positive integer')
+                usage()
+                sys.exit(2)
+
+        elif opt in ( '-t', '--threads' ):
+            options['threads'] = count_arg( 'threads', arg )
+            if options['threads'] < 1:
+                eprint('threads must be a positive integer')
+                usage()
+                sys.exit(2)
+
+        elif opt in ( '-r', '--retries' ):
+            options['retries'] = count_arg( 'retries', arg )
+
+        elif opt in ( '-p', '--pack' ):
+            options['pack'] = True
+
+        elif opt in ( '-m', '--memory' ):
+            options['memory'] = count_arg( 'memory', arg )*1024*1024
+
+        elif opt in ( '-w', '--scratch' ):
+            options['scratch'] = arg
+
+        elif opt in ( '-i', '--in' ):
+            options['datapath'] = os.path.abspath( arg ) + '/'
+
+        elif opt in ( '-o', '--out' ):
+            options['outpath'] = os.path.abspath( arg ) + '/'
+
+    if not os.path.isdir( options['scratch'] ):
+        options['scratch'] = None       # system temporary directory
+
+    if options['threads'] == None:
+        options['threads'] = max( 1, os.cpu_count()//options['jobs'] )
+
+    return options
+
+# ----------------------------------------------------------------------------
+# main
+
+if __name__ == '__main__':
+
+    options = read_args( sys.argv[1:] )
+    datapath = options['datapath']
+    outpath = options['outpath']
+
+    # check if input/output data directories exists
+    if not os.path.isdir( datapath ):
+        print( 'run_filter:', datapath, ' does not exist...exiting',
                file=sys.stderr )
         sys.exit( 1 )
 
-    # remove date directory
-    for f in glob.glob( folder + '/*' ):
-        os.remove( f )
-    os.rmdir( folder  )
-    print( '-----------------------------------------------------------\n' )
+    if not os.path.isdir( outpath ):
+        os.mkdir( outpath )
+        if not os.path.isdir( outpath ):
+            print( 'run_filter:', outpath, ' cannot be made...exiting',
+                   file=sys.stderr )
+            sys.exit( 1 )
+
+    os.chdir( outpath ) # work from here
+
+    manifest_path = outpath + 'run_filter.json'
+    manifest = reprocess.read_manifest( manifest_path, 'archives' )
+    settings = get_settings( options )
+
+    prefix_size = len( datapath )
+
+    # run through all files in datapath with "tar.gz" suffix, skipping
+    # those done
+    todo = []
+    nskipped = 0
+    for f in sorted( glob.glob( datapath + '*.tar.gz' ) ):
+
+        # get the name of the date folder (YYYYMMD)
+        folder = f[prefix_size:-7]
+
+        if not options['redo'] and \
+           reprocess.is_done( manifest['archives'].get( folder ), settings,
+                              get_source( f ) ):
+            nskipped += 1
+            continue
+
+        todo.append( ( f, folder ) )
+
+    eprint( len( todo ), 'archives to filter,', nskipped, 'already done.' )
+
+    start = time.time()
+    ndone = 0
+    nbytes = [ 0, 0, 0 ]
+    failed = {}
+    attempts = {}
+
+    with concurrent.futures.ProcessPoolExecutor( options['jobs'] ) as pool:
+
+        # each round retries the failures of the one before
+        for attempt in range( options['retries'] + 1 ):
+
+            if attempt > 0:
+                if len( failed ) == 0:
+                    break
+                eprint( 'retrying', len( failed ), 'failed archives' )
+                todo = [ ( f, folder ) for f, folder in todo
+                         if folder in failed ]
+
+            futures = {}
+            for f, folder in todo:
+                source = get_source( f )
+                future = pool.submit( filter_archive, f, folder, options )
+                futures[future] = ( f, folder, source )
+                attempts[folder] = attempt + 1
+
+            for future in concurrent.futures.as_completed( futures ):
+
+                f, folder, source = futures[future]
+                try:
+                    outputs, size, seconds = future.result()
+                except Exception as e:
+                    eprint( 'failed on', f + ':', repr(e) )
+                    failed[folder] = repr(e)
+                    manifest['archives'][folder] = { 'status':'failed',
+                                                     'error':repr(e),
+                                                     'attempts':attempts[folder] }
+                else:
+                    failed.pop( folder, None )
+                    manifest['archives'][folder] = { 'status':'done',
+                                                     'source':source,
+                                                     'settings':settings,
+                                                     'outputs':outputs,
+                                                     'bytes':size,
+                                                     'seconds':round( seconds, 1 ),
+                                                     'attempts':attempts[folder] }
+                    ndone += 1
+                    nbytes = [ a + b for a, b in zip( nbytes, size ) ]
+
+                    eprint( 'filtered %s: read %.1f MB archive (%.1f MB WRF), '
+                            'wrote %.1f MB in %.1f s'
+                            % ( folder, size[0]/1e6, size[1]/1e6, size[2]/1e6,
+                                seconds ) )
+
+                reprocess.write_manifest( manifest_path, manifest )
+
+    # summary
+    hours = ( time.time() - start )/3600.0
+    eprint( '-----------------------------------------------------------' )
+    eprint( 'filtered %d archives, skipped %d, failed %d'
+            % ( ndone, nskipped, len( failed ) ) )
+    if ndone > 0:
+        eprint( 'read %.2f GB archives (%.2f GB WRF), wrote %.2f GB in %.2f '
+                'hours: %.1f archives/hour'
+                % ( nbytes[0]/1e9, nbytes[1]/1e9, nbytes[2]/1e9, hours,
+                    ndone/max( hours, 1e-9 ) ) )
+    for folder in sorted( failed ):
+        eprint( '    failed', folder + ':', failed[folder] )
+
+    if len( failed ) > 0:
+        sys.exit( 2 )
+
+# end run_filter.py
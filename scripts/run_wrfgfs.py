@@ -28,6 +28,12 @@ import time
 import getopt
 import shutil
 import datetime
+import subprocess
+
+import blockzip
+import tarindex
+import pipeline
+import wrfGFS
 
 # set dirs  
 # FIXME: implement environment variable?
@@ -41,12 +47,32 @@ def eprint( *args ):
 def oprint( *args ):
     print( *args, file=sys.stdout, flush=True)
 
+# stages run at once: eg. one day's WRF and another day's WPS or
+# post-processing; the ETo streams wait beside them
+JOBS = 3
+
 # command line options
 def usage():
-    eprint('usage: run_wrfgfs.py -h -b hour -s sector -d datapath <-r date>')
-    eprint('       run_wrfgfs.py --help --begin=hour --sector=sector --datadir=datapath <--rundate=date>')
+    eprint('usage: run_wrfgfs.py -h -e -x -c codec -t N -j N -i hours -b hour -s sector -d datapath <-r date> <-u date>')
+    eprint('       run_wrfgfs.py --help --stream --index --codec=codec --threads=N --jobs=N --interval=hours --begin=hour --sector=sector --datadir=datapath <--rundate=date> <--until=date>')
     eprint('       omitting rundate defaults to yesterday data')
     eprint('       begin hour is in UTC')
+    eprint('       --stream calculates ETo while wrf.exe runs')
+    eprint('       --codec compresses the day\'s tarball with ' +
+           ', '.join( sorted( blockzip.CODECS ) ) + ' (default gzip;')
+    eprint('       the other scripts read .tar.gz only)')
+    eprint('       --threads compresses on N threads (default the cores)')
+    eprint('       --index writes a seekable tarball and its index; see')
+    eprint('       tarindex.py')
+    eprint('       --until runs every date from rundate to until; the dates')
+    eprint('       run at once, each in its own scratch directories')
+    eprint('       --jobs runs N stages at once (default %d); the days\' ETo' % JOBS )
+    eprint('       streams (--stream) wait beside them, not counted')
+    eprint('       --interval writes WRF restart files every hours and')
+    eprint('       restarts a failed wrf.exe from them; with --stream ETo')
+    eprint('       is then calculated after wrf.exe completes')
+    eprint('       stages are recorded in ' +
+           wrfGFS.state_path( '<sector>', [ '<rundate>', '<until>' ] ) )
 
 # end usage
 
@@ -54,13 +80,22 @@ def read_args( argv ):
 
     sector = None
     rundate = None
+    until = None
+    jobs = JOBS
     begin = None
     datadir = None
+    stream = False
+    index = False
+    codec = 'gzip'
+    threads = None
+    interval = None
 
     try:                                
-        opts, args = getopt.getopt( argv, 'hb:s:d:r:', 
-                                    ['help','begin=','sector=','datadir=',
-                                     'rundate='] )
+        opts, args = getopt.getopt( argv, 'hexc:t:j:i:b:s:d:r:u:', 
+                                    ['help','stream','index','codec=',
+                                     'threads=','jobs=','interval=',
+                                     'begin=','sector=',
+                                     'datadir=','rundate=','until='] )
     except getopt.GetoptError: 
         eprint('unkown command arguments')
         usage()                          
@@ -71,6 +106,42 @@ def read_args( argv ):
             usage()                     
             sys.exit(0)       
            
+        elif opt in ( '-e', '--stream' ): 
+            stream = True
+
+        elif opt in ( '-x', '--index' ):
+            index = True
+
+        elif opt in ( '-c', '--codec' ):
+            codec = arg
+            if codec not in blockzip.CODECS:
+                eprint('codec not available:', codec)
+                usage()
+                sys.exit( 2 )
+
+        elif opt in ( '-t', '--threads' ):
+            try:
+                threads = int( arg )
+            except ValueError:
+                threads = 0
+            if threads < 1:
+                eprint('threads must be a positive integer')
+                usage()
+                sys.exit( 2 )
+           
+        elif opt in ( '-j', '--jobs' ):
+            try:
+                jobs = int( arg )
+            except ValueError:
+                jobs = 0
+            if jobs < 1:
+                eprint('jobs must be a positive integer')
+                usage()
+                sys.exit( 2 )
+
+        elif opt in ( '-i', '--interval' ):
+            interval = wrfGFS.read_interval( arg )
+
         elif opt in ( '-s', '--sector' ):
             sector = arg  
 
@@ -80,6 +151,9 @@ def read_args( argv ):
         elif opt in ( '-r', '--rundate' ):
             rundate = arg  
 
+        elif opt in ( '-u', '--until' ):
+            until = arg
+
         elif opt in ( '-b', '--begin' ):   # REVIEW: this is not general enough
                                            #         only works for 00,06,12,18
             begin = int(arg)
@@ -103,46 +177,49 @@ def read_args( argv ):
         usage()                     
         sys.exit( 2 )
 
-    return sector, rundate, begin, datadir
+    if until != None and rundate == None:
+        eprint('--until needs a rundate.')
+        usage()
+        sys.exit( 2 )
+
+    return sector, rundate, until, begin, datadir, stream, index, codec, \
+           threads, jobs, interval
 
 # end read_args
 
-if __name__ == '__main__':  
+# parse a YYYYMMDD date
+def parse_date( date ):
+    return datetime.datetime.strptime( date, '%Y%m%d' ).date()
 
-    # get run date and domain sector
-    sector, rundate, begin, datadir = read_args( sys.argv[1:] ) 
+# calculate ETo from the hourly frames as wrf.exe writes them,
+# taking ETo off the critical path; see eto_FAO.py --stream.
+# stopped if the day's WRF stage fails
+def stream_eto( pipe, sector, rundate ):
 
-    # NOTE: begin time does not work below (still true?)
-    
-    # run wrf and data extraction
-
-    eprint('running wrfGFS on', sector + '.')
-
-    if rundate == None:
-    
-        # figure out yesterday's date
-        today = datetime.datetime.now() # local time
-        yesterday = today - datetime.timedelta(days = 1)
-        rundate = yesterday.strftime( "%Y%m%d" )
+    eprint('streaming ETo on', sector, 'for date', rundate + '.')
+    streamer = subprocess.Popen( [ script_dir + 'eto_FAO.py',
+                                   '-s', sector, '-r', rundate,
+                                   '-w', wrfGFS.run_dirs( sector, rundate )[1] ] )
 
-    # run the WRF script
-    status = os.system( script_dir + 'wrfGFS.py -s ' + 
-                        sector + ' -b ' + '%02d'%begin +
-                        ' -d ' + datadir + ' -r ' + rundate )
-    # check return status
-    if status != 0:
-        eprint('wrfGFS failed.')
-        sys.exit(2)
+    while streamer.poll() == None:
+        if pipe.status( rundate + '/wrf' ) in ( pipeline.FAILED,
+                                                pipeline.BLOCKED ):
+            streamer.terminate()
+            streamer.wait()
+            raise IOError( 'ETo stream stopped, wrf failed.' )
+        time.sleep( 5 )
 
-    eprint('wrfGFS completed.')
+    if streamer.returncode != 0:
+        raise IOError( 'ETo stream failed.' )
 
-    # post-processing
+# run one of the scripts
+def run_script( command, failure ):
+    if os.system( command ) != 0:
+        raise IOError( failure )
 
-    # go to working directory
-    wdir = outdir + sector + '/' + rundate
-    os.chdir( wdir )
+def rename_outputs( wdir ):
 
-    for f in glob.glob( 'wrfout_d*' ):
+    for f in glob.glob( wdir + '/wrfout_d*' ):
     
         newfile = f.replace( ':', '-' ) # replace ':' with '-' 
                                         # because gdal cannot 
@@ -150,67 +227,169 @@ if __name__ == '__main__':
                                         # containing ':'
         os.rename( f, newfile )
 
-    ''' DISABLED for git release
-    # run ETo calculations for this sector
-    eprint('running ETo script on', sector,'for date', rundate + '.')
+# should move these files offline, but can be too expensive to store
+# depending WRF Registry variable output.
+# for now zap domains 1 and 2, keep domain 3 (3.3km) for future analysis 
+def prune_outputs( wdir ):
 
-    status = os.system( script_dir + 'eto_FAO.py -s ' + sector +
-                        ' -r ' + rundate )
-    if status != 0:
-        eprint('ETo failed.')
-        sys.exit(2)
-    eprint('ETo script completed.')
+    for f in glob.glob( wdir + '/wrfout_d0[1-2]*' ):
+        os.remove( f )
 
-    eprint('running ETo WRF merge script on', sector, 
-          'for date', rundate + '.')
+# compress blocks of the tar stream on all cores, in process; the
+# tarball is written under a temporary name and renamed when whole
+def tar_outputs( sector, rundate, index, codec, threads ):
 
-    status = os.system( script_dir + 'merge.py -s ' + sector +
-                        ' -r ' + rundate )
-    if status != 0:
-        eprint('merge failed.')
-        sys.exit(2)
-    eprint('merge completed.')
+    tarpath = outdir + sector + '/' + rundate + blockzip.tar_suffix( codec )
+    wdir = outdir + sector + '/' + rundate
 
-    # remove ETo*.npy files
-    os.chdir( wdir )
-    for f in glob.glob( 'ETo*.npy' ):
-        os.remove( f )
+    eprint( "tar'ing output files for", rundate )
+    if index:
+        stats = tarindex.archive( tarpath, wdir, codec, threads=threads )
+    else:
+        stats = blockzip.tarball( tarpath, wdir, codec, threads=threads )
+    eprint( blockzip.report( codec, stats ) )
+
+    shutil.rmtree( wdir )
+
+## add a day's stages: its ETo stream, the WPS/WRF ones, then renaming,
+## pruning and tar'ing the outputs
+## @param interval - hours between WRF restart files, None for none
+## @return name of the day's WRF store stage
+def add_day( pipe, sector, rundate, begin, datadir, stream, index, codec,
+             threads, interval ):
 
+    yesterday, today = wrfGFS.get_days( rundate )
+    wdir = outdir + sector + '/' + rundate
+    prefix = rundate + '/'
+
+    # the store stage moves the wrfout files the stream reads; a
+    # restarted wrf.exe writes new wrfout files, with recovery the
+    # stream waits for them to be stitched
+    store_after = []
+    if stream:
+        eto_after = [ prefix + 'real' ]
+        if interval != None:
+            eto_after = [ prefix + 'wrf' ]
+        # a watcher: it polls the wrf stage added after it; with the
+        # days run at once every day's stream may be waiting, none of
+        # them holding a job
+        pipe.add( pipeline.stage( prefix + 'eto',
+                                  lambda: stream_eto( pipe, sector, rundate ),
+                                  after=eto_after, watcher=True ) )
+        store_after.append( prefix + 'eto' )
+
+    store = wrfGFS.add_stages( pipe, sector, yesterday, today, begin,
+                               datadir, store_after=store_after,
+                               interval=interval )
+
+    pipe.add( pipeline.stage( prefix + 'rename',
+                              lambda: rename_outputs( wdir ),
+                              inputs=[ wdir + '/wrfout_d0*' ],
+                              after=[ store ] ) )
+
+    ''' DISABLED for git release
+    # run ETo calculations and merge for this sector in one pass
+    # (replaces eto_FAO.py then merge.py; no ETo*.npy files to remove);
+    # uses the streamed ETo_FAO_*.npy files if there are any
+    pipe.add( pipeline.stage( prefix + 'postproc',
+                              lambda: run_script( script_dir +
+                                                  'postproc.py -p -s ' +
+                                                  sector + ' -r ' + rundate,
+                                                  'post-processing failed.' ),
+                              after=[ prefix + 'rename' ] ) )
     '''
-    # should move these files offline, but can be too expensive to store
-    # depending WRF Registry variable output.
-    # for now zap domains 1 and 2, keep domain 3 (3.3km) for future analysis 
-    for f in glob.glob( 'wrfout_d0[1-2]*' ):
-        os.remove( f )
+
+    pipe.add( pipeline.stage( prefix + 'prune',
+                              lambda: prune_outputs( wdir ),
+                              after=[ prefix + 'rename' ] ) )
 
     ''' DISABLED for git release
     # upload to web server
-    status = os.system( script_dir + 'upload.sh -s ' + sector +
-                        ' -r ' + rundate )
-    if status != 0:
-        eprint('upload failed.')
-        sys.exit(2)
-
-    eprint('upload completed.')
+    pipe.add( pipeline.stage( prefix + 'upload',
+                              lambda: run_script( script_dir +
+                                                  'upload.sh -s ' + sector +
+                                                  ' -r ' + rundate,
+                                                  'upload failed.' ),
+                              after=[ prefix + 'prune' ] ) )
     '''
+
+    pipe.add( pipeline.stage( prefix + 'tar',
+                              lambda: tar_outputs( sector, rundate, index,
+                                                   codec, threads ),
+                              outputs=[ outdir + sector + '/' + rundate +
+                                        blockzip.tar_suffix( codec ) ],
+                              after=[ prefix + 'prune' ] ) )
+
+    return store
+
+if __name__ == '__main__':  
+
+    # get run dates and domain sector
+    sector, rundate, until, begin, datadir, stream, index, codec, threads, \
+        jobs, interval = read_args( sys.argv[1:] ) 
+
+    # NOTE: begin time does not work below (still true?)
     
-    os.chdir( outdir + sector )
-    time.sleep(5)    # attempt to make tar more robust; 
-                     # tar seems to fail occasionally; crontab connected?
-    eprint( "tar'ing output files" )
-    status = os.system( 'tar cvfz ' + rundate + '.tar.gz ' + rundate )
-    if status != 0:
-        eprint('tarball failed.')
-        sys.exit(2)
-    eprint('tarball completed.')
+    # run wrf and data extraction
+
+    eprint('running wrfGFS on', sector + '.')
+
+    if rundate == None:
+    
+        # figure out yesterday's date
+        today = datetime.datetime.now() # local time
+        yesterday = today - datetime.timedelta(days = 1)
+        rundate = yesterday.strftime( "%Y%m%d" )
+
+    if until == None:
+        until = rundate
 
     try:
-        shutil.rmtree( rundate )
-    except OSError as e:
-        eprint('could not remove:',rundate)
+        first = parse_date( rundate )
+        last = parse_date( until )
+    except ValueError as e:
+        eprint( e )
         sys.exit( 2 )
 
+    rundates = []
+    while first <= last:
+        rundates.append( first.strftime( "%Y%m%d" ) )
+        first += datetime.timedelta( days=1 )
+
+    # check the data of every day before locking the dates
+    for day in rundates:
+        yesterday, today = wrfGFS.get_days( day )
+        try:
+            wrfGFS.check_data_exists( datadir, yesterday.strftime( "%Y%m%d" ),
+                                      today.strftime( "%Y%m%d" ) )
+        except IOError as e:
+            eprint( e )
+            eprint('wrfGFS failed.')
+            sys.exit(2)
+
+    lockpaths = wrfGFS.set_lock( sector, rundates )
+
+    # each day runs in its own scratch directories, the days' stages
+    # run at once, jobs at a time
+    pipe = pipeline.pipeline( wrfGFS.state_path( sector, rundates ), jobs,
+                              wrfGFS.checkpoint_path( sector, rundates ) )
+    for day in rundates:
+        add_day( pipe, sector, day, begin, datadir, stream, index, codec,
+                 threads, interval )
+
+    ok = pipe.run()
+
+    # a day's WPS/WRF stages done, the date is free; its lock is left on
+    # failure, see run_wrf
+    for day in rundates:
+        if pipe.status( day + '/store' ) == pipeline.DONE:
+            os.remove( lockpaths[day] )
+
+    if not ok:
+        eprint('stages failed:', ', '.join( pipe.failed() ))
+        sys.exit(2)
+
     eprint('RUN COMPLETED SUCCESSFULLY for sector:', sector + ',', 
-          'rundate:', rundate + '.')
+          'rundate:', ' to '.join( sorted( set( [ rundate, until ] ) ) ) + '.')
 
 # end run_wrfgfs.py
@@ -0,0 +1,751 @@
+#! /usr/bin/env /usr/bin/python3
+
+#  tarindex.py
+#
+#  Copyright (c) 2026 agent
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#  or visit https://www.gnu.org/licenses/gpl-3.0-standalone.html
+#
+tarindex_copyright = 'tarindex.py Copyright (c) 2026 agent ' + \
+                     'released under GNU GPL V3.0'
+
+import os
+import sys
+import json
+import glob
+import time
+import bisect
+import getopt
+import struct
+import tarfile
+
+import numpy as np
+
+import blockzip
+
+## @file      tarindex.py
+## @brief     Seekable, indexed daily archives: the tar stream is cut into
+##            independently compressed members at file and netCDF
+##            variable/time boundaries, and an index of the members, the
+##            variables, their shapes and byte offsets lets a reader
+##            decompress only the blocks it needs.
+## @author    agent
+## @copyright Copyright (c) 2026 agent. All Rights Reserved.
+## @license   Released under GNU General Public License V3.0
+## @results   <date>.tar.gz and its index, <date>.tar.gz.idx
+
+# The archive stays a standard multi-member .tar.gz (see blockzip.py),
+# tar xzf and the other scripts read it as before. The index, JSON, holds:
+#
+#   blocks  - [ tar offset, tar bytes, file offset, file bytes ] of each
+#             compressed member
+#   members - per tar member its name, data offset in the tar stream and
+#             size; for netCDF classic files (wrfout, SMV) also each
+#             variable's dimensions, shape, dtype and data offset, record
+#             variables with the record size, so variable v at time t is
+#             at offset + begin + t*recsize
+#
+# A block starts at every tar member and, once MINBLOCK bytes are
+# buffered, at the next variable or record slab; slabs of a few KB share
+# blocks, a 2D field of a 3 km domain is about one block.
+
+# print functions to reduce clutter and to flush output
+def eprint( *args ):
+    print( *args, file=sys.stderr, flush=True)
+
+def oprint( *args ):
+    print( *args, file=sys.stdout, flush=True)
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = '.idx'
+
+# bytes buffered before a slab boundary starts a new block
+MINBLOCK = 256*1024
+
+# largest block, bytes; slabs bigger than this span blocks
+MAXBLOCK = 16*1024*1024
+
+# bytes copied per read
+COPYSIZE = 1024*1024
+
+# --------------------------------------------------------------------
+# netCDF classic (CDF-1, CDF-2, CDF-5) header layout
+
+# nc_type: numpy big endian dtype
+NC_TYPES = { 1:'i1', 2:'S1', 3:'>i2', 4:'>i4', 5:'>f4', 6:'>f8',
+             7:'u1', 8:'>u2', 9:'>u4', 10:'>i8', 11:'>u8' }
+
+NC_DIMENSION = 10
+NC_VARIABLE = 11
+NC_ATTRIBUTE = 12
+STREAMING = 0xFFFFFFFF
+
+# header incomplete, read more
+class truncated( Exception ):
+    pass
+
+class header():
+
+    def __init__( self, data ):
+
+        if len( data ) < 4:
+            raise truncated()
+        if data[:3] != b'CDF' or data[3] not in ( 1, 2, 5 ):
+            raise ValueError( 'not a netCDF classic file' )
+
+        self.data = data
+        self.pos = 4
+        self.version = data[3]
+
+        # CDF-5 counts are 64 bit, CDF-2 and CDF-5 offsets are
+        self.count = '>q' if self.version == 5 else '>i'
+        self.offset = '>i' if self.version == 1 else '>q'
+
+    def unpack( self, fmt ):
+
+        size = struct.calcsize( fmt )
+        if self.pos + size > len( self.data ):
+            raise truncated()
+        value = struct.unpack_from( fmt, self.data, self.pos )[0]
+        self.pos += size
+        return value
+
+    def skip( self, size ):
+
+        if self.pos + size > len( self.data ):
+            raise truncated()
+        self.pos += ( size + 3 ) & ~3   # padded to 4 bytes
+
+    def name( self ):
+
+        n = self.unpack( self.count )
+        start = self.pos
+        self.skip( n )
+        return self.data[start:start+n].decode( 'utf-8' )
+
+    # absent or a list tag, returns the element count
+    def list_count( self, tag ):
+
+        found = self.unpack( '>i' )
+        n = self.unpack( self.count )
+        if found not in ( 0, tag ):
+            raise ValueError( 'bad netCDF header' )
+        return n
+
+    def skip_attributes( self ):
+
+        for i in range( self.list_count( NC_ATTRIBUTE ) ):
+            self.name()
+            nc_type = self.unpack( '>i' )
+            n = self.unpack( self.count )
+            self.skip( n*np.dtype( NC_TYPES[nc_type] ).itemsize )
+
+    ## @return { 'numrecs', 'recsize', 'variables':{ name:{ 'dims', 'shape',
+    ##          'dtype', 'begin', 'record' } } }, shapes without the record
+    ##          dimension for record variables
+    def parse( self, filesize ):
+
+        numrecs = self.unpack( self.count )
+
+        dims = []
+        for i in range( self.list_count( NC_DIMENSION ) ):
+            dims.append( ( self.name(), self.unpack( self.count ) ) )
+
+        self.skip_attributes()
+
+        variables = {}
+        for i in range( self.list_count( NC_VARIABLE ) ):
+            name = self.name()
+            ids = [ self.unpack( self.count )
+                    for j in range( self.unpack( self.count ) ) ]
+            self.skip_attributes()
+            dtype = NC_TYPES[self.unpack( '>i' )]
+            self.unpack( self.count )     # vsize, clamped for large variables
+            begin = self.unpack( self.offset )
+
+            record = len( ids ) > 0 and dims[ids[0]][1] == 0
+            shape = [ dims[d][1] for d in ids ]
+            if record:
+                shape = shape[1:]
+
+            variables[name] = { 'dims':[ dims[d][0] for d in ids ],
+                                'shape':shape,
+                                'dtype':dtype,
+                                'begin':begin,
+                                'record':record }
+
+        # one record is every record variable's slab, each padded to 4
+        # bytes unless there is only one
+        records = [ v for v in variables.values() if v['record'] ]
+        recsize = 0
+        for v in records:
+            nbytes = slab_bytes( v )
+            if len( records ) > 1:
+                nbytes = ( nbytes + 3 ) & ~3
+            recsize += nbytes
+
+        if numrecs == STREAMING or ( self.version != 5 and numrecs < 0 ):
+            numrecs = 0
+            if recsize > 0:
+                numrecs = ( filesize - min( v['begin'] for v in records ) ) \
+                          // recsize
+
+        return { 'numrecs':numrecs,
+                 'recsize':recsize,
+                 'variables':variables }
+
+# end class header
+
+# bytes of one variable, or of one record of a record variable
+def slab_bytes( var ):
+    return int( np.prod( var['shape'], dtype=np.int64 ) ) * \
+           np.dtype( var['dtype'] ).itemsize
+
+## the classic layout of a netCDF file whose first bytes are in data
+## @return the layout, see header.parse, or None if not netCDF classic;
+##         raises truncated if data holds less than the whole header
+def nc_layout( data, filesize ):
+
+    try:
+        return header( data ).parse( filesize )
+    except ( ValueError, KeyError, UnicodeDecodeError, IndexError ):
+        return None
+
+# start of each variable slab in a netCDF file, file offsets
+def slab_starts( layout ):
+
+    starts = []
+    for v in layout['variables'].values():
+        if not v['record']:
+            starts.append( v['begin'] )
+            continue
+        for r in range( layout['numrecs'] ):
+            starts.append( v['begin'] + r*layout['recsize'] )
+
+    return sorted( starts )
+
+# --------------------------------------------------------------------
+
+class tarwriter():
+
+    ## @param fileobj - binary file to write the compressed archive to
+    ## @param codec, level, threads - see blockzip.blockwriter
+    ## @param minblock - bytes buffered before a slab starts a new block
+    def __init__( self, fileobj, codec='gzip', level=None, threads=None,
+                  minblock=MINBLOCK ):
+
+        self.codec = codec
+        self.minblock = minblock
+        self.writer = blockzip.blockwriter( fileobj, codec, level, threads,
+                                            MAXBLOCK )
+        self.members = []
+
+    ## add a tar member; the data of a regular file is read from fileobj
+    def add( self, tarinfo, fileobj=None ):
+
+        # every member starts a block
+        self.writer.cut()
+        self.writer.write( tarinfo.tobuf( tarfile.DEFAULT_FORMAT,
+                                          tarfile.ENCODING,
+                                          'surrogateescape' ) )
+        if not tarinfo.isreg():
+            return
+
+        member = { 'name':tarinfo.name,
+                   'offset':self.writer.raw,
+                   'size':tarinfo.size }
+
+        # the header of a netCDF classic file is well within its first
+        # slab's offset; read until it parses
+        head = b''
+        layout = None
+        while len( head ) < tarinfo.size:
+            data = fileobj.read( min( max( len( head ), 65536 ),
+                                      tarinfo.size - len( head ) ) )
+            if len( data ) == 0:
+                raise IOError( 'unexpected end of ' + tarinfo.name )
+            head += data
+            try:
+                layout = nc_layout( head, tarinfo.size )
+                break
+            except truncated:
+                continue
+
+        cuts = []
+        if layout != None:
+            member['format'] = 'netcdf3'
+            member.update( layout )
+            cuts = slab_starts( layout )
+
+        # the data, cutting at the slab starts
+        pos = 0
+        for cut in cuts + [ tarinfo.size ]:
+            cut = min( cut, tarinfo.size )
+            if cut <= pos:
+                continue
+            if self.writer.buffered() >= self.minblock:
+                self.writer.cut()
+            pos = self.copy( fileobj, head, pos, cut )
+
+        # tar pads data to its block size
+        if tarinfo.size % tarfile.BLOCKSIZE > 0:
+            self.writer.write( tarfile.NUL*( tarfile.BLOCKSIZE -
+                                             tarinfo.size % tarfile.BLOCKSIZE ) )
+        self.members.append( member )
+
+    # copy file bytes pos to stop, the first ones from head
+    def copy( self, fileobj, head, pos, stop ):
+
+        if pos < len( head ):
+            end = min( len( head ), stop )
+            self.writer.write( head[pos:end] )
+            pos = end
+
+        while pos < stop:
+            data = fileobj.read( min( COPYSIZE, stop - pos ) )
+            if len( data ) == 0:
+                raise IOError( 'unexpected end of file data' )
+            self.writer.write( data )
+            pos += len( data )
+
+        return pos
+
+    ## end the archive
+    ## @return the index
+    def close( self ):
+
+        # end of archive: two zero blocks, padded to a tar record
+        self.writer.cut()
+        size = self.writer.raw + 2*tarfile.BLOCKSIZE
+        size += -size % tarfile.RECORDSIZE
+        self.writer.write( tarfile.NUL*( size - self.writer.raw ) )
+        self.writer.close()
+
+        return { 'version':INDEX_VERSION,
+                 'codec':self.codec,
+                 'size':self.writer.written,
+                 'blocks':self.writer.blocks,
+                 'members':self.members }
+
+# end class tarwriter
+
+# --------------------------------------------------------------------
+
+class tarreader():
+
+    ## @param path - indexed archive; its index is path + INDEX_SUFFIX
+    def __init__( self, path ):
+
+        self.path = path
+        with open( path + INDEX_SUFFIX, 'r' ) as f:
+            self.index = json.load( f )
+
+        if self.index.get( 'version' ) != INDEX_VERSION:
+            raise IOError( 'unknown index version: ' + path + INDEX_SUFFIX )
+        if os.path.getsize( path ) != self.index['size']:
+            raise IOError( 'stale index: ' + path + INDEX_SUFFIX )
+
+        self.decompress = blockzip.DECOMPRESSORS[self.index['codec']]
+        self.starts = [ b[0] for b in self.index['blocks'] ]
+        self.members = {}
+        for member in self.index['members']:
+            self.members[member['name']] = member
+
+        self.f = open( path, 'rb' )
+        self.cached = ( None, None )   # last block read
+
+    def close( self ):
+        self.f.close()
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, *args ):
+        self.close()
+
+    # member names, in archive order
+    def names( self ):
+        return [ m['name'] for m in self.index['members'] ]
+
+    # a member by its name, or by its base name
+    def member( self, name ):
+
+        if name in self.members:
+            return self.members[name]
+
+        for member in self.index['members']:
+            if os.path.basename( member['name'] ) == name:
+                return member
+
+        raise KeyError( 'not in ' + self.path + ': ' + name )
+
+    def block( self, i ):
+
+        if self.cached[0] == i:
+            return self.cached[1]
+
+        start, size, offset, nbytes = self.index['blocks'][i]
+        self.f.seek( offset )
+        data = self.decompress( self.f.read( nbytes ) )
+        if len( data ) != size:
+            raise IOError( 'corrupt block %d of %s' % ( i, self.path ) )
+
+        self.cached = ( i, data )
+        return data
+
+    ## bytes of the uncompressed tar stream, decompressing only the blocks
+    ## they are in
+    def read_range( self, start, nbytes ):
+
+        out = bytearray()
+        i = bisect.bisect_right( self.starts, start ) - 1
+        while nbytes > 0:
+            data = self.block( i )
+            offset = start - self.starts[i]
+            part = data[offset:offset+nbytes]
+            out += part
+            start += len( part )
+            nbytes -= len( part )
+            i += 1
+
+        return bytes( out )
+
+    ## the contents of a member
+    def read_file( self, name ):
+
+        member = self.member( name )
+        return self.read_range( member['offset'], member['size'] )
+
+    ## the variables of a netCDF classic member, see header.parse
+    def variables( self, name ):
+
+        member = self.member( name )
+        if member.get( 'format' ) != 'netcdf3':
+            raise ValueError( 'not an indexed netCDF file: ' + name )
+        return member['variables']
+
+    ## a variable of a netCDF classic member
+    ## @param times - for record variables, a record number, a slice or
+    ##                None for all records
+    ## @return numpy array, raw values as stored (no scale or fill handling)
+    def read( self, name, var, times=None ):
+
+        member = self.member( name )
+        variables = self.variables( name )
+        if var not in variables:
+            raise KeyError( var + ' is not in ' + name )
+        v = variables[var]
+        dtype = np.dtype( v['dtype'] )
+        nbytes = slab_bytes( v )
+
+        if not v['record']:
+            data = self.read_range( member['offset'] + v['begin'], nbytes )
+            return np.frombuffer( data, dtype ).reshape( v['shape'] )
+
+        records = range( member['numrecs'] )
+        if times == None:
+            times = slice( None )
+        single = not isinstance( times, slice )
+        if single:
+            records = [ records[times] ]
+        else:
+            records = records[times]
+
+        out = np.empty( [ len( records ) ] + v['shape'], dtype )
+        for i, r in enumerate( records ):
+            data = self.read_range( member['offset'] + v['begin'] +
+                                    r*member['recsize'], nbytes )
+            out[i] = np.frombuffer( data, dtype ).reshape( v['shape'] )
+
+        if single:
+            return out[0]
+        return out
+
+# end class tarreader
+
+# --------------------------------------------------------------------
+
+# tar member info of a file, directory or symbolic link
+def tarinfo_of( path, arcname ):
+
+    st = os.lstat( path )
+    info = tarfile.TarInfo( arcname )
+    info.mode = st.st_mode & 0o7777
+    info.mtime = int( st.st_mtime )
+    info.uid = st.st_uid
+    info.gid = st.st_gid
+
+    if os.path.islink( path ):
+        info.type = tarfile.SYMTYPE
+        info.linkname = os.readlink( path )
+    elif os.path.isdir( path ):
+        info.type = tarfile.DIRTYPE
+    else:
+        info.size = st.st_size
+
+    return info
+
+# write the index next to the archive, under a temporary name then renamed
+def write_index( path, index ):
+
+    part = path + INDEX_SUFFIX + '.part'
+    with open( part, 'w' ) as f:
+        json.dump( index, f, separators=( ',', ':' ) )
+    os.replace( part, path + INDEX_SUFFIX )
+
+## tar a directory or file, like blockzip.tarball, with an index
+## @return { 'raw':tar bytes, 'stored':compressed bytes, 'seconds':wall time }
+def archive( path, srcpath, codec='gzip', level=None, threads=None,
+             minblock=MINBLOCK, arcname=None ):
+
+    if arcname == None:
+        arcname = os.path.basename( os.path.normpath( srcpath ) )
+
+    start = time.time()
+    part = path + '.part'
+    with open( part, 'wb' ) as f:
+        out = tarwriter( f, codec, level, threads, minblock )
+
+        for root, dirs, files in os.walk( srcpath ):
+            dirs.sort()
+            name = os.path.normpath( arcname + '/' +
+                                     os.path.relpath( root, srcpath ) )
+            out.add( tarinfo_of( root, name ) )
+
+            for fname in sorted( files ):
+                fpath = root + '/' + fname
+                info = tarinfo_of( fpath, name + '/' + fname )
+                if info.isreg():
+                    with open( fpath, 'rb' ) as src:
+                        out.add( info, src )
+                else:
+                    out.add( info )
+
+        index = out.close()
+
+    os.replace( part, path )
+    write_index( path, index )
+
+    return { 'raw':out.writer.raw,
+             'stored':out.writer.written,
+             'seconds':time.time() - start }
+
+## rewrite an existing .tar.gz (any compressed tar) as an indexed archive,
+## streaming; path may be src, it is replaced when the new one is whole
+## @return see archive
+def reindex( src, path, threads=None, minblock=MINBLOCK ):
+
+    start = time.time()
+    part = path + '.part'
+    with open( part, 'wb' ) as f:
+        out = tarwriter( f, 'gzip', None, threads, minblock )
+
+        # not tarfile's 'r|*', it stops after the first gzip member
+        with blockzip.tarstream( src ) as tar:
+            for member in tar:
+                if member.isreg():
+                    out.add( member, tar.extractfile( member ) )
+                else:
+                    out.add( member )
+
+        index = out.close()
+
+    os.replace( part, path )
+    write_index( path, index )
+
+    return { 'raw':out.writer.raw,
+             'stored':out.writer.written,
+             'seconds':time.time() - start }
+
+# is the archive's index there and current
+def indexed( path ):
+
+    try:
+        with open( path + INDEX_SUFFIX, 'r' ) as f:
+            index = json.load( f )
+    except ( OSError, ValueError ):
+        return False
+
+    return index.get( 'version' ) == INDEX_VERSION and \
+           index.get( 'size' ) == os.path.getsize( path )
+
+# --------------------------------------------------------------------
+
+# command line options
+def usage():
+    eprint('usage: tarindex.py -h -t threads -m KB -o outdir archive ...')
+    eprint('       tarindex.py --help --threads=threads --minblock=KB --outdir=outdir archive ...')
+    eprint('       tarindex.py -l archive')
+    eprint('       tarindex.py -f file -v variable -n record archive')
+    eprint('       rewrites each <date>.tar.gz archive (or the ones in a')
+    eprint('       directory lacking a current index) as a seekable archive')
+    eprint('       with its index, <date>.tar.gz' + INDEX_SUFFIX)
+    eprint('       --outdir writes them there instead of in place')
+    eprint('       --minblock sets the bytes per block before a variable')
+    eprint('       starts a new one (default %d KB)' % ( MINBLOCK//1024 ) )
+    eprint('       --list lists the files and netCDF variables of an archive')
+    eprint('       --file, --variable read a variable of a file in the')
+    eprint('       archive, --record one time record of it (default all), and')
+    eprint('       print its statistics and the read time')
+
+# end usage
+
+def read_args( argv ):
+
+    options = { 'threads':None,
+                'minblock':MINBLOCK,
+                'outdir':None,
+                'list':False,
+                'file':None,
+                'variable':None,
+                'record':None }
+
+    try:
+        opts, args = getopt.getopt( argv, 'hlt:m:o:f:v:n:',
+                                    ['help','list','threads=','minblock=',
+                                     'outdir=','file=','variable=',
+                                     'record='] )
+    except getopt.GetoptError:
+        eprint('unknown command arguments')
+        usage()
+        sys.exit(2)
+
+    try:
+        for opt, arg in opts:
+            if opt in ( '-h', '--help' ):
+                usage()
+                sys.exit(0)
+
+            elif opt in ( '-l', '--list' ):
+                options['list'] = True
+
+            elif opt in ( '-t', '--threads' ):
+                options['threads'] = int( arg )
+                if options['threads'] < 1:
+                    raise ValueError( 'threads must be a positive integer' )
+
+            elif opt in ( '-m', '--minblock' ):
+                options['minblock'] = int( float( arg )*1024 )
+                if options['minblock'] < 1:
+                    raise ValueError( 'minblock must be positive' )
+
+            elif opt in ( '-o', '--outdir' ):
+                options['outdir'] = arg
+
+            elif opt in ( '-f', '--file' ):
+                options['file'] = arg
+
+            elif opt in ( '-v', '--variable' ):
+                options['variable'] = arg
+
+            elif opt in ( '-n', '--record' ):
+                options['record'] = int( arg )
+
+    except ValueError as e:
+        eprint( e )
+        usage()
+        sys.exit(2)
+
+    if len( args ) == 0 or \
+       ( options['file'] == None ) != ( options['variable'] == None ):
+        usage()
+        sys.exit(2)
+
+    return options, args
+
+# end read_args
+
+# list the members and variables of an indexed archive
+def list_archive( path ):
+
+    with tarreader( path ) as reader:
+        oprint( '%s: %d blocks' % ( path, len( reader.index['blocks'] ) ) )
+        for member in reader.index['members']:
+            oprint( '%12d  %s' % ( member['size'], member['name'] ) )
+            if member.get( 'format' ) != 'netcdf3':
+                continue
+            for name, v in member['variables'].items():
+                shape = v['shape']
+                if v['record']:
+                    shape = [ member['numrecs'] ] + shape
+                oprint( '              %-12s %-4s %s' %
+                        ( name, v['dtype'].lstrip( '>' ),
+                          '(' + ', '.join( v['dims'] ) + ') ' +
+                          'x'.join( str( n ) for n in shape ) ) )
+
+# read one variable and report it
+def query( path, options ):
+
+    start = time.time()
+    with tarreader( path ) as reader:
+        data = reader.read( options['file'], options['variable'],
+                            options['record'] )
+    seconds = time.time() - start
+
+    oprint( '%s %s: %s %s' % ( options['file'], options['variable'],
+                               data.dtype, 'x'.join( str( n )
+                                                     for n in data.shape ) ) )
+    if data.dtype.kind in 'iuf' and data.size > 0:
+        oprint( 'min %g  max %g  mean %g' % ( data.min(), data.max(),
+                                              data.astype( np.float64 ).mean() ) )
+    oprint( 'read in %.1f ms' % ( seconds*1000 ) )
+
+if __name__ == '__main__':
+
+    options, args = read_args( sys.argv[1:] )
+
+    if options['list'] or options['file'] != None:
+        try:
+            for path in args:
+                if options['list']:
+                    list_archive( path )
+                else:
+                    query( path, options )
+        except ( OSError, KeyError, ValueError, IndexError ) as e:
+            eprint( e )
+            sys.exit(2)
+        sys.exit(0)
+
+    # archives given, or the ones in directories without a current index
+    paths = []
+    for arg in args:
+        if os.path.isdir( arg ):
+            paths += [ p for p in sorted( glob.glob( arg + '/*.tar.gz' ) )
+                       if not indexed( p ) ]
+        else:
+            paths.append( arg )
+
+    nfailed = 0
+    for path in paths:
+        dst = path
+        if options['outdir'] != None:
+            dst = options['outdir'] + '/' + os.path.basename( path )
+
+        try:
+            stats = reindex( path, dst, options['threads'],
+                             options['minblock'] )
+        except Exception as e:
+            eprint( 'failed on', path + ':', repr(e) )
+            nfailed += 1
+            continue
+
+        eprint( dst + ':', blockzip.report( 'gzip', stats ) )
+
+    if nfailed > 0:
+        eprint( nfailed, 'of', len( paths ), 'archives failed' )
+        sys.exit(2)
+
+# end tarindex.py
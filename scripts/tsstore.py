@@ -0,0 +1,414 @@
+#! /usr/bin/env /usr/bin/python3
+
+#  tsstore.py
+#
+#  Copyright (c) 2026 agent
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#  or visit https://www.gnu.org/licenses/gpl-3.0-standalone.html
+#
+tsstore_copyright = 'tsstore.py Copyright (c) 2026 agent ' + \
+                    'released under GNU GPL V3.0'
+
+import os
+import re
+import sys
+import glob
+import time
+import getopt
+import shutil
+import datetime
+
+import numpy as np
+from netCDF4 import Dataset
+
+import tarindex
+import blockzip
+
+## @file      tsstore.py
+## @brief     Per sector time series store of the daily soil moisture
+##            variables (SMV): one NETCDF4 file per domain with an
+##            unlimited time dimension, appended to daily by merge.py,
+##            rebuilt from the archive by this script.
+## @author    agent
+## @copyright Copyright (c) 2026 agent. All Rights Reserved.
+## @license   Released under GNU General Public License V3.0
+## @results   <sector>/series/SMV_dNN.nc
+
+# The time axis is daily and regular from the first day stored: a day's
+# index is its distance from that day, so appending a day twice
+# overwrites it and missing days are left as fill values.
+#
+# Variables are chunked long in time and small in space, TCHUNK days by
+# SCHUNK x SCHUNK pixels, so years of one pixel are a few chunk reads.
+# Appending a day rewrites the current time block of every spatial chunk.
+
+# print functions to reduce clutter and to flush output
+def eprint( *args ):
+    print( *args, file=sys.stderr, flush=True)
+
+def oprint( *args ):
+    print( *args, file=sys.stdout, flush=True)
+
+# default chunk shape, days and pixels
+TCHUNK = 64
+SCHUNK = 32
+
+EPOCH = datetime.date( 1970, 1, 1 )
+
+# variables of the SMV files not stored, the grid cache has them
+SKIP_VARS = [ 'XLAT', 'XLONG' ]
+
+# domain and run date of a WRF or SMV file name,
+# eg. ('d03', 2022-05-01) for S_SMV_d03_2022-05-01_06-00-00.nc
+def domain_date( path ):
+
+    m = re.search( r'_(d\d\d)_(\d{4})-(\d\d)-(\d\d)', os.path.basename( path ) )
+    if m == None:
+        raise ValueError( 'no domain and date in file name: ' + path )
+
+    return m.group(1), datetime.date( int( m.group(2) ), int( m.group(3) ),
+                                      int( m.group(4) ) )
+
+class tsstore():
+
+    ## @param path - store file, eg. <output>/<sector>/series/SMV_d03.nc
+    ## @param tchunk - chunk length in days
+    ## @param schunk - chunk side in pixels
+    ## @param complevel - zlib level
+    def __init__( self, path, tchunk=TCHUNK, schunk=SCHUNK, complevel=4 ):
+
+        self.path = path
+        self.tchunk = tchunk
+        self.schunk = schunk
+        self.complevel = complevel
+
+    # new store laid out for the grid of the first day's variables
+    def create( self, date, shape, gattrs ):
+
+        os.makedirs( os.path.dirname( os.path.abspath( self.path ) ),
+                     exist_ok=True )
+
+        ds = Dataset( self.path, 'w', format='NETCDF4' )
+
+        ds.description = 'Daily soil moisture variables (SMV) time series based on the WRF model.  For research and educational purposes only.'
+        ds.history = 'File created on ' + time.ctime(time.time()) + '.'
+        for attr in gattrs:
+            if attr not in [ 'description', 'history' ]:
+                ds.setncattr( attr, gattrs[attr] )
+        ds.setncattr( 'START_DATE', date.isoformat() )
+
+        ds.createDimension( 'time', None )
+        ds.createDimension( 'south_north', shape[0] )
+        ds.createDimension( 'west_east', shape[1] )
+
+        tvar = ds.createVariable( 'time', 'i4', ('time',) )
+        tvar.setncattr( 'units', 'days since ' + EPOCH.isoformat() )
+        tvar.setncattr( 'calendar', 'standard' )
+        tvar.setncattr( 'description', 'WRF RUN START DATE' )
+
+        return ds
+
+    def create_var( self, ds, name, attrs ):
+
+        ny = len( ds.dimensions['south_north'] )
+        nx = len( ds.dimensions['west_east'] )
+
+        var = ds.createVariable( name, 'f4', ('time','south_north','west_east'),
+                                 zlib=True, complevel=self.complevel,
+                                 shuffle=True,
+                                 chunksizes=( self.tchunk,
+                                              min( self.schunk, ny ),
+                                              min( self.schunk, nx ) ) )
+        for attr in attrs:
+            if attr == '_FillValue':
+                continue
+            elif attr == 'coordinates':
+                var.setncattr( attr, 'XLONG XLAT time' )
+            else:
+                var.setncattr( attr, attrs[attr] )
+
+        return var
+
+    ## store a day's variables
+    ## @param date - datetime.date of the WRF run
+    ## @param values - dictionary of 2-D arrays keyed by variable name
+    ## @param attrs - dictionary of variable attribute dictionaries
+    ## @param gattrs - global attributes, used when the store is created
+    def append( self, date, values, attrs, gattrs ):
+
+        shape = None
+        for name in values:
+            if shape == None:
+                shape = values[name].shape
+            elif values[name].shape != shape:
+                raise ValueError( 'variables have different shapes' )
+
+        if os.path.isfile( self.path ):
+            ds = Dataset( self.path, 'a' )
+        else:
+            ds = self.create( date, shape, gattrs )
+
+        try:
+            store_shape = ( len( ds.dimensions['south_north'] ),
+                            len( ds.dimensions['west_east'] ) )
+            if shape != store_shape:
+                raise IOError( 'grid ' + str(shape) + ' does not match ' +
+                               self.path + ' ' + str(store_shape) )
+
+            start = datetime.date.fromisoformat( ds.getncattr( 'START_DATE' ) )
+            i = ( date - start ).days
+            if i < 0:
+                raise IOError( str(date) + ' is before the start of ' +
+                               self.path + ', ' + str(start) + '; rebuild it' )
+
+            # extend the time axis over any missing days
+            tvar = ds.variables['time']
+            n = len( tvar )
+            if i >= n:
+                tvar[n:i+1] = np.arange( n, i+1 ) + ( start - EPOCH ).days
+
+            for name in values:
+                if name not in ds.variables:
+                    self.create_var( ds, name, attrs.get( name, {} ) )
+                ds.variables[name][i] = values[name]
+
+        finally:
+            ds.close()
+
+    ## store the variables of an SMV file or open Dataset
+    ## @param date - datetime.date, default from the file name
+    def append_file( self, smv, date=None ):
+
+        if isinstance( smv, Dataset ):
+            ds = smv
+        else:
+            ds = Dataset( smv, 'r' )
+
+        if date == None:
+            date = domain_date( ds.filepath() )[1]
+
+        ds.set_auto_mask( False )
+
+        values = {}
+        attrs = {}
+        for name in ds.variables:
+            var = ds.variables[name]
+            if name in SKIP_VARS or var.ndim != 2:
+                continue
+            values[name] = var[:]
+            attrs[name] = dict( ( a, var.getncattr( a ) ) for a in var.ncattrs() )
+
+        gattrs = dict( ( a, ds.getncattr( a ) ) for a in ds.ncattrs() )
+
+        if not isinstance( smv, Dataset ):
+            ds.close()
+
+        self.append( date, values, attrs, gattrs )
+
+    ## a pixel's series of a variable
+    ## @return dates, values (masked on missing days)
+    def series( self, name, y, x ):
+
+        ds = Dataset( self.path, 'r' )
+        start = datetime.date.fromisoformat( ds.getncattr( 'START_DATE' ) )
+        values = ds.variables[name][:,y,x]
+        ds.close()
+
+        dates = [ start + datetime.timedelta( days=i )
+                  for i in range( len( values ) ) ]
+
+        return dates, values
+
+# end class tsstore
+
+# --------------------------------------------------------------------
+
+outdir = '/students/agrineer/wrf/output'
+
+# store file of a sector domain in the sector series directory
+def store_path( series_dir, domain ):
+    return series_dir + '/SMV_' + domain + '.nc'
+
+# SMV files of a daily archive, ( name, Dataset ) in file order; tarballs
+# are read in memory, nothing is extracted
+def archive_members( path ):
+
+    if os.path.isdir( path ):
+        for f in sorted( glob.glob( path + '/*_SMV_d*.nc' ) ):
+            yield os.path.basename( f ), Dataset( f, 'r' )
+        return
+
+    # seek to the SMV files of an indexed archive, skipping the wrfout
+    if tarindex.indexed( path ):
+        with tarindex.tarreader( path ) as reader:
+            for member in reader.names():
+                name = os.path.basename( member )
+                if '_SMV_d' in name and name.endswith( '.nc' ):
+                    yield name, Dataset( name, 'r',
+                                         memory=reader.read_file( member ) )
+        return
+
+    with blockzip.tarstream( path ) as tar:
+        for member in tar:
+            name = os.path.basename( member.name )
+            if not member.isfile() or '_SMV_d' not in name or \
+               not name.endswith( '.nc' ):
+                continue
+            data = tar.extractfile( member ).read()
+            yield name, Dataset( name, 'r', memory=data )
+
+# command line options
+def usage():
+    eprint('usage: tsstore.py -h -t days -x pixels -i input -o output -s sector')
+    eprint('       tsstore.py --help --tchunk=days --schunk=pixels --input=input --output=output --sector=sector')
+    eprint('       rebuilds the sector time series stores, <output>/series/SMV_dNN.nc,')
+    eprint('       from the daily SMV files in input: the <date>.tar.gz archives')
+    eprint('       and <date> directories (eg. from hindcast.py) there')
+    eprint('       input and output default to ' + outdir + '/<sector>')
+    eprint('       --tchunk and --schunk set the chunk shape (default %d days,'
+           % TCHUNK )
+    eprint('       %d x %d pixels)' % ( SCHUNK, SCHUNK ) )
+
+# end usage
+
+# parse a positive integer option or exit
+def positive_int( name, arg ):
+
+    try:
+        value = int( arg )
+    except ValueError:
+        value = 0
+
+    if value < 1:
+        eprint( name, 'must be a positive integer' )
+        usage()
+        sys.exit(2)
+
+    return value
+
+def read_args( argv ):
+
+    options = { 'sector':None,
+                'input':None,
+                'output':None,
+                'tchunk':TCHUNK,
+                'schunk':SCHUNK }
+
+    try:
+        opts, args = getopt.getopt( argv,
+                                    'ht:x:i:o:s:',
+                                    ['help','tchunk=','schunk=','input=',
+                                     'output=','sector='])
+    except getopt.GetoptError:
+        eprint('unknown command arguments')
+        usage()
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ( '-h', '--help' ):
+            usage()
+            sys.exit(0)
+
+        elif opt in ( '-t', '--tchunk' ):
+            options['tchunk'] = positive_int( 'tchunk', arg )
+
+        elif opt in ( '-x', '--schunk' ):
+            options['schunk'] = positive_int( 'schunk', arg )
+
+        elif opt in ( '-i', '--input' ):
+            options['input'] = arg
+
+        elif opt in ( '-o', '--output' ):
+            options['output'] = arg
+
+        elif opt in ( '-s', '--sector' ):
+            options['sector'] = arg
+
+    if options['sector'] == None:
+        usage()
+        sys.exit( 2 )
+
+    if options['input'] == None:
+        options['input'] = outdir + '/' + options['sector']
+
+    if options['output'] == None:
+        options['output'] = outdir + '/' + options['sector']
+
+    return options
+
+# end read_args
+
+if __name__ == '__main__':
+
+    options = read_args( sys.argv[1:] )
+
+    if not os.path.isdir( options['input'] ):
+        eprint('directory:', options['input'], 'does not exist')
+        sys.exit(2)
+
+    # daily archives, <date>.tar.gz or <date>/, in date order
+    days = {}
+    for path in glob.glob( options['input'] + '/*' ):
+        name = os.path.basename( path )
+        if name.endswith( '.tar.gz' ):
+            name = name[:-7]
+        if len( name ) == 8 and name.isdigit():
+            days.setdefault( name, [] ).append( path )
+
+    # build next to the stores, replace them when complete
+    build_dir = options['output'] + '/series.rebuild'
+    shutil.rmtree( build_dir, ignore_errors=True )
+
+    stores = {}
+    start = time.time()
+    nfiles = 0
+    nfailed = 0
+
+    for day in sorted( days ):
+        for path in sorted( days[day] ):
+            try:
+                for name, ds in archive_members( path ):
+
+                    domain, date = domain_date( name )
+                    if domain not in stores:
+                        stores[domain] = tsstore( store_path( build_dir,
+                                                              domain ),
+                                                  options['tchunk'],
+                                                  options['schunk'] )
+                    try:
+                        stores[domain].append_file( ds, date )
+                    finally:
+                        ds.close()
+                    nfiles += 1
+
+            except Exception as e:
+                eprint( 'failed on', path + ':', repr(e) )
+                nfailed += 1
+
+    os.makedirs( options['output'] + '/series', exist_ok=True )
+    for domain in stores:
+        os.replace( stores[domain].path,
+                    store_path( options['output'] + '/series', domain ) )
+    shutil.rmtree( build_dir, ignore_errors=True )
+
+    eprint( 'stored %d SMV files from %d days in %.1f s'
+            % ( nfiles, len( days ), time.time() - start ) )
+
+    if nfailed > 0:
+        eprint( nfailed, 'archives failed' )
+        sys.exit(2)
+
+# end tsstore.py
@@ -29,12 +29,36 @@ import sys
 import glob
 import time
 import getopt
+import shutil
+import fnmatch
 import datetime
+import subprocess
+
+import pipeline
+import wrfrestart
 
 # FIXME: consider making these arguments or env variables
 domain_dir = '/students/agrineer/wrf/sectors' 
 lock_dir = '/students/agrineer/wrf/log'
 out_dir = '/students/agrineer/wrf/output'
+scratch_dir = '/students/agrineer/wrf/scratch'   # <sector>/<YYYYMMDD>/wps, wrf
+
+# files a run writes in its wps, wrf directories; the sector's other
+# entries (geo_em files, tables, executables, namelist ORGs) are linked
+# into each run's scratch directories
+RUN_FILES = [ 'namelist.wps', 'namelist.wps.old', 'namelist.input',
+              'namelist.input.old', 'namelist.input.save', '*.log',
+              'GFS*', 'GRIBFILE*', 'FILE*', 'PFILE*', 'met_em.d0*',
+              'rsl.*', '*rsl.log', 'wrfout_d0*', 'wrfrst_d0*', 'wrfinput_d0*',
+              'wrfbdy_d0*', '*.part', 'link.sh' ]
+
+# wrf.exe restarts from its restart files in recovery mode (-i)
+RESTART_ATTEMPTS = 3
+
+# stages run at once; the WPS and WRF stages of a run are sequential,
+# runs of other dates, in their own scratch directories, and
+# run_wrfgfs.py's post processing run alongside
+jobs = 2
 
 #------------------------------------------------------------------
 
@@ -54,10 +78,20 @@ def print_and_exit( outstr ):
 
 # command line options
 def usage():
-    eprint('usage: wrfGFS.py -h -b hour -s sectorname -d datapath <-r date> ')
-    eprint('       wrfGFS.py --help --begin=hour --sector=sectorname --datadir=datapath <--rundate=date>')
+    eprint('usage: wrfGFS.py -h -i hours -b hour -s sectorname -d datapath <-r date> ')
+    eprint('       wrfGFS.py --help --interval=hours --begin=hour --sector=sectorname --datadir=datapath <--rundate=date>')
     eprint('       omitting rundate defaults to yesterday data')
     eprint('       begin hour is in UTC')
+    eprint('       runs in ' + scratch_dir + '/<sector>/<date>, so runs of')
+    eprint('       other dates of the sector can run at once')
+    eprint('       stages are recorded in ' + lock_dir + '/pipeline_<sector>_<date>.json')
+    eprint('       a rerun of a failed run resumes at the first WPS/WRF stage')
+    eprint('       whose outputs are missing or stale, see')
+    eprint('       ' + lock_dir + '/checkpoint_<sector>_<date>.json')
+    eprint('       --interval writes WRF restart files every hours; when')
+    eprint('       wrf.exe fails it is restarted from the newest complete')
+    eprint('       ones, up to %d times, and the history files are stitched'
+           % RESTART_ATTEMPTS )
   
 # NOTE:  if -b hour is not 06, 12, 18, 00; 
 #        ungrib.exe tries to interpolate input FILE:XXXXXXXX's but
@@ -69,11 +103,13 @@ def read_args( argv ):
     rundate = None
     begin = None
     datadir = None
+    interval = None
 
     try:                                
         opts, args = getopt.getopt( argv,
-                                    'hb:s:d:r:', 
-                                    ['help','begin=','sector=','datadir=','rundate='])
+                                    'hi:b:s:d:r:', 
+                                    ['help','interval=','begin=','sector=',
+                                     'datadir=','rundate='])
     except getopt.GetoptError: 
         eprint('unkown command arguments')
         usage()                          
@@ -87,6 +123,9 @@ def read_args( argv ):
         elif opt in ( '-s', '--sector' ):
             sector = arg  
 
+        elif opt in ( '-i', '--interval' ):
+            interval = read_interval( arg )
+
         elif opt in ( '-d', '--datadir' ):
             datadir = arg  
 
@@ -115,7 +154,22 @@ def read_args( argv ):
         usage()                     
         sys.exit( 2 )
 
-    return sector, rundate, begin, datadir
+    return sector, rundate, begin, datadir, interval
+
+# parse a restart interval, hours
+def read_interval( arg ):
+
+    try:
+        interval = int( arg )
+    except ValueError:
+        interval = 0
+
+    if interval < 1 or interval >= 24:
+        eprint('restart interval must be 1 to 23 hours.')
+        usage()
+        sys.exit( 2 )
+
+    return interval
 
 # return days to use from date
 def get_days( date ):
@@ -137,69 +191,52 @@ def get_days( date ):
 
     return yesterday, today
 
+
+# GFS files a run needs, yesterday's 00-18z and today's 00-06z analyses
+def gfs_files( gfs_dir, ystdir, tdydir ):
+
+    files = []
+    for hour in [ '00', '06', '12', '18' ]:
+        files.append( gfs_dir + '/' + ystdir + '/gfs.t' + hour + 'z.pgrb2.0p25.f000' )
+    for hour in [ '00', '06' ]:
+        files.append( gfs_dir + '/' + tdydir + '/gfs.t' + hour + 'z.pgrb2.0p25.f000' )
+
+    return files
+
 # check data files exists
 def check_data_exists( gfs_dir, ystdir, tdydir):
 
-    # yesterday's data
-    dir = gfs_dir + '/' + ystdir
-    if os.path.exists( dir ):
-        if not os.path.isfile( dir + '/gfs.t00z.pgrb2.0p25.f000' ):
-            print_and_exit( 'data missing for ' + 
-                            dir + ': gfs.t00z.pgrb2.0p25.f000' )
-        if not os.path.isfile( dir + '/gfs.t06z.pgrb2.0p25.f000' ):
-            print_and_exit( 'data missing for ' + 
-                            dir + ': gfs.t06z.pgrb2.0p25.f000' )
-        if not os.path.isfile( dir + '/gfs.t12z.pgrb2.0p25.f000' ):
-            print_and_exit( 'data missing for ' + 
-                            dir + ': gfs.t12z.pgrb2.0p25.f000' )
-        if not os.path.isfile( dir + '/gfs.t18z.pgrb2.0p25.f000' ):
-            print_and_exit( 'data missing for ' + 
-                            dir + ': gfs.t18z.pgrb2.0p25.f000' )
-    else :
-        print_and_exit( 'data directory missing for ' + dir )
-
-    # today's data
-    dir = gfs_dir + '/' + tdydir
-    if os.path.exists( dir ):
-        if not os.path.isfile( dir + '/gfs.t00z.pgrb2.0p25.f000' ):
-            print_and_exit( 'data missing for ' + 
-                            dir + ': gfs.t00z.pgrb2.0p25.f000' )
-        if not os.path.isfile( dir + '/gfs.t06z.pgrb2.0p25.f000' ):
-            print_and_exit( 'data missing for ' + 
-                            dir + ': gfs.t06z.pgrb2.0p25.f000' )
-    else :
-        print_and_exit( 'data directory missing for '+ dir )
+    for dir in [ gfs_dir + '/' + ystdir, gfs_dir + '/' + tdydir ]:
+        if not os.path.exists( dir ):
+            raise IOError( 'data directory missing for ' + dir )
 
-# remove old temp files
-def clean_wps_dir( sector_dir ):
+    for f in gfs_files( gfs_dir, ystdir, tdydir ):
+        if not os.path.isfile( f ):
+            raise IOError( 'data missing for ' + os.path.dirname( f ) +
+                           ': ' + os.path.basename( f ) )
 
-    # go to WPS dir
-    os.chdir( sector_dir + '/wps')
+# run a shell command in a directory, like os.system there
+def system( command, cwd ):
+    return subprocess.call( command, shell=True, cwd=cwd )
 
-    # must already be in WPS directory
+# remove old temp files
+def clean_wps_dir( wps_dir ):
 
-    for f in glob.glob( 'GFS*' ):
-        os.remove( f )
-    for f in glob.glob( 'GRIBFILE*' ):
-        os.remove( f )
-    for f in glob.glob( 'FILE*' ):
-        os.remove( f )
-    for f in glob.glob( 'met_em.d0*' ):
-        os.remove( f )
+    for pattern in [ 'GFS*', 'GRIBFILE*', 'FILE*', 'met_em.d0*' ]:
+        for f in glob.glob( wps_dir + '/' + pattern ):
+            os.remove( f )
 
 # create new namelist.wps file from ORG with this run's dates
-def new_wps_namelist( yesterday, today, begin ):
-
-    # must already be in WPS directory
+def new_wps_namelist( wps_dir, yesterday, today, begin ):
 
-    if os.path.isfile( 'namelist.wps.old' ):
-        os.remove( 'namelist.wps.old' )
+    if os.path.isfile( wps_dir + '/namelist.wps.old' ):
+        os.remove( wps_dir + '/namelist.wps.old' )
 
-    if os.path.isfile( 'namelist.wps' ):
-        os.rename( 'namelist.wps', 'namelist.wps.old' )
+    if os.path.isfile( wps_dir + '/namelist.wps' ):
+        os.rename( wps_dir + '/namelist.wps', wps_dir + '/namelist.wps.old' )
 
-    fin = open( 'namelist.wps.org', 'r' )
-    fout = open( 'namelist.wps', 'w' )
+    fin = open( wps_dir + '/namelist.wps.org', 'r' )
+    fout = open( wps_dir + '/namelist.wps', 'w' )
 
     format = '%Y-%m-%d_' + '%02d'%begin + ':00:00' # has to have colons for WRF
     sd = yesterday.strftime( format ) 
@@ -220,78 +257,120 @@ def new_wps_namelist( yesterday, today, begin ):
     fout.close()
     fin.close()
 
-def ungrib():
+# link the run's grib files as GRIBFILE.AAA, ...
+def link_grib( wps_dir, gfs_dir, ystdir, tdydir ):
+
+    ddir = gfs_dir + '/'
+    gdirs = ddir + ystdir + '/* ' + ddir + tdydir + '/* '
+    system( './link_grib.csh ' + gdirs, wps_dir ) # link gribfiles
+
+# check a program's log for its success line
+def check_log( path, success ):
+
+    if not os.path.isfile( path ):
+        return False
+
+    fin = open( path, 'r' )
+    for line in fin:
+        if line.find( success ) != -1:
+            eprint( line )        # found
+            fin.close()
+            return True
+    fin.close()
+
+    return False
+
+def ungrib( wps_dir ):
 
     # assume geogrid.exe has been run
 
     # check for previous ungrib log
-    if os.path.isfile( 'ungrib.log' ):
-        os.remove( 'ungrib.log' )
+    if os.path.isfile( wps_dir + '/ungrib.log' ):
+        os.remove( wps_dir + '/ungrib.log' )
 
     # ungrib and check results
-    status = os.system( './ungrib.exe' )
-    if status == 0:
-
-        fin = open( 'ungrib.log', 'r' )
-        for line in fin:
-            if line.find( 'Successful completion of program ungrib.exe') != -1:
-                eprint( line )        # found
-                fin.close()
-                return
-        fin.close()
+    status = system( './ungrib.exe', wps_dir )
+    if status == 0 and \
+       check_log( wps_dir + '/ungrib.log',
+                  'Successful completion of program ungrib.exe' ):
+        return
 
     # not found
-    ostr='UNSuccessful completion of program ungrib.exe, check ungrib.log file'
-    print_and_exit( ostr )
+    raise IOError( 'UNSuccessful completion of program ungrib.exe, check ungrib.log file' )
 
 # run metgrid
-def metgrid():
+def metgrid( wps_dir ):
 
     # check for previous metgrid log
-    if os.path.isfile( 'metgrid.log' ):
-        os.remove( 'metgrid.log' )
-
-    status = os.system( './metgrid.exe' )
-    if status == 0:
-        fin = open( 'metgrid.log', 'r' )
-        for line in fin:
-            if line.find('Successful completion of program metgrid.exe' ) != -1:
-                eprint( line )
-                fin.close()
-                return
-        fin.close()
+    if os.path.isfile( wps_dir + '/metgrid.log' ):
+        os.remove( wps_dir + '/metgrid.log' )
+
+    status = system( './metgrid.exe', wps_dir )
+    if status == 0 and \
+       check_log( wps_dir + '/metgrid.log',
+                  'Successful completion of program metgrid.exe' ):
+        return
 
     # not found
-    ostr = 'UNSuccessful completion of program metgrid.exe, check metgrid.log file'
-    print_and_exit( ostr )
+    raise IOError( 'UNSuccessful completion of program metgrid.exe, check metgrid.log file' )
+
+# start of a run on a day, datetime
+def run_start( day, begin ):
+    return datetime.datetime( day.year, day.month, day.day, begin )
 
-# create namelist from ORG with this run's dates
-def new_namelist( yesterday, today, begin ):
+# create namelist from ORG with this run's dates;
+# with interval write restart files every interval hours,
+# with restart (a datetime) restart the run from then
+def new_namelist( wrf_dir, yesterday, today, begin, interval=None,
+                  restart=None ):
+
+    start = run_start( yesterday, begin )
+    if restart != None:
+        start = restart
+    end = run_start( today, begin )
+    hours = int( ( end - start ).total_seconds() ) // 3600
 
     # edit namelist.input.ORG
-    syr = yesterday.strftime( '%Y, ' )
-    smn = yesterday.strftime( '%m, ' )
-    sdy = yesterday.strftime( '%d, ' )
-    shr = '%02d'%begin + ', '
+    syr = start.strftime( '%Y, ' )
+    smn = start.strftime( '%m, ' )
+    sdy = start.strftime( '%d, ' )
+    shr = start.strftime( '%H, ' )
 
     eyr = today.strftime( '%Y, ' )
     emn = today.strftime( '%m, ' )
     edy = today.strftime( '%d, ' )
-    ehr = shr
+    ehr = '%02d'%begin + ', '
+
+    # namelist entries set for recovery, added to &time_control if
+    # the ORG file lacks them
+    entries = {}
+    if interval != None:
+        entries['restart_interval'] = ' restart_interval = %d,\n' % ( 60*interval )
+    if restart != None:
+        entries['restart'] = ' restart = .true.,\n'
 
-    if os.path.isfile( 'namelist.input.old' ) :
-        os.remove( 'namelist.input.old' )
+    if os.path.isfile( wrf_dir + '/namelist.input.old' ) :
+        os.remove( wrf_dir + '/namelist.input.old' )
 
-    if os.path.isfile( 'namelist.input' ) :
-        os.rename( 'namelist.input','namelist.input.old' )
+    if os.path.isfile( wrf_dir + '/namelist.input' ) :
+        os.rename( wrf_dir + '/namelist.input',
+                   wrf_dir + '/namelist.input.old' )
 
-    fin = open( 'namelist.input.org', 'r' )
-    fout = open( 'namelist.input', 'w' )
+    fin = open( wrf_dir + '/namelist.input.org', 'r' )
+    fout = open( wrf_dir + '/namelist.input', 'w' )
 
     #FIXME: depends on num of sectors
     for line in fin :
-        if line.find( 'run_hours' ) != -1 :
-            fout.write( ' run_hours = 24,\n' )
+        key = line.split( '=' )[0].strip()
+        if key in entries :
+            fout.write( entries.pop( key ) )
+        elif line.strip().lower() == '&time_control' :
+            fout.write( line )
+            for key in list( entries ) :
+                if not key_in_file( wrf_dir + '/namelist.input.org', key ):
+                    fout.write( entries.pop( key ) )
+        elif line.find( 'run_hours' ) != -1 :
+            fout.write( ' run_hours = %d,\n' % hours )
         elif line.find( 'start_year' ) != -1 :
             fout.write( ' start_year = ' + syr + syr + syr + '\n' )
         elif line.find( 'start_month' ) != -1 :
@@ -318,67 +397,75 @@ def new_namelist( yesterday, today, begin ):
     fout.close()
     fin.close()
 
-def clean_wrf_dir( sector_dir, rsl ):
+# does a namelist file set key
+def key_in_file( path, key ):
 
-    # go to WRF dir
-    os.chdir( sector_dir + '/wrf')
+    with open( path, 'r' ) as f:
+        for line in f:
+            if line.split( '=' )[0].strip() == key:
+                return True
 
-    # remove old status files
-    for f in glob.glob( 'rsl.out*' ):
-        os.remove( f )
+    return False
 
+def clean_wrf_dir( wrf_dir, rsl ):
+
+    # remove old status files
+    patterns = [ 'rsl.out*' ]
     if ( rsl ):
-        for f in glob.glob( 'rsl.error.*' ):
-            os.remove( f )
+        patterns.append( 'rsl.error.*' )
 
     # remove any old output files
-    for f in glob.glob( 'wrfout_d0*' ):
-        os.remove( f )
-
-    for f in glob.glob( 'met_em.d0*' ):
-        os.remove( f )
+    patterns += [ 'wrfout_d0*', 'wrfrst_d0*', 'met_em.d0*', 'wrfbdy_d0*',
+                  'wrfinput_d0*', '*rsl.log' ]
 
-    for f in glob.glob( 'wrfbdy_d0*' ):
-        os.remove( f )
-
-    for f in glob.glob( 'wrfinput_d0*' ):
-        os.remove( f )
+    for pattern in patterns:
+        for f in glob.glob( wrf_dir + '/' + pattern ):
+            os.remove( f )
 
-    for f in glob.glob( '*rsl.log' ):
-        os.remove( f )
+# link metgrid's output into the WRF directory
+def link_met_em( wps_dir, wrf_dir ):
 
-def run_real():
+    for f in sorted( glob.glob( wps_dir + '/met_em.d0*' ) ):
+        os.symlink( os.path.relpath( f, wrf_dir ),
+                    wrf_dir + '/' + os.path.basename( f ) )
 
-    status = os.system( './real.exe' )
-    if status == 0:
-        fin = open( 'rsl.out.0000', 'r' )
-        for line in fin :
-            if line.find( 'SUCCESS COMPLETE REAL_EM' ) != -1:
-                eprint( line )  # found
-                fin.close()
-                return
+def run_real( wrf_dir ):
 
-        fin.close()
+    status = system( './real.exe', wrf_dir )
+    if status == 0 and \
+       check_log( wrf_dir + '/rsl.out.0000', 'SUCCESS COMPLETE REAL_EM' ):
+        return
 
-    ostr = 'UNSuccessful completion of program real.exe, check rsl.error.0000'
-    print_and_exit( ostr )
+    raise IOError( 'UNSuccessful completion of program real.exe, check rsl.error.0000' )
     
-def run_wrf( ystdir ):
+# with clean False the history and restart files of an earlier
+# attempt are kept, for a restart
+def run_wrf( wrf_dir, ystdir, clean=True ):
 
     nnodes = 2              # slurm implementation
     ntasks = 4
     ncores = nnodes*ntasks  # mpich implementation
 
+    # remove the status and output files of an earlier attempt;
+    # its inputs are kept, real.exe may not have rerun
+    patterns = [ 'rsl.out*', 'rsl.error.*', '*rsl.log' ]
+    if clean:
+        patterns += [ 'wrfout_d0*', 'wrfrst_d0*' ]
+    for pattern in patterns:
+        for f in glob.glob( wrf_dir + '/' + pattern ):
+            os.remove( f )
+
     # now run wrf.exe
-    #os.system( 'salloc -N %d --exclude=imbabura0086 --ntasks-per-node %d /usr/bin/mpiexec ./wrf.exe'%(nnodes,ntasks) )
-    os.system( 'salloc -N %d --ntasks-per-node %d /usr/bin/mpiexec ./wrf.exe'%(nnodes,ntasks) )
-    #os.system( '/usr/bin/mpiexec -hostfile /home/agrineer/mpd.hosts -n %d ./wrf.exe'%ncores )
+    #system( 'salloc -N %d --exclude=imbabura0086 --ntasks-per-node %d /usr/bin/mpiexec ./wrf.exe'%(nnodes,ntasks), wrf_dir )
+    system( 'salloc -N %d --ntasks-per-node %d /usr/bin/mpiexec ./wrf.exe'%(nnodes,ntasks), wrf_dir )
+    #system( '/usr/bin/mpiexec -hostfile /home/agrineer/mpd.hosts -n %d ./wrf.exe'%ncores, wrf_dir )
     
     # gather success reports into file
-    os.system( 'grep "SUCCESS COMPLETE WRF" rsl.error.* > '+ystdir+ 'rsl.log' )
+    system( 'grep "SUCCESS COMPLETE WRF" rsl.error.* > '+ystdir+ 'rsl.log',
+            wrf_dir )
 
     # should see SUCCESS from each core, just count
-    fin = open( ystdir + 'rsl.log', 'r' )
+    fin = open( wrf_dir + '/' + ystdir + 'rsl.log', 'r' )
  
     # check each line, ignore artifacts if any
     nfound = 0              # number of found successes
@@ -388,101 +475,292 @@ def run_wrf( ystdir ):
     fin.close()
  
     if nfound != ncores:
-        ostr = 'UNsuccessful completion of program wrf.exe ' + \
-               datetime.datetime.now().isoformat()
-        print_and_exit( ostr )
+        raise IOError( 'UNsuccessful completion of program wrf.exe ' +
+                       datetime.datetime.now().isoformat() )
 
     ostr = 'Successful completion of program wrf.exe ' + \
            datetime.datetime.now().isoformat()
     
     eprint( ostr )
 
-#####################################################################
+# run wrf.exe writing restart files; on failure restart it from the
+# newest whole set of restart files, then stitch the history files
+# into one per domain
+def run_wrf_recover( wrf_dir, ystdir, yesterday, today, begin, interval,
+                     attempts=RESTART_ATTEMPTS ):
 
-# Program start
+    start = run_start( yesterday, begin )
+    end = run_start( today, begin )
+    ndomains = len( glob.glob( wrf_dir + '/wrfinput_d0*' ) )
 
-# get domain sector, run date, begin hour, and input data dir
-sector, rundate, begin, gfs_dir = read_args( sys.argv[1:] ) 
-yesterday,today = get_days( rundate )     # parse dates from run date
+    # restart files left by an earlier invocation are used too
+    attempt = 0
+    while True:
+        attempt += 1
+        restart = wrfrestart.newest_restart( wrf_dir, ndomains, start, end )
+
+        try:
+            if restart == None:
+                run_wrf( wrf_dir, ystdir )
+            else:
+                eprint( 'restarting wrf.exe from ' +
+                        restart.strftime( wrfrestart.TIME_FORMAT ) )
+
+                # real.exe's namelist is put back after, as it was
+                os.replace( wrf_dir + '/namelist.input',
+                            wrf_dir + '/namelist.input.save' )
+                try:
+                    new_namelist( wrf_dir, yesterday, today, begin, interval,
+                                  restart )
+                    run_wrf( wrf_dir, ystdir, False )
+                finally:
+                    os.replace( wrf_dir + '/namelist.input.save',
+                                wrf_dir + '/namelist.input' )
+            break
+
+        except IOError as e:
+            if attempt >= attempts:
+                raise
+            eprint( str( e ) + ', attempt %d of %d' % ( attempt, attempts ) )
+
+    wrfrestart.stitch( wrf_dir, start )
+
+# store output files, then do file housekeeping
+def store_output( wps_dir, wrf_dir, out ):
+
+    if not os.path.exists( out ):
+        os.makedirs( out )
+
+    for f in glob.glob( wrf_dir + '/wrfout_d0*' ):
+        shutil.move( f, out + '/' + os.path.basename( f ) )
+
+    clean_wps_dir( wps_dir )
+    clean_wrf_dir( wrf_dir, False ) # False retains rsl.error files
+                                    # for later inspection
+    unlink_sector( wps_dir )
+    unlink_sector( wrf_dir )
+
+# a run's scratch wps and wrf directories
+def run_dirs( sector, ystdir ):
+
+    run_dir = scratch_dir + '/' + sector + '/' + ystdir
+    return run_dir + '/wps', run_dir + '/wrf'
+
+# is a wps, wrf directory entry written by a run
+def run_file( name ):
+    return any( fnmatch.fnmatch( name, p ) for p in RUN_FILES )
+
+# link the static entries of a sector directory into a run's scratch
+# directory, like link.sh; existing entries are left
+def link_sector( src, dst ):
+
+    if not os.path.isdir( src ):
+        raise IOError( 'no sector directory: ' + src )
+
+    os.makedirs( dst, exist_ok=True )
+    for name in sorted( os.listdir( src ) ):
+        if run_file( name ) or os.path.lexists( dst + '/' + name ):
+            continue
+        os.symlink( src + '/' + name, dst + '/' + name )
+
+# remove the links to a sector directory from a scratch directory,
+# leaving the run's namelists and logs
+def unlink_sector( dst ):
+
+    for name in os.listdir( dst ):
+        if not run_file( name ) and os.path.islink( dst + '/' + name ):
+            os.remove( dst + '/' + name )
+
+def make_scratch( sector, wps_dir, wrf_dir ):
+
+    link_sector( domain_dir + '/' + sector + '/wps', wps_dir )
+    link_sector( domain_dir + '/' + sector + '/wrf', wrf_dir )
+
+# the stages of a run
+
+def prepare_wps( wps_dir, gfs_dir, yesterday, today, begin ):
+
+    ystdir = yesterday.strftime( "%Y%m%d" )
+    tdydir = today.strftime( "%Y%m%d" )
+
+    # do file housekeeping in case of earlier abort
+    clean_wps_dir( wps_dir )
+    new_wps_namelist( wps_dir, yesterday, today, begin )
+    link_grib( wps_dir, gfs_dir, ystdir, tdydir )
+
+def prepare_real( wps_dir, wrf_dir, yesterday, today, begin, interval ):
+
+    clean_wrf_dir( wrf_dir, True )
+    link_met_em( wps_dir, wrf_dir )
+    new_namelist( wrf_dir, yesterday, today, begin, interval )
+    run_real( wrf_dir )
+
+## add the stages of a WPS/WRF run on a sector to a pipeline.pipeline;
+## they are named <YYYYMMDD>/<stage>. The run's scratch directories
+## are linked first, see run_dirs. The WPS, real and WRF stages are
+## resumable, keyed by the GFS files, namelists, executables and dates
+## @param after - stages the first one waits for
+## @param store_after - stages the store stage waits for, eg. ones
+##                      reading the wrfout files while WRF writes them
+## @param interval - hours between restart files, None to run wrf.exe
+##                   without recovery
+## @return name of the last stage, which stores the wrfout files in
+##         out_dir/<sector>/<YYYYMMDD>
+def add_stages( pipe, sector, yesterday, today, begin, gfs_dir,
+                after=(), store_after=(), interval=None ):
+
+    ystdir = yesterday.strftime( "%Y%m%d" )
+    tdydir = today.strftime( "%Y%m%d" )
+
+    wps_dir, wrf_dir = run_dirs( sector, ystdir )
+    out = out_dir + '/' + sector + '/' + ystdir
+    prefix = ystdir + '/'
+
+    met_em = wps_dir + '/met_em.d0*'
+    inputs = [ wrf_dir + '/namelist.input', wrf_dir + '/wrfinput_d01',
+               wrf_dir + '/wrfbdy_d01' ]
+    dates = ( ystdir, tdydir, begin )
+
+    pipe.add( pipeline.stage( prefix + 'scratch',
+                              lambda: make_scratch( sector, wps_dir, wrf_dir ),
+                              after=after ) )
+
+    pipe.add( pipeline.stage( prefix + 'wps',
+                              lambda: prepare_wps( wps_dir, gfs_dir,
+                                                   yesterday, today, begin ),
+                              inputs=gfs_files( gfs_dir, ystdir, tdydir ),
+                              outputs=[ wps_dir + '/namelist.wps',
+                                        wps_dir + '/GRIBFILE.AAA' ],
+                              after=[ prefix + 'scratch' ], resume=True,
+                              depends=[ wps_dir + '/namelist.wps.org',
+                                        wps_dir + '/link_grib.csh' ],
+                              params=dates ) )
+
+    pipe.add( pipeline.stage( prefix + 'ungrib', lambda: ungrib( wps_dir ),
+                              inputs=[ wps_dir + '/namelist.wps',
+                                       wps_dir + '/GRIBFILE.AAA' ],
+                              outputs=[ wps_dir + '/FILE:*' ], resume=True,
+                              depends=[ wps_dir + '/ungrib.exe',
+                                        wps_dir + '/Vtable' ] ) )
+
+    pipe.add( pipeline.stage( prefix + 'metgrid', lambda: metgrid( wps_dir ),
+                              inputs=[ wps_dir + '/FILE:*' ],
+                              outputs=[ met_em ], resume=True,
+                              depends=[ wps_dir + '/metgrid.exe',
+                                        wps_dir + '/geo_em.d0*',
+                                        wps_dir + '/metgrid/METGRID.TBL' ] ) )
+
+    pipe.add( pipeline.stage( prefix + 'real',
+                              lambda: prepare_real( wps_dir, wrf_dir,
+                                                    yesterday, today, begin,
+                                                    interval ),
+                              inputs=[ met_em ],
+                              outputs=inputs, resume=True,
+                              depends=[ wrf_dir + '/namelist.input.org',
+                                        wrf_dir + '/real.exe' ],
+                              params=dates + ( interval, ) ) )
+
+    run = lambda: run_wrf( wrf_dir, ystdir )
+    if interval != None:
+        run = lambda: run_wrf_recover( wrf_dir, ystdir, yesterday, today,
+                                       begin, interval )
+
+    pipe.add( pipeline.stage( prefix + 'wrf', run,
+                              inputs=inputs,
+                              outputs=[ wrf_dir + '/wrfout_d0*' ], resume=True,
+                              depends=[ wrf_dir + '/wrf.exe' ] ) )
+
+    pipe.add( pipeline.stage( prefix + 'store',
+                              lambda: store_output( wps_dir, wrf_dir, out ),
+                              inputs=[ wrf_dir + '/wrfout_d0*' ],
+                              outputs=[ out + '/wrfout_d0*' ],
+                              after=store_after ) )
+
+    return prefix + 'store'
+
+# lock file of a run of a date of a sector
+def lock_path( sector, ystdir ):
+    return lock_dir + '/running_' + sector + '_' + ystdir + '.lock'
+
+# if not already running wrf on these dates of the sector then set
+# their lock files, one per date; returns { date:lock file's path }
+def set_lock( sector, dates ):
+
+    lockpaths = {}
+    for ystdir in dates:
+
+        # check for previous run; created exclusively, runs of the
+        # same sector may start at once
+        lockpath = lock_path( sector, ystdir )
+        try:
+            os.close( os.open( lockpath, os.O_CREAT | os.O_EXCL | os.O_WRONLY ) )
+        except OSError:
+            for path in lockpaths.values():
+                os.remove( path )
+            if os.path.isfile( lockpath ) :
+                print_and_exit('wrf already running or crashed on ' +
+                               sector + ' ' + ystdir + '.')
+            print_and_exit( 'unable to set lock file, exiting...' )
+
+        lockpaths[ystdir] = lockpath
+
+    return lockpaths
+
+# name of a run of one or more dates of a sector, eg. ANDES_03_20220501
+# or ANDES_03_20220501-20220507
+def run_name( sector, dates ):
+    return sector + '_' + '-'.join( sorted( set( [ dates[0], dates[-1] ] ) ) )
+
+# stage status file of a run
+def state_path( sector, dates ):
+    return lock_dir + '/pipeline_' + run_name( sector, dates ) + '.json'
+
+# stage checkpoint file of a run; a rerun of the same dates resumes
+def checkpoint_path( sector, dates ):
+    return lock_dir + '/checkpoint_' + run_name( sector, dates ) + '.json'
 
-# use these data directories
-ystdir = yesterday.strftime( "%Y%m%d" )
-tdydir = today.strftime( "%Y%m%d" )
-sector_dir = domain_dir + '/' + sector
-
-check_data_exists( gfs_dir, ystdir, tdydir ) # see if data is there
-
-# if not already running wrf on this sector then set lock file
-
-# check for previous run
-lockpath = lock_dir + '/running_' + sector + '.lock'
-if os.path.isfile( lockpath ) :
-    print_and_exit('wrf already running or crashed.')
-else :
-    try:
-        lockfile = open( lockpath,'w' )
-    except:
-        print_and_exit( 'unable to set lock file, exiting...' )
-
-# do file housekeeping in case of earlier abort
-clean_wps_dir( sector_dir )
-clean_wrf_dir( sector_dir, True )
-
-# start processing
-ostr = 'Starting run at ' + datetime.datetime.now().isoformat()
-eprint( ostr )
-
-ostr = 'Using input data directory: ' + gfs_dir
-eprint( ostr )
-
-ostr = 'Running wps/wrf on ' + sector + ' for ' + ystdir + '.'
-eprint( ostr )
+#####################################################################
 
-ostr = ' Changing directory to: ' + sector_dir + '/wps'
-eprint( ostr )
+if __name__ == '__main__':
 
-os.chdir( sector_dir + '/wps' )
-new_wps_namelist( yesterday, today, begin )
+    # get domain sector, run date, begin hour, and input data dir
+    sector, rundate, begin, gfs_dir, interval = read_args( sys.argv[1:] ) 
+    yesterday,today = get_days( rundate )     # parse dates from run date
 
-ddir = gfs_dir + '/'
-gdirs = ddir + ystdir + '/* ' + ddir + tdydir + '/* '
-os.system( './link_grib.csh ' + gdirs ) # link gribfiles
+    # use these data directories
+    ystdir = yesterday.strftime( "%Y%m%d" )
+    tdydir = today.strftime( "%Y%m%d" )
 
-# ready to run wps routines
-eprint( 'running ungrib...' )
-ungrib()
+    try:
+        check_data_exists( gfs_dir, ystdir, tdydir ) # see if data is there
+    except IOError as e:
+        print_and_exit( str( e ) )
 
-eprint( 'running metgrid...' )
-metgrid()
+    lockpaths = set_lock( sector, [ ystdir ] )
 
-ostr = 'Changing directory to: ' + sector_dir + '/wrf'
-eprint( ostr )
+    # start processing
+    ostr = 'Starting run at ' + datetime.datetime.now().isoformat()
+    eprint( ostr )
 
-os.chdir( '../wrf' )
-os.system( 'ln -s ../wps/met_em.d0* .' ) 
-new_namelist( yesterday, today, begin )
+    ostr = 'Using input data directory: ' + gfs_dir
+    eprint( ostr )
 
-eprint( 'running real.exe...' )
-run_real()
+    ostr = 'Running wps/wrf on ' + sector + ' for ' + ystdir + '.'
+    eprint( ostr )
 
-eprint( 'running wrf.exe...' )
-run_wrf( ystdir )
+    pipe = pipeline.pipeline( state_path( sector, [ ystdir ] ), jobs,
+                              checkpoint_path( sector, [ ystdir ] ) )
+    add_stages( pipe, sector, yesterday, today, begin, gfs_dir,
+                interval=interval )
 
-# store output files 
-out = out_dir + '/' + sector + '/' + ystdir 
-if not os.path.exists( out ):
-    os.makedirs( out )
+    # the lock is left on failure, see run_wrf
+    if not pipe.run():
+        print_and_exit( 'stages failed: ' + ', '.join( pipe.failed() ) )
 
-os.system( 'mv wrfout_d0* ' + out )
+    ostr = 'Run complete ' + datetime.datetime.now().isoformat()
+    eprint( ostr )
 
-# do file housekeeping
-clean_wps_dir( sector_dir )
-clean_wrf_dir( sector_dir, False ) # False retains rsl.error files
-                                   # for later inspection
-                                   
-ostr = 'Run complete ' + datetime.datetime.now().isoformat()
-eprint( ostr )
+    # remove lock file
+    os.remove( lockpaths[ystdir] )
 
-# remove lock file
-lockfile.close()
-os.remove( lockpath )
+# end wrfGFS.py
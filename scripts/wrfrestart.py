@@ -0,0 +1,201 @@
+#  wrfrestart.py
+#
+#  Copyright (c) 2026 agent
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#  or visit https://www.gnu.org/licenses/gpl-3.0-standalone.html
+#
+wrfrestart_copyright = 'wrfrestart.py Copyright (c) 2026 agent ' + \
+                       'released under GNU GPL V3.0'
+
+import os
+import sys
+import glob
+import datetime
+
+from netCDF4 import Dataset
+
+import tarindex
+
+## @file      wrfrestart.py
+## @brief     WRF restart recovery helpers for wrfGFS.py: find the newest
+##            complete set of wrfrst files and stitch the history files
+##            of a restarted run into one file per domain.
+## @author    agent
+## @copyright Copyright (c) 2026 agent. All Rights Reserved.
+## @license   Released under GNU General Public License V3.0
+
+# wrf.exe writes wrfrst_dNN_<time> every restart_interval minutes. A
+# restart from <time> writes its history to new wrfout_dNN_<time> files;
+# the frames of the first file after <time> were written by the failed
+# run. Stitching keeps, for each time, the frame of the latest file.
+
+# print functions to reduce clutter and to flush output
+def eprint( *args ):
+    print( *args, file=sys.stderr, flush=True)
+
+def oprint( *args ):
+    print( *args, file=sys.stdout, flush=True)
+
+# WRF file name time format
+TIME_FORMAT = '%Y-%m-%d_%H:%M:%S'
+
+# time of a WRF file name, eg. wrfrst_d01_2022-05-01_12:00:00
+def file_time( path ):
+    return datetime.datetime.strptime( os.path.basename( path )[11:30],
+                                       TIME_FORMAT )
+
+# times of a WRF file's frames, as strings
+def frame_times( ds ):
+    return [ b''.join( t ).decode( 'utf-8' )
+             for t in ds.variables['Times'][:] ]
+
+# is a restart file whole: a netCDF classic file as long as its header
+# says, or a readable NETCDF4 one, holding the time of its name
+def valid_restart( path ):
+
+    size = os.path.getsize( path )
+    head = b''
+    layout = None
+    with open( path, 'rb' ) as f:
+        while len( head ) < size:
+            head += f.read( max( len( head ), 1024*1024 ) )
+            try:
+                layout = tarindex.nc_layout( head, size )
+                break
+            except tarindex.truncated:
+                continue
+
+    if layout != None:
+        end = 0
+        records = []
+        for v in layout['variables'].values():
+            if v['record']:
+                records.append( v['begin'] )
+            else:
+                end = max( end, v['begin'] + tarindex.slab_bytes( v ) )
+        if len( records ) > 0:
+            end = max( end, min( records ) +
+                            layout['numrecs']*layout['recsize'] )
+        if size < end:
+            return False
+
+    try:
+        ds = Dataset( path, 'r' )
+        try:
+            times = frame_times( ds )
+        finally:
+            ds.close()
+    except ( OSError, KeyError, IndexError, UnicodeDecodeError ):
+        return False
+
+    return file_time( path ).strftime( TIME_FORMAT ) in times
+
+## newest time with a whole restart file for each domain
+## @param ndomains - domains of the run
+## @param start, end - the run's start and end, datetime; restart times
+##                     are strictly between them
+## @return datetime or None
+def newest_restart( wrf_dir, ndomains, start, end ):
+
+    times = {}
+    for path in glob.glob( wrf_dir + '/wrfrst_d0*' ):
+        try:
+            t = file_time( path )
+        except ValueError:
+            continue
+        times.setdefault( t, [] ).append( path )
+
+    for t in sorted( times, reverse=True ):
+        if not start < t < end or len( times[t] ) != ndomains:
+            continue
+        if all( valid_restart( path ) for path in times[t] ):
+            return t
+
+    return None
+
+## stitch each domain's wrfout files in wrf_dir into the run's file,
+## wrfout_dNN_<start>; frames are taken from the latest file having them
+## @param start - the run's start, datetime
+def stitch( wrf_dir, start ):
+
+    domains = sorted( set( os.path.basename( p )[:10] for p in
+                           glob.glob( wrf_dir + '/wrfout_d0*' )
+                           if not p.endswith( '.part' ) ) )
+
+    for domain in domains:
+
+        files = sorted( p for p in glob.glob( wrf_dir + '/' + domain + '_*' )
+                        if not p.endswith( '.part' ) )
+        target = wrf_dir + '/' + domain + '_' + start.strftime( TIME_FORMAT )
+        if len( files ) < 2:
+            continue
+        if files[0] != target:
+            raise IOError( 'no history file from the run start: ' + target )
+
+        sources = [ Dataset( f, 'r' ) for f in files ]
+        try:
+            for ds in sources:
+                ds.set_auto_maskandscale( False )
+
+            # time: ( file, frame ), later files replacing earlier ones
+            frames = {}
+            for i, ds in enumerate( sources ):
+                for j, t in enumerate( frame_times( ds ) ):
+                    frames[t] = ( i, j )
+            order = [ frames[t] for t in sorted( frames ) ]
+
+            eprint( 'stitching', len( files ), domain, 'files,',
+                    len( order ), 'frames.' )
+            write_stitched( target + '.part', sources, order )
+
+        finally:
+            for ds in sources:
+                ds.close()
+
+        os.replace( target + '.part', target )
+        for f in files[1:]:
+            os.remove( f )
+
+# write the frames ( source, frame ) of the sources into one file shaped
+# like the first
+def write_stitched( path, sources, order ):
+
+    first = sources[0]
+    out = Dataset( path, 'w', format=first.data_model )
+    out.set_auto_maskandscale( False )
+    out.setncatts( first.__dict__ )
+
+    for name, dim in first.dimensions.items():
+        out.createDimension( name, None if dim.isunlimited() else len( dim ) )
+
+    for name, var in first.variables.items():
+        attrs = var.__dict__
+        ovar = out.createVariable( name, var.dtype, var.dimensions,
+                                   fill_value=attrs.get( '_FillValue' ) )
+        ovar.setncatts( { k:v for k, v in attrs.items()
+                          if k != '_FillValue' } )
+
+    for name, var in first.variables.items():
+        if len( var.dimensions ) == 0 or var.dimensions[0] != 'Time':
+            out.variables[name][:] = var[:]
+            continue
+
+        for k, ( i, j ) in enumerate( order ):
+            out.variables[name][k] = sources[i].variables[name][j]
+
+    out.close()
+
+# end wrfrestart.py